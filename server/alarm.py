@@ -0,0 +1,442 @@
+"""
+告警分发 - 推理线程不等待任何通知
+推理线程只把检测结果追加到无锁的双端队列（deque 的 append/popleft 是原子操作），
+告警线程负责确认、合并和分发：
+
+- 确认：同一摄像头同一类别在 CONFIRM_WINDOW 秒内至少 CONFIRM_FRAMES 次推理检出，才算一次告警，单帧误检不报警
+- 合并：告警持续期间的重复检出只更新同一事件（次数、最高置信度），不重复通知；
+  超过 CLEAR_AFTER 秒没有检出则事件结束，发送解除通知；持续时间较长时每 REMIND_INTERVAL 秒提醒一次
+- 分发：每条通知并发发给所有通知渠道（日志、Webhook、声光报警 GPIO 等）。每个渠道有自己的发送线程和队列，
+  按顺序发送、从开始发送起独立计算超时；慢渠道只积压自己的队列，不影响其他渠道，也不阻塞告警线程
+
+通知渠道用 ALARM_WEBHOOK_URL（逗号分隔多个地址）和 ALARM_GPIO_PIN 配置，也可以调用 add_sink() 注册。
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 触发告警的类别
+ALARM_CLASSES = ('fire', 'smoke')
+# 确认窗口（秒）及窗口内至少检出的推理次数
+CONFIRM_WINDOW = float(os.getenv('ALARM_CONFIRM_WINDOW', '2'))
+CONFIRM_FRAMES = int(os.getenv('ALARM_CONFIRM_FRAMES', '3'))
+# 超过这个时间（秒）没有检出，告警结束
+CLEAR_AFTER = float(os.getenv('ALARM_CLEAR_AFTER', '15'))
+# 告警持续期间的提醒间隔（秒），0 为不提醒
+REMIND_INTERVAL = float(os.getenv('ALARM_REMIND_INTERVAL', '300'))
+# 每个通知渠道的默认超时（秒）
+SINK_TIMEOUT = 5.0
+# 待处理检测结果上限（告警线程跟不上时丢弃最旧的）
+QUEUE_SIZE = 256
+# 每个通知渠道待发送通知上限（渠道卡住时丢弃最旧的）
+SINK_QUEUE_SIZE = 32
+# 保留最近结束的告警事件数
+HISTORY_SIZE = 50
+
+
+# --- 通知渠道 ---
+
+class AlarmSink:
+    """通知渠道基类：send() 在该渠道自己的发送线程中按顺序执行，开始发送后超过 timeout 秒视为超时"""
+    name = 'sink'
+
+    def __init__(self, timeout=SINK_TIMEOUT):
+        self.timeout = timeout
+        self.sent = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.dropped = 0
+        self.last_error = None
+        self.last_latency_ms = None
+
+    def send(self, notification):
+        raise NotImplementedError
+
+    def status(self):
+        return {
+            'name': self.name,
+            'timeout': self.timeout,
+            'sent': self.sent,
+            'failed': self.failed,
+            'timed_out': self.timed_out,
+            'dropped': self.dropped,
+            'last_latency_ms': self.last_latency_ms,
+            'last_error': self.last_error,
+        }
+
+
+class LogSink(AlarmSink):
+    """写日志（每次告警一条，而不是每帧每个检测框一条）"""
+    name = 'log'
+
+    def send(self, notification):
+        incident = notification['incident']
+        if notification['type'] == 'resolved':
+            logging.info(
+                f"✅ 告警解除 [{incident['camera']}] {incident['class']}，"
+                f"持续 {incident['last_seen'] - incident['started']:.0f} 秒，检出 {incident['detections']} 次"
+            )
+        else:
+            icon = '🔥' if incident['class'] == 'fire' else '💨'
+            logging.warning(
+                f"{icon} {'告警' if notification['type'] == 'raised' else '告警持续'} "
+                f"[{incident['camera']}] {incident['class']}，最高置信度 {incident['max_confidence']:.2f}"
+            )
+
+
+class WebhookSink(AlarmSink):
+    """POST JSON 到 Webhook（短信网关、IM 机器人等）"""
+
+    def __init__(self, url, timeout=SINK_TIMEOUT):
+        super().__init__(timeout)
+        self.url = url
+        self.name = f'webhook:{url}'
+
+    def send(self, notification):
+        body = json.dumps(notification, ensure_ascii=False).encode('utf-8')
+        request = urllib.request.Request(
+            self.url, data=body, headers={'Content-Type': 'application/json'}, method='POST'
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as resp:
+            resp.read()
+
+
+class GPIOSink(AlarmSink):
+    """声光报警器（sysfs GPIO）：告警时拉高，解除时拉低"""
+
+    def __init__(self, pin, timeout=1.0):
+        super().__init__(timeout)
+        self.pin = pin
+        self.name = f'gpio:{pin}'
+        self.path = f'/sys/class/gpio/gpio{pin}/value'
+        if not os.path.exists(self.path):
+            with open('/sys/class/gpio/export', 'w') as f:
+                f.write(str(pin))
+            with open(f'/sys/class/gpio/gpio{pin}/direction', 'w') as f:
+                f.write('out')
+
+    def send(self, notification):
+        with open(self.path, 'w') as f:
+            f.write('0' if notification['active'] == 0 else '1')
+
+
+class _SinkWorker:
+    """一个通知渠道的发送线程：按提交顺序逐条发送，渠道卡住时只积压自己的队列"""
+
+    def __init__(self, sink):
+        self.sink = sink
+        self._queue = deque(maxlen=SINK_QUEUE_SIZE)
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._started = None     # 正在发送的通知的开始时刻（time.monotonic()），空闲时为 None
+        self._timed_out = False  # 正在发送的通知是否已记为超时
+        self._thread = threading.Thread(target=self._run, name=f'alarm-sink:{sink.name}', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    @property
+    def busy(self):
+        return self._started is not None
+
+    def put(self, notification):
+        if len(self._queue) == self._queue.maxlen:
+            self.sink.dropped += 1
+        self._queue.append(notification)
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            while self._queue:
+                self._send(self._queue.popleft())
+
+    def _send(self, notification):
+        sink = self.sink
+        with self._lock:
+            self._started = start = time.monotonic()
+            self._timed_out = False
+        error = None
+        try:
+            sink.send(notification)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        elapsed = time.monotonic() - start
+        with self._lock:
+            self._started = None
+            if self._timed_out:
+                return  # 已记为超时
+        if error is not None:
+            sink.failed += 1
+            sink.last_error = error
+            logging.warning(f"告警通知渠道 {sink.name} 发送失败: {error}")
+            return
+        sink.sent += 1
+        sink.last_latency_ms = round(elapsed * 1000, 1)
+
+    def check_timeout(self, now):
+        """开始发送后超过渠道超时仍未返回的记为超时（线程无法强行中断，结束后不再计数）"""
+        with self._lock:
+            if self._started is None or self._timed_out or now - self._started <= self.sink.timeout:
+                return
+            self._timed_out = True
+        self.sink.timed_out += 1
+        self.sink.last_error = f'超时（>{self.sink.timeout}s）'
+        logging.warning(f"告警通知渠道 {self.sink.name} 超时")
+
+
+# --- 告警确认与合并 ---
+
+class Incident:
+    """一次告警事件（同一摄像头同一类别的连续检出）"""
+
+    def __init__(self, incident_id, camera, class_name, started):
+        self.id = incident_id
+        self.camera = camera
+        self.class_name = class_name
+        self.started = started
+        self.last_seen = started
+        self.last_notified = started
+        self.detections = 0
+        self.max_confidence = 0.0
+        self.frame_id = None
+        self.ended = None
+
+    def update(self, timestamp, confidence, frame_id):
+        self.last_seen = max(self.last_seen, timestamp)
+        self.detections += 1
+        self.max_confidence = max(self.max_confidence, confidence)
+        self.frame_id = frame_id
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'camera': self.camera,
+            'class': self.class_name,
+            'started': self.started,
+            'last_seen': self.last_seen,
+            'ended': self.ended,
+            'detections': self.detections,
+            'max_confidence': round(self.max_confidence, 3),
+            'frame_id': self.frame_id,
+        }
+
+
+class AlarmDispatcher:
+    """
+    告警分发器
+
+    submit() 由推理线程调用，只做一次 deque.append；确认、合并在告警线程中进行，发送在各渠道的发送线程中进行。
+    """
+
+    def __init__(self, sinks=None, classes=ALARM_CLASSES, confirm_window=CONFIRM_WINDOW,
+                 confirm_frames=CONFIRM_FRAMES, clear_after=CLEAR_AFTER, remind_interval=REMIND_INTERVAL):
+        self.sinks = list(sinks) if sinks is not None else default_sinks()
+        self.classes = set(classes)
+        self.confirm_window = confirm_window
+        self.confirm_frames = confirm_frames
+        self.clear_after = clear_after
+        self.remind_interval = remind_interval
+        self._queue = deque(maxlen=QUEUE_SIZE)
+        self._wakeup = threading.Event()
+        self._candidates = {}  # (摄像头, 类别) -> 确认窗口内的检出时间 deque
+        self.active = {}       # (摄像头, 类别) -> Incident
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self._workers = []     # 每个渠道一个 _SinkWorker
+        self._thread = None
+        self._next_id = 1
+        self.received = 0
+        self.notifications = 0
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+        if self._thread is not None:
+            self._start_worker(sink)
+
+    def _start_worker(self, sink):
+        worker = _SinkWorker(sink)
+        worker.start()
+        self._workers.append(worker)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        for sink in self.sinks:
+            self._start_worker(sink)
+        self._thread = threading.Thread(target=self._run, name='alarm', daemon=True)
+        self._thread.start()
+        logging.info(f"✅ 告警分发已启动（{', '.join(sink.name for sink in self.sinks)}）")
+
+    def submit(self, event, camera='default'):
+        """提交一次推理的检测结果（只取告警类别，队列满时丢弃最旧的）"""
+        hits = [det for det in event['detections'] if det['class'] in self.classes]
+        if hits:
+            self._queue.append((camera, event['timestamp'], event['frame_id'], hits))
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            # 有活动告警或候选时需要定期检查超时，否则等到有新检测结果
+            timeout = 0.5 if (self.active or self._candidates or any(w.busy for w in self._workers)) else None
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+            # 单次处理出错不能让告警线程退出，否则之后的告警都不会再发送
+            try:
+                while self._queue:
+                    self._process(*self._queue.popleft())
+                self._tick(time.time())
+            except Exception as e:
+                logging.error(f"告警处理出错: {e}", exc_info=True)
+
+    def _process(self, camera, timestamp, frame_id, hits):
+        self.received += 1
+        best = {}
+        for det in hits:
+            best[det['class']] = max(best.get(det['class'], 0.0), det['confidence'])
+        for class_name, confidence in best.items():
+            key = (camera, class_name)
+            incident = self.active.get(key)
+            if incident is not None:
+                incident.update(timestamp, confidence, frame_id)
+                continue
+            # 确认窗口内的检出次数达到阈值才开始告警
+            seen = self._candidates.setdefault(key, deque())
+            seen.append((timestamp, confidence))
+            while seen and seen[0][0] < timestamp - self.confirm_window:
+                seen.popleft()
+            if len(seen) < self.confirm_frames:
+                continue
+            del self._candidates[key]
+            incident = Incident(self._next_id, camera, class_name, seen[0][0])
+            self._next_id += 1
+            for ts, conf in seen:
+                incident.update(ts, conf, frame_id)
+            self.active[key] = incident
+            self._dispatch('raised', incident)
+
+    def _tick(self, now):
+        for key, seen in list(self._candidates.items()):
+            if seen[-1][0] < now - self.confirm_window:
+                del self._candidates[key]
+        for key, incident in list(self.active.items()):
+            if now - incident.last_seen > self.clear_after:
+                incident.ended = now
+                del self.active[key]
+                self.history.append(incident)
+                self._dispatch('resolved', incident)
+            elif self.remind_interval > 0 and now - incident.last_notified >= self.remind_interval:
+                self._dispatch('ongoing', incident)
+        monotonic = time.monotonic()
+        for worker in self._workers:
+            worker.check_timeout(monotonic)
+
+    def _dispatch(self, kind, incident):
+        """把通知放入各渠道的发送队列，不等待结果"""
+        incident.last_notified = time.time()
+        notification = {
+            'type': kind,
+            'active': len(self.active),
+            'incident': incident.to_dict(),
+            'time': incident.last_notified,
+        }
+        self.notifications += 1
+        for worker in self._workers:
+            worker.put(notification)
+
+    def status(self):
+        return {
+            'active': [incident.to_dict() for incident in list(self.active.values())],
+            'recent': [incident.to_dict() for incident in list(self.history)[::-1]],
+            'sinks': [sink.status() for sink in self.sinks],
+            'queued': len(self._queue),
+            'received': self.received,
+            'notifications': self.notifications,
+            'confirm': {'window': self.confirm_window, 'frames': self.confirm_frames},
+            'clear_after': self.clear_after,
+        }
+
+
+def default_sinks():
+    """按环境变量组装通知渠道：日志 + ALARM_WEBHOOK_URL + ALARM_GPIO_PIN"""
+    sinks = [LogSink()]
+    for url in filter(None, (part.strip() for part in os.getenv('ALARM_WEBHOOK_URL', '').split(','))):
+        sinks.append(WebhookSink(url))
+    pin = os.getenv('ALARM_GPIO_PIN')
+    if pin:
+        try:
+            sinks.append(GPIOSink(int(pin)))
+        except (OSError, ValueError) as e:
+            logging.error(f"❌ 声光报警 GPIO 初始化失败: {e}")
+    return sinks
+
+
+# --- 本地 Webhook 接收端（代替短信网关等，开发和联调用）---
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            notification = json.loads(body)
+            incident = notification['incident']
+            logging.info(
+                f"📨 {notification['type']} #{incident['id']} [{incident['camera']}] {incident['class']} "
+                f"（检出 {incident['detections']} 次）"
+            )
+        except (ValueError, KeyError):
+            self.send_response(400)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        with self.server.lock:
+            self.server.received.append(notification)
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class WebhookReceiver(ThreadingHTTPServer):
+    """
+    本地 Webhook 接收端：记录收到的告警通知
+
+    Args:
+        delay: 每个请求的模拟处理延迟（秒），用于验证慢渠道不阻塞其他渠道
+    """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=5301, delay=0.0):
+        self.delay = delay
+        self.received = []
+        self.lock = threading.Lock()
+        super().__init__((host, port), _WebhookHandler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='本地告警 Webhook 接收端')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=5301, help='监听端口')
+    parser.add_argument('--delay', type=float, default=0.0, help='每个请求的模拟处理延迟（秒）')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+    server = WebhookReceiver(args.host, args.port, args.delay)
+    logging.info(f"📨 告警 Webhook 接收端已启动: http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,307 @@
+"""
+离线批量分析 - 对录像文件做火情检测，不依赖摄像头和 HTTP 服务
+长视频按时长切成多个片段分给多个工作进程，每个进程内解码线程与批量推理并行；
+结果按输入顺序写入 JSONL 或 Parquet（需要 pyarrow），并报告解码/推理吞吐。
+
+用法:
+    python3 analyze.py 录像目录/ incident.mp4 -o detections.jsonl
+    python3 analyze.py footage/ --model fire_m.pt --workers 8 --batch 16 --stride 5 -o out.parquet
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from multiprocessing import get_context
+
+import cv2
+
+from device_config import MODEL_FILES, get_model_path, resolve_model_file
+from model_manager import DANGER_CLASSES, extract_detections
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov', '.m4v', '.ts', '.mjpeg', '.mjpg', '.webm')
+# 每个片段的时长（秒），长视频切成多个片段并行处理
+CHUNK_SECONDS = 120.0
+# 解码线程最多预读几批帧（每批 batch_size 帧，限制每个进程的内存占用）
+DECODE_AHEAD_BATCHES = 2
+
+# 工作进程内的模型和参数（每个进程加载一次）
+_worker = {}
+
+
+def find_videos(inputs):
+    """展开输入的文件和目录（目录递归查找视频文件），按路径排序"""
+    videos = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                videos.extend(os.path.join(root, name) for name in names
+                              if name.lower().endswith(VIDEO_EXTENSIONS))
+        elif os.path.isfile(path):
+            videos.append(path)
+        else:
+            logging.warning(f"跳过不存在的输入: {path}")
+    return sorted(videos)
+
+
+def plan_chunks(videos, chunk_seconds=CHUNK_SECONDS):
+    """
+    按时长把视频切成片段
+
+    Returns:
+        list: [(路径, 起始帧, 结束帧（不含，None 为到结尾）, 帧率), ...]；帧数未知的视频整段处理
+    """
+    chunks = []
+    for path in videos:
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            logging.warning(f"无法打开视频，跳过: {path}")
+            continue
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        cap.release()
+        if fps <= 0 or total <= 0:
+            chunks.append((path, 0, None, fps))
+            continue
+        step = max(1, int(chunk_seconds * fps))
+        for start in range(0, total, step):
+            chunks.append((path, start, min(total, start + step), fps))
+    return chunks
+
+
+def _init_worker(model_path, device, conf, imgsz, threads):
+    """工作进程初始化：限制每个进程的线程数，避免多进程互相争抢 CPU，然后加载模型"""
+    cv2.setNumThreads(1)
+    import torch
+    from ultralytics import YOLO
+    torch.set_num_threads(threads)
+    _worker.update(model=YOLO(model_path), device=device, conf=conf, imgsz=imgsz)
+
+
+def _decode(path, start, end, stride, out):
+    """解码线程：按步长读取帧放入有界队列；跳过的帧只 grab 不解码"""
+    cap = cv2.VideoCapture(path)
+    try:
+        if start:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        index = start
+        while end is None or index < end:
+            if (index - start) % stride:
+                if not cap.grab():
+                    break
+            else:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                out.put((index, cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0, frame))
+            index += 1
+    finally:
+        cap.release()
+        out.put(None)
+
+
+def analyze_chunk(task):
+    """
+    工作进程：分析一个片段
+
+    Returns:
+        dict: {"records": [...], "frames": 推理帧数, "decode_wait": 等待解码耗时, "infer": 推理耗时}
+    """
+    path, start, end, fps, stride, batch_size, keep_empty = task
+    model = _worker['model']
+    frames = queue.Queue(maxsize=DECODE_AHEAD_BATCHES * batch_size)
+    decoder = threading.Thread(target=_decode, args=(path, start, end, stride, frames), daemon=True)
+    decoder.start()
+
+    records = []
+    count = 0
+    decode_wait = infer_time = 0.0
+    done = False
+    while not done:
+        batch = []
+        wait_start = time.perf_counter()
+        while len(batch) < batch_size:
+            item = frames.get()
+            if item is None:
+                done = True
+                break
+            batch.append(item)
+        decode_wait += time.perf_counter() - wait_start
+        if not batch:
+            break
+
+        infer_start = time.perf_counter()
+        results = model(
+            [frame for _, _, frame in batch],
+            conf=_worker['conf'], imgsz=_worker['imgsz'], device=_worker['device'], verbose=False,
+        )
+        infer_time += time.perf_counter() - infer_start
+        count += len(batch)
+
+        for (index, position, frame), result in zip(batch, results):
+            detections = extract_detections(result)
+            if not detections and not keep_empty:
+                continue
+            if position <= 0 and index and fps:
+                position = index / fps  # 部分容器读不到时间戳，按帧率推算
+            records.append({
+                "file": path,
+                "frame": index,
+                "time": round(position, 3),
+                "width": frame.shape[1],
+                "height": frame.shape[0],
+                "has_danger": any(det['class'] in DANGER_CLASSES for det in detections),
+                "detections": detections,
+            })
+    decoder.join()
+    return {"records": records, "frames": count, "decode_wait": decode_wait, "infer": infer_time}
+
+
+class JSONLWriter:
+    """每个有检测结果的帧一行"""
+
+    def __init__(self, path):
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def write(self, records):
+        for record in records:
+            self.file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    """每个检测框一行（file, frame, time, class, confidence, x1, y1, x2, y2），按片段分批写入"""
+
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("输出 Parquet 需要安装 pyarrow: pip install pyarrow")
+        self.pa = pa
+        self.schema = pa.schema([
+            ('file', pa.string()), ('frame', pa.int64()), ('time', pa.float64()),
+            ('class', pa.string()), ('confidence', pa.float32()),
+            ('x1', pa.float32()), ('y1', pa.float32()), ('x2', pa.float32()), ('y2', pa.float32()),
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+
+    def write(self, records):
+        rows = [(r['file'], r['frame'], r['time'], det['class'], det['confidence'], *det['box'])
+                for r in records for det in r['detections']]
+        if rows:
+            columns = list(zip(*rows))
+            self.writer.write_table(self.pa.table(
+                {field.name: column for field, column in zip(self.schema, columns)}, schema=self.schema
+            ))
+
+    def close(self):
+        self.writer.close()
+
+
+def run(videos, output, model_path, device='cpu', workers=None, batch_size=8, stride=1,
+        conf=0.25, imgsz=640, chunk_seconds=CHUNK_SECONDS, keep_empty=False):
+    """
+    批量分析视频并写出结果
+
+    Returns:
+        dict: 吞吐统计
+    """
+    chunks = plan_chunks(videos, chunk_seconds)
+    if not chunks:
+        raise SystemExit("没有可分析的视频")
+    cores = os.cpu_count() or 1
+    if workers is None:
+        # GPU 上多进程只会争抢显存，单进程加大批量更快
+        workers = 1 if device != 'cpu' else cores
+    workers = max(1, min(workers, len(chunks)))
+    threads = max(1, cores // workers)
+    writer = ParquetWriter(output) if output.endswith('.parquet') else JSONLWriter(output)
+    logging.info(
+        f"🎬 {len(videos)} 个视频切分为 {len(chunks)} 个片段，{workers} 个工作进程 × {threads} 线程，"
+        f"批量 {batch_size}，每 {stride} 帧分析一帧"
+    )
+
+    tasks = [(path, start, end, fps, stride, batch_size, keep_empty) for path, start, end, fps in chunks]
+    totals = {'frames': 0, 'detection_frames': 0, 'detections': 0, 'decode_wait': 0.0, 'infer': 0.0}
+    start_time = time.time()
+    # spawn：子进程不继承父进程中可能已初始化的 CUDA / OpenCV 线程状态
+    ctx = get_context('spawn')
+    try:
+        with ctx.Pool(workers, initializer=_init_worker,
+                      initargs=(model_path, device, conf, imgsz, threads)) as pool:
+            # imap 按提交顺序返回，输出文件中的记录与输入顺序一致
+            for i, result in enumerate(pool.imap(analyze_chunk, tasks), 1):
+                writer.write(result['records'])
+                totals['frames'] += result['frames']
+                totals['detection_frames'] += sum(1 for r in result['records'] if r['detections'])
+                totals['detections'] += sum(len(r['detections']) for r in result['records'])
+                totals['decode_wait'] += result['decode_wait']
+                totals['infer'] += result['infer']
+                elapsed = time.time() - start_time
+                logging.info(
+                    f"[{i}/{len(tasks)}] 已分析 {totals['frames']} 帧，"
+                    f"{totals['frames'] / elapsed:.1f} 帧/秒，检出 {totals['detections']} 个目标"
+                )
+    finally:
+        writer.close()
+
+    elapsed = time.time() - start_time
+    return {
+        'videos': len(videos),
+        'chunks': len(chunks),
+        'workers': workers,
+        'frames': totals['frames'],
+        'detection_frames': totals['detection_frames'],
+        'detections': totals['detections'],
+        'elapsed': round(elapsed, 2),
+        'fps': round(totals['frames'] / elapsed, 1) if elapsed > 0 else None,
+        # 各进程等待解码与推理的耗时占比，等待解码占比高说明瓶颈在解码
+        'decode_wait_ratio': round(totals['decode_wait'] / max(1e-9, totals['decode_wait'] + totals['infer']), 3),
+        'infer_ms_per_frame': round(totals['infer'] / totals['frames'] * 1000, 2) if totals['frames'] else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='离线批量分析录像中的火焰/烟雾')
+    parser.add_argument('inputs', nargs='+', help='视频文件或目录（目录递归查找）')
+    parser.add_argument('-o', '--output', default='detections.jsonl', help='输出文件（.jsonl 或 .parquet）')
+    parser.add_argument('--model', default='medium',
+                        help=f"模型大小（{'/'.join(MODEL_FILES)}）或模型文件名，如 fire_m.pt")
+    parser.add_argument('--device', default='cpu', help='推理设备: cpu / cuda / cuda:1')
+    parser.add_argument('--workers', type=int, default=None, help='工作进程数（默认 CPU 为核数，GPU 为 1）')
+    parser.add_argument('--batch', type=int, default=8, help='每次推理的帧数')
+    parser.add_argument('--stride', type=int, default=1, help='每隔多少帧分析一帧')
+    parser.add_argument('--conf', type=float, default=0.25, help='置信度阈值')
+    parser.add_argument('--imgsz', type=int, default=640, help='推理输入尺寸')
+    parser.add_argument('--chunk-seconds', type=float, default=CHUNK_SECONDS, help='长视频切分的片段时长（秒）')
+    parser.add_argument('--all-frames', action='store_true', help='没有检测结果的帧也写入（仅 JSONL）')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+    if args.model in MODEL_FILES:
+        model_path = get_model_path(args.model)
+    else:
+        model_path = resolve_model_file(args.model)
+    videos = find_videos(args.inputs)
+    summary = run(
+        videos, args.output, model_path, device=args.device, workers=args.workers,
+        batch_size=max(1, args.batch), stride=max(1, args.stride), conf=args.conf, imgsz=args.imgsz,
+        chunk_seconds=args.chunk_seconds, keep_empty=args.all_frames,
+    )
+    logging.info(f"✅ 分析完成，结果已写入 {args.output}")
+    logging.info(
+        f"   {summary['frames']} 帧 / {summary['elapsed']}s = {summary['fps']} 帧/秒，"
+        f"推理 {summary['infer_ms_per_frame']}ms/帧，等待解码占比 {summary['decode_wait_ratio']:.0%}，"
+        f"{summary['detection_frames']} 帧检出 {summary['detections']} 个目标"
+    )
+    print(json.dumps(summary, ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,3 +1,6 @@
+# 最先导入，用于统计各启动阶段耗时
+from startup import StartupTracker, PROCESS_START
+
 import cv2
 import threading
 import platform
@@ -7,43 +10,52 @@ import time
 import logging
 from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
-from ultralytics import YOLO
 
 app = Flask(__name__)
 CORS(app)  # 允许前端跨域访问 API
 
+# 启动阶段统计（HTTP 服务先监听，模型和摄像头在后台并行初始化）
+startup = StartupTracker(required=('model', 'camera'))
+startup.record('imports', time.time() - PROCESS_START)
+
 # --- 日志配置 ---
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
 
-# --- 加载模型 ---
-logging.info("正在加载 YOLO 模型 (fire_m.pt)...")
-try:
+# --- 加载模型（后台进行）---
+model = None
+
+
+def _load_model():
+    """后台启动阶段：加载模型并检查 CUDA 状态"""
+    global model
+    from ultralytics import YOLO
+
+    logging.info("正在加载 YOLO 模型 (fire_m.pt)...")
     # 确保 fire_m.pt 文件在当前目录下
+    start_time = time.time()
     model = YOLO('fire_m.pt')
-    # 预热一下模型 (可选)
-    logging.info("模型加载成功，正在预热...")
-except Exception as e:
-    logging.error(f"模型加载失败! 请检查文件名是否正确: {e}")
-    sys.exit(1)
-
-# 检查 CUDA 状态
-try:
-    import torch
-    if torch.cuda.is_available():
-        logging.info(f"🚀 CUDA 就绪! 使用显卡: {torch.cuda.get_device_name(0)}")
-    else:
-        logging.warning("⚠️ CUDA 不可用! 正在使用 CPU (可能会卡顿)")
-except Exception:
-    logging.info("无法确定 torch/cuda 状态")
+    startup.record('model_load', time.time() - start_time)
+    logging.info("模型加载成功")
+
+    # 检查 CUDA 状态
+    try:
+        import torch
+        if torch.cuda.is_available():
+            logging.info(f"🚀 CUDA 就绪! 使用显卡: {torch.cuda.get_device_name(0)}")
+        else:
+            logging.warning("⚠️ CUDA 不可用! 正在使用 CPU (可能会卡顿)")
+    except Exception:
+        logging.info("无法确定 torch/cuda 状态")
 
 
 # --- 摄像头管理类 ---
 class Camera:
-    def __init__(self, source=0):
+    def __init__(self, source=0, open_now=True):
         self.current_source = source
         self.video = None
         self.lock = threading.Lock()
-        self.open_camera(source)
+        if open_now:
+            self.open_camera(source)
 
     def _choose_backend(self):
         """根据系统选择最佳的摄像头后端"""
@@ -102,6 +114,11 @@ class Camera:
             if not success or frame is None:
                 return None
 
+        # 模型仍在后台加载：直接输出原始画面
+        if model is None:
+            ret, jpeg = cv2.imencode('.jpg', frame)
+            return jpeg.tobytes() if ret else None
+
         # --- AI 推理 (核心修改) ---
         try:
             # 关键修改：将置信度 conf 降低到 0.15
@@ -161,8 +178,15 @@ class Camera:
             logging.error(f"绘图失败: {e}")
             return None
 
-# 全局摄像头实例
-global_camera = Camera()
+# 全局摄像头实例（摄像头在后台打开，不阻塞 HTTP 服务启动）
+global_camera = Camera(open_now=False)
+
+
+def _open_camera():
+    """后台启动阶段：打开摄像头"""
+    global_camera.open_camera(global_camera.current_source)
+    if not (global_camera.video and global_camera.video.isOpened()):
+        raise RuntimeError(f"无法打开摄像头索引: {global_camera.current_source}")
 
 
 def generate_frames():
@@ -211,6 +235,22 @@ def switch_camera():
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/api/health')
+def health_check():
+    """健康检查：liveness 表示进程存活，readiness 表示模型和摄像头已就绪"""
+    camera_ok = global_camera.video is not None and global_camera.video.isOpened()
+    readiness = startup.readiness()
+    if readiness != 'starting':
+        readiness = 'ready' if (model is not None and camera_ok) else 'not_ready'
+    return jsonify({
+        "status": "ok" if readiness == 'ready' else readiness,
+        "liveness": "alive",
+        "readiness": readiness,
+        "camera": "ok" if camera_ok else "error",
+        "model_loaded": model is not None,
+        "startup": startup.summary(),
+    })
+
 # 调试接口：查看原始检测数据
 @app.route('/api/debug_frame')
 def debug_frame():
@@ -226,5 +266,8 @@ signal.signal(signal.SIGINT, _cleanup_and_exit)
 signal.signal(signal.SIGTERM, _cleanup_and_exit)
 
 if __name__ == '__main__':
+    startup.run_in_background('model', _load_model)
+    startup.run_in_background('camera', _open_camera)
+    startup.record('http_start', time.time() - PROCESS_START)
     # 监听所有 IP，允许局域网访问
     app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
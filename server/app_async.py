@@ -0,0 +1,597 @@
+"""
+异步（asyncio）流媒体服务 - 面向大量并发视频流客户端
+与 app_edge.py 共享同一套采集/推理流水线和路由：
+- /video_feed 由协程直接从共享帧缓冲区推流，每个客户端一个有界队列，不占用系统线程
+- /api/events 检测事件流、/api/telemetry/stream 遥测增量流（SSE）同样由协程推送
+- /api/snapshot 快照长轮询由协程等待下一帧，不占用线程池
+- /api/replay 录像回放通过 sendfile 直接从磁盘发送（零拷贝）
+- /ws/video 二进制 WebSocket 视频流：每帧一条消息（帧头元数据 + JPEG），按客户端确认做流控并测量往返延迟
+- 其余 JSON 接口原样转发给 app_edge 的 Flask 应用（在线程池中执行），保证接口兼容
+
+用法:
+    python3 app_async.py [设备类型]
+"""
+import asyncio
+import io
+import json
+import logging
+import os
+import struct
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+from werkzeug.http import http_date, parse_etags
+
+import app_edge
+import dvr
+from event_stream import KEEPALIVE_INTERVAL
+from frame_buffer import mjpeg_part, trace_headers
+from stream_quality import StreamProfile, AdaptiveStream
+
+PORT = int(os.getenv('PORT', '5000'))
+# 每个视频流客户端的帧队列长度（满了丢最旧帧，慢客户端总是拿最新画面）
+CLIENT_QUEUE_SIZE = 2
+# 转发 Flask 接口使用的线程池大小
+WSGI_WORKERS = int(os.getenv('WSGI_WORKERS', '8'))
+
+MJPEG_BOUNDARY = 'frame'
+# WebSocket 客户端最多允许多少帧未确认（超过则跳帧，确认后直接发送最新帧）
+WS_MAX_IN_FLIGHT = 2
+# 未确认帧超过这个时间（秒）视为丢失，避免客户端异常时永久停发
+WS_ACK_TIMEOUT = 5.0
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*'}
+
+
+async def video_feed(request):
+    """视频流接口（MJPEG，异步推流，参数同 app_edge: size/q/fps/adaptive/mode=raw）"""
+    try:
+        profile = StreamProfile.from_args(request.query)
+    except ValueError as e:
+        return web.json_response(
+            {"status": "error", "message": f"无效的视频流参数: {e}"}, status=400, headers=CORS_HEADERS
+        )
+    config = app_edge.CONFIG
+    stream = AdaptiveStream(profile, config['jpeg_quality'], config['target_fps'])
+    loop = asyncio.get_running_loop()
+
+    response = web.StreamResponse(headers={
+        'Content-Type': f'multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}',
+        'Cache-Control': 'no-cache',
+        **CORS_HEADERS,
+    })
+    await response.prepare(request)
+
+    buffer = app_edge.raw_buffer if profile.raw else app_edge.frame_buffer
+    queue = buffer.subscribe(maxsize=CLIENT_QUEUE_SIZE)
+    clients = app_edge.stream_clients.labels(app_edge.CAMERA, 'mjpeg')
+    delivery = app_edge.delivery_seconds.labels(app_edge.CAMERA, 'mjpeg')
+    sent = app_edge.frames_sent_total.labels(app_edge.CAMERA, 'mjpeg')
+    frame_delivery = app_edge.FrameDelivery('mjpeg', profile.raw)
+    clients.inc()
+    try:
+        while True:
+            frame = await queue.get()
+            if not stream.should_send():
+                continue
+            width, quality = stream.variant(config['resolution'][0])
+            if width is None and quality == config['jpeg_quality']:
+                frame_data = frame.jpeg
+            else:
+                # 重新编码可能耗时，放到线程池中执行，避免阻塞事件循环
+                frame_data = await loop.run_in_executor(
+                    None, app_edge.variant_cache.get, buffer.name, frame, width, quality, config['jpeg_quality']
+                )
+            # write 会在套接字缓冲区满时等待，期间新帧覆盖队列中的旧帧
+            send_start = time.monotonic()
+            await response.write(mjpeg_part(frame, frame_data))
+            send_time = time.monotonic() - send_start
+            stream.on_sent(send_time)
+            delivery.observe(send_time)
+            sent.inc()
+            frame_delivery.record(frame)
+    except (ConnectionResetError, asyncio.CancelledError):
+        pass
+    finally:
+        buffer.unsubscribe(queue)
+        clients.dec()
+    return response
+
+
+async def detection_event_stream(request):
+    """检测事件流（SSE，格式同 app_edge /api/events）"""
+    events = app_edge.detection_events
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+        **CORS_HEADERS,
+    })
+    await response.prepare(request)
+
+    # 先订阅再补发历史，避免两者之间发布的事件丢失；按序号去重
+    queue = events.subscribe()
+    try:
+        await response.write(b'retry: 2000\n\n')
+        seq = events.resume_seq(request.headers.get('Last-Event-ID') or request.query.get('last_id'))
+        for item_seq, _, payload in events.since(seq):
+            seq = item_seq
+            await response.write(payload)
+        while True:
+            try:
+                item_seq, _, payload = await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                await response.write(b': keepalive\n\n')
+                continue
+            if item_seq > seq:
+                seq = item_seq
+                await response.write(payload)
+    except (ConnectionResetError, asyncio.CancelledError):
+        pass
+    finally:
+        events.unsubscribe(queue)
+    return response
+
+
+async def telemetry_event_stream(request):
+    """遥测增量推送（SSE，格式同 app_edge /api/telemetry/stream）"""
+    stream = app_edge.telemetry_stream
+    if stream is None:
+        return web.json_response(
+            {"status": "error", "message": "遥测采集未启用"}, status=404, headers=CORS_HEADERS
+        )
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+        **CORS_HEADERS,
+    })
+    await response.prepare(request)
+
+    # 先订阅再取全量，全量之后的增量都会进入队列；序号不连续时重发全量
+    queue = stream.events.subscribe()
+    try:
+        await response.write(b'retry: 2000\n\n')
+        seq, payload = stream.snapshot()
+        await response.write(payload)
+        while True:
+            try:
+                item_seq, _, payload = await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                await response.write(b': keepalive\n\n')
+                continue
+            if item_seq <= seq:
+                continue
+            if item_seq > seq + 1:
+                seq, payload = stream.snapshot()
+            else:
+                seq = item_seq
+            await response.write(payload)
+    except (ConnectionResetError, asyncio.CancelledError):
+        pass
+    finally:
+        stream.events.unsubscribe(queue)
+    return response
+
+
+async def snapshot(request):
+    """最新一帧 JPEG（参数、ETag 语义同 app_edge /api/snapshot）"""
+    camera = request.match_info.get('camera', 'default')
+    raw = request.query.get('raw') in ('1', 'true', 'yes')
+    buffer = app_edge.snapshot_buffer(camera, raw)
+    if buffer is None:
+        return web.json_response(
+            {"status": "error", "message": f"未知摄像头: {camera}"}, status=404, headers=CORS_HEADERS
+        )
+    try:
+        wait = app_edge.parse_snapshot_wait(request.query.get('wait'))
+    except ValueError:
+        return web.json_response(
+            {"status": "error", "message": "无效的 wait 参数"}, status=400, headers=CORS_HEADERS
+        )
+    stale = buffer.stale_seq()
+    buffer.touch()
+
+    etags = parse_etags(request.headers.get('If-None-Match'))
+    known = [buffer.seq_from_etag(tag) for tag in etags.as_set()]
+    known = [seq for seq in known if seq is not None]
+    after = max(known) if known and wait > 0 else None
+
+    def outdated(frame):
+        # 无人观看期间缓冲区停止了更新，最新帧早于 stale 时也要等新的一帧
+        return frame is None or frame.seq <= stale or (after is not None and frame.seq <= after)
+
+    frame = buffer.latest
+    if outdated(frame):
+        starting = frame is None or frame.seq <= stale
+        timeout = max(wait, app_edge.FIRST_SNAPSHOT_WAIT) if starting else wait
+        queue = buffer.subscribe(maxsize=1)
+        try:
+            deadline = time.monotonic() + timeout
+            while outdated(frame):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    frame = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+        finally:
+            buffer.unsubscribe(queue)
+        frame = frame or buffer.latest
+    if frame is None:
+        return web.json_response(
+            {"status": "error", "message": "暂无画面"}, status=503,
+            headers={'Retry-After': '1', **CORS_HEADERS}
+        )
+
+    etag = buffer.etag(frame)
+    headers = {
+        'ETag': f'"{etag}"',
+        'Last-Modified': http_date(frame.timestamp),
+        'Cache-Control': 'no-cache',
+        'X-Timestamp': f'{frame.timestamp:.3f}',
+        **CORS_HEADERS,
+    }
+    if frame.frame_id is not None:
+        headers['X-Frame-Id'] = str(frame.frame_id)
+    if frame.trace is not None:
+        headers.update(trace_headers(frame.trace))
+    if etags.contains(etag):
+        return web.Response(status=304, headers=headers)
+    if not request.headers.get('If-None-Match') and request.if_modified_since is not None:
+        if int(frame.timestamp) <= request.if_modified_since.timestamp():
+            return web.Response(status=304, headers=headers)
+    app_edge.frames_sent_total.labels(camera, 'snapshot').inc()
+    if camera == app_edge.CAMERA:
+        app_edge.FrameDelivery('snapshot', raw).record(frame)
+    return web.Response(body=frame.jpeg, content_type='image/jpeg', headers=headers)
+
+
+async def replay(request):
+    """录像回放（参数同 app_edge /api/replay），帧数据经 sendfile 从磁盘直接发往套接字"""
+    try:
+        camera, from_ts, to_ts, speed, fmt = app_edge.parse_replay_args(request.query)
+    except ValueError as e:
+        return web.json_response(
+            {"status": "error", "message": f"无效的回放参数: {e}"}, status=400, headers=CORS_HEADERS
+        )
+    loop = asyncio.get_running_loop()
+    segments = await loop.run_in_executor(None, dvr.find_frames, dvr.DVR_DIR, camera, from_ts, to_ts)
+    if not segments:
+        return web.json_response(
+            {"status": "error", "message": "该时间段没有录像"}, status=404, headers=CORS_HEADERS
+        )
+
+    # 预先算出总长度：固定长度响应不使用分块编码，sendfile 写入的数据才能与响应体对齐
+    part_header = b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n'
+    if fmt == 'raw':
+        content_type = 'video/x-motion-jpeg'
+        total = sum(records[-1][1] + records[-1][2] - records[0][1] for _, records in segments)
+    else:
+        content_type = f'multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}'
+        total = sum(len(part_header % length) + length + 2
+                    for _, records in segments for _, _, length in records)
+    response = web.StreamResponse(headers={'Content-Type': content_type, **CORS_HEADERS})
+    response.content_length = total
+    await response.prepare(request)
+
+    first_ts = None
+    start = time.monotonic()
+    try:
+        for data_path, records in segments:
+            try:
+                f = open(data_path, 'rb')
+            except FileNotFoundError:
+                break  # 已被配额清理，长度无法再对齐，结束响应
+            with f:
+                if fmt == 'raw':
+                    begin = records[0][1]
+                    end = records[-1][1] + records[-1][2]
+                    await loop.sendfile(request.transport, f, begin, end - begin)
+                    continue
+                for ts_ms, offset, length in records:
+                    if speed > 0:
+                        if first_ts is None:
+                            first_ts = ts_ms
+                        delay = (ts_ms - first_ts) / 1000.0 / speed - (time.monotonic() - start)
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                    if request.transport is None or request.transport.is_closing():
+                        return response
+                    await response.write(part_header % length)
+                    await loop.sendfile(request.transport, f, offset, length)
+                    await response.write(b'\r\n')
+    except (ConnectionResetError, asyncio.CancelledError):
+        pass
+    return response
+
+
+class WSClient:
+    """
+    单个 WebSocket 视频客户端的流控与延迟统计
+
+    客户端收到帧后回复 {"type": "ack", "seq": ..., "sent": ...}（原样回传帧头中的值）；
+    未确认帧达到 WS_MAX_IN_FLIGHT 时暂停发送，期间到达的帧只保留最新一帧。
+    从未发送确认的客户端不启用窗口，仅靠套接字写缓冲做背压。
+    """
+
+    def __init__(self, remote):
+        self.remote = remote
+        self.connected_at = time.time()
+        self.in_flight = {}  # frame seq -> 发送时刻（monotonic）
+        self.acks_enabled = False
+        self.window_open = asyncio.Event()
+        self.window_open.set()
+        self.rtt = None  # 往返延迟（秒，指数平滑）
+        self.sent = 0
+        self.skipped = 0
+
+    def on_send(self, seq):
+        self.sent += 1
+        if self.acks_enabled:
+            self.in_flight[seq] = time.monotonic()
+            self._update_window()
+
+    def on_ack(self, seq, sent):
+        """处理客户端确认，sent 为帧头中的发送时刻（毫秒）"""
+        self.acks_enabled = True
+        self.in_flight.pop(seq, None)
+        if sent is not None:
+            rtt = max(0.0, time.monotonic() - sent / 1000.0)
+            self.rtt = rtt if self.rtt is None else self.rtt * 0.8 + rtt * 0.2
+        self._update_window()
+
+    def expire(self):
+        """丢弃超时未确认的帧"""
+        deadline = time.monotonic() - WS_ACK_TIMEOUT
+        for seq, sent_at in list(self.in_flight.items()):
+            if sent_at < deadline:
+                del self.in_flight[seq]
+        self._update_window()
+
+    def _update_window(self):
+        if len(self.in_flight) < WS_MAX_IN_FLIGHT:
+            self.window_open.set()
+        else:
+            self.window_open.clear()
+
+    def summary(self):
+        return {
+            'remote': self.remote,
+            'connected_at': self.connected_at,
+            'rtt_ms': round(self.rtt * 1000, 1) if self.rtt is not None else None,
+            'in_flight': len(self.in_flight),
+            'sent': self.sent,
+            'skipped': self.skipped,
+        }
+
+
+# 当前连接的 WebSocket 视频客户端
+ws_clients = set()
+
+
+def _detection_summary(frame):
+    """帧头中的检测摘要：取不晚于该帧的最近一次推理结果"""
+    event = app_edge.detection_events.latest()
+    summary = {'has_danger': frame.has_danger, 'count': 0, 'classes': {}}
+    if event is None or (frame.frame_id is not None and event['frame_id'] > frame.frame_id):
+        return summary
+    summary['has_danger'] = frame.has_danger or event['has_danger']
+    summary['count'] = len(event['detections'])
+    for det in event['detections']:
+        summary['classes'][det['class']] = summary['classes'].get(det['class'], 0) + 1
+    summary['frame_id'] = event['frame_id']
+    return summary
+
+
+def pack_ws_frame(header, jpeg):
+    """二进制帧格式：4 字节大端帧头长度 + UTF-8 JSON 帧头 + JPEG 数据"""
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    return struct.pack('>I', len(header_bytes)) + header_bytes + jpeg
+
+
+async def _ws_receive(ws, client):
+    """读取客户端消息（确认帧）"""
+    async for msg in ws:
+        if msg.type != web.WSMsgType.TEXT:
+            continue
+        try:
+            data = json.loads(msg.data)
+        except ValueError:
+            continue
+        if isinstance(data, dict) and data.get('type') == 'ack':
+            client.on_ack(data.get('seq'), data.get('sent'))
+
+
+async def video_ws(request):
+    """
+    二进制 WebSocket 视频流（参数同 /video_feed: size/q/fps/adaptive/mode=raw）
+
+    每帧一条二进制消息，帧头字段: seq, frame_id, timestamp（发布时间）, width, quality,
+    sent（服务端发送时刻，毫秒）, detections（检测摘要）, rtt_ms（上次测得的往返延迟），
+    latency（captured_at 采集时刻的墙钟时间, age_ms 发送时的帧龄, stages_ms 发布前各阶段耗时）
+    """
+    try:
+        profile = StreamProfile.from_args(request.query)
+    except ValueError as e:
+        return web.json_response(
+            {"status": "error", "message": f"无效的视频流参数: {e}"}, status=400, headers=CORS_HEADERS
+        )
+    config = app_edge.CONFIG
+    stream = AdaptiveStream(profile, config['jpeg_quality'], config['target_fps'])
+    loop = asyncio.get_running_loop()
+
+    ws = web.WebSocketResponse(heartbeat=30.0)
+    await ws.prepare(request)
+
+    client = WSClient(request.remote)
+    ws_clients.add(client)
+    clients = app_edge.stream_clients.labels(app_edge.CAMERA, 'ws')
+    delivery = app_edge.delivery_seconds.labels(app_edge.CAMERA, 'ws')
+    sent = app_edge.frames_sent_total.labels(app_edge.CAMERA, 'ws')
+    frame_delivery = app_edge.FrameDelivery('ws', profile.raw)
+    clients.inc()
+    receiver = asyncio.ensure_future(_ws_receive(ws, client))
+    buffer = app_edge.raw_buffer if profile.raw else app_edge.frame_buffer
+    queue = buffer.subscribe(maxsize=1)
+    try:
+        while not ws.closed and not receiver.done():
+            # 等待发送窗口；等待期间新帧覆盖旧帧，窗口打开后直接发送最新帧
+            if not client.window_open.is_set():
+                try:
+                    await asyncio.wait_for(client.window_open.wait(), WS_ACK_TIMEOUT)
+                except asyncio.TimeoutError:
+                    client.expire()
+                    continue
+            # 同时等待新帧和客户端断开，摄像头无画面时也能及时结束
+            getter = asyncio.ensure_future(queue.get())
+            await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                getter.cancel()
+                break
+            frame = getter.result()
+            if not stream.should_send():
+                client.skipped += 1
+                continue
+
+            width, quality = stream.variant(config['resolution'][0])
+            if width is None and quality == config['jpeg_quality']:
+                frame_data = frame.jpeg
+            else:
+                frame_data = await loop.run_in_executor(
+                    None, app_edge.variant_cache.get, buffer.name, frame, width, quality, config['jpeg_quality']
+                )
+            header = {
+                'seq': frame.seq,
+                'frame_id': frame.frame_id,
+                'timestamp': frame.timestamp,
+                'width': width,
+                'quality': quality,
+                'sent': round(time.monotonic() * 1000, 1),
+                'detections': _detection_summary(frame),
+                'rtt_ms': round(client.rtt * 1000, 1) if client.rtt is not None else None,
+                'latency': frame.trace.to_dict() if frame.trace is not None else None,
+            }
+            send_start = time.monotonic()
+            await ws.send_bytes(pack_ws_frame(header, frame_data))
+            send_time = time.monotonic() - send_start
+            stream.on_sent(send_time)
+            delivery.observe(send_time)
+            sent.inc()
+            frame_delivery.record(frame)
+            client.on_send(frame.seq)
+    except (ConnectionResetError, asyncio.CancelledError):
+        pass
+    finally:
+        buffer.unsubscribe(queue)
+        ws_clients.discard(client)
+        clients.dec()
+        receiver.cancel()
+        await ws.close()
+    return ws
+
+
+async def ws_client_stats(request):
+    """WebSocket 视频客户端状态（往返延迟、未确认帧、发送/跳过帧数）"""
+    return web.json_response([client.summary() for client in ws_clients], headers=CORS_HEADERS)
+
+
+class WSGIBridge:
+    """把 aiohttp 请求转发给 WSGI 应用（仅用于非流式接口）"""
+
+    def __init__(self, wsgi_app, executor):
+        self.wsgi_app = wsgi_app
+        self.executor = executor
+
+    def _environ(self, request, body):
+        host = request.host.split(':')[0]
+        environ = {
+            'REQUEST_METHOD': request.method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': request.path,
+            'QUERY_STRING': request.query_string,
+            'SERVER_NAME': host,
+            'SERVER_PORT': str(PORT),
+            'SERVER_PROTOCOL': f'HTTP/{request.version.major}.{request.version.minor}',
+            'REMOTE_ADDR': request.remote or '',
+            'CONTENT_TYPE': request.headers.get('Content-Type', ''),
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': request.scheme,
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in request.headers.items():
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            if key in ('HTTP_CONTENT_TYPE', 'HTTP_CONTENT_LENGTH'):
+                continue
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+        return environ
+
+    def _call(self, environ):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = headers
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            body = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response['status'], response['headers'], body
+
+    async def handle(self, request):
+        body = await request.read()
+        environ = self._environ(request, body)
+        loop = asyncio.get_running_loop()
+        status, headers, body = await loop.run_in_executor(self.executor, self._call, environ)
+        response = web.Response(status=status, body=body)
+        for name, value in headers:
+            if name.lower() != 'content-length':
+                response.headers.add(name, value)
+        return response
+
+
+def create_app():
+    """创建 aiohttp 应用"""
+    executor = ThreadPoolExecutor(max_workers=WSGI_WORKERS, thread_name_prefix='wsgi')
+    bridge = WSGIBridge(app_edge.app.wsgi_app, executor)
+
+    app = web.Application()
+    app.router.add_get('/video_feed', video_feed)
+    app.router.add_get('/api/events', detection_event_stream)
+    app.router.add_get('/api/telemetry/stream', telemetry_event_stream)
+    app.router.add_get('/api/snapshot', snapshot)
+    app.router.add_get('/api/snapshot/{camera:.+}', snapshot)
+    app.router.add_get('/api/replay', replay)
+    app.router.add_get('/ws/video', video_ws)
+    app.router.add_get('/api/ws_clients', ws_client_stats)
+    # 其余路由全部交给 Flask 应用处理
+    app.router.add_route('*', '/{tail:.*}', bridge.handle)
+
+    async def on_startup(app):
+        app_edge.start_background_init()
+        app_edge.startup.record('http_start', time.time() - app_edge.PROCESS_START)
+
+    async def on_cleanup(app):
+        logging.info('👋 服务正在停止...')
+        app_edge.global_camera.release()
+        executor.shutdown(wait=False)
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == '__main__':
+    logging.info(f"🚀 启动异步流媒体服务器 (端口: {PORT})")
+    logging.info(f"📊 设备: {app_edge.CONFIG['name']}")
+    web.run_app(create_app(), host='0.0.0.0', port=PORT, access_log=None)
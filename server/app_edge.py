@@ -2,39 +2,78 @@
 边缘设备优化版本 - 针对终端机部署
 支持多平台自动检测和性能自适应
 """
+# 最先导入，用于统计各启动阶段耗时
+from startup import StartupTracker, PROCESS_START
+
 import cv2
+import functools
+import hmac
 import threading
 import platform
 import signal
 import sys
 import time
 import logging
-import numpy as np
 import os
 from collections import deque
-from queue import Queue, Empty
-from flask import Flask, Response, jsonify, request
+from datetime import datetime
+from queue import Queue, Empty, Full
+from flask import Flask, Response, jsonify, request, send_from_directory
 from flask_cors import CORS
-from ultralytics import YOLO
 
 # 导入设备配置
-from device_config import get_device_config, get_model_path, print_device_info
+from device_config import (
+    get_device_config, get_model_path, print_device_info, resolve_model_file, apply_gpu_check
+)
+from model_manager import DANGER_CLASSES, ModelManager, StubModel, extract_detections
+from frame_buffer import get_buffer, find_buffer, mjpeg_part, trace_headers
+from frame_trace import FrameTrace, LatencyWindow, AGE_BUCKETS
+from event_stream import EventBroadcaster
+from clip_recorder import ClipRecorder
+import dvr
+from detection_store import DetectionStore
+from spool import EventSpool, SPOOL_UPLOAD_URL
+from alarm import AlarmDispatcher
+from telemetry import TelemetryService, CHANNELS
+from timeseries import TimeSeriesStore
+from telemetry_stream import TelemetryDeltaStream
+from stream_quality import StreamProfile, AdaptiveStream, VariantCache
+from video_source import ThreadedSource, parse_source, describe_source
+from metrics import Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE
+import profiler
 
 app = Flask(__name__)
 CORS(app)
 
+# 启动阶段统计（HTTP 服务先监听，模型和摄像头在后台并行初始化）
+startup = StartupTracker(required=('model', 'camera'))
+startup.record('imports', time.time() - PROCESS_START)
+
+# HTTP 端口（同一台机器上运行多个节点时用不同端口，如集群汇聚联调）
+PORT = int(os.getenv('PORT', '5000'))
+
 # --- 从环境变量或命令行参数获取设备类型 ---
 DEVICE_TYPE = os.getenv('DEVICE_TYPE', None)
 if len(sys.argv) > 1:
     DEVICE_TYPE = sys.argv[1]
 
-# 获取设备配置
-CONFIG, detected_device_type = get_device_config(DEVICE_TYPE)
+# 校准模式：实测候选配置并写入缓存后退出（python3 app_edge.py calibrate）
+if DEVICE_TYPE == 'calibrate':
+    from calibration import main as run_calibration
+    sys.exit(run_calibration(sys.argv[2:]))
+
+# 获取设备配置（GPU 检查需要导入 torch，推迟到后台模型加载阶段）
+CONFIG, detected_device_type = get_device_config(DEVICE_TYPE, check_gpu=False)
+
+# 桩模型（MODEL_STUB=1）：不加载权重，用颜色阈值模拟检测，用于压力测试等只关心流水线开销的场合；
+# MODEL_STUB_DELAY 为模拟的每帧推理耗时（毫秒）
+MODEL_STUB = os.getenv('MODEL_STUB', '0') == '1'
+MODEL_STUB_DELAY = float(os.getenv('MODEL_STUB_DELAY', '0')) / 1000.0
 
 # 获取模型路径并检查
 try:
-    MODEL_PATH = get_model_path(CONFIG['model_size'])
-    if not os.path.exists(MODEL_PATH):
+    MODEL_PATH = 'stub' if MODEL_STUB else get_model_path(CONFIG['model_size'])
+    if not MODEL_STUB and not os.path.exists(MODEL_PATH):
         logging.error(f"❌ 模型文件不存在: {MODEL_PATH}")
         logging.error("请确保模型文件在 server/ 目录下")
         logging.error("可用模型: fire_m.pt, yolov8n.pt, yolov8s.pt")
@@ -55,11 +94,8 @@ logging.basicConfig(
 # 打印设备信息
 print_device_info(CONFIG, detected_device_type)
 
-# --- 全局统计 ---
+# --- 全局统计（各项只由一个线程写入；计数和耗时分布见下方指标）---
 stats = {
-    'total_frames': 0,
-    'detected_fires': 0,
-    'detected_smoke': 0,
     'current_fps': 0.0,
     'inference_fps': 0.0,
     'last_detection_time': None,
@@ -67,48 +103,131 @@ stats = {
     'memory_usage': 0.0,
 }
 
-# --- 加载模型 ---
-logging.info(f"正在加载 YOLO 模型 ({MODEL_PATH})...")
-try:
-    model = YOLO(MODEL_PATH)
-    
-    # 设置设备
-    device = 'cuda' if CONFIG['use_gpu'] else 'cpu'
-    if device == 'cuda':
-        try:
+# --- 运行指标（/metrics，Prometheus 文本格式）---
+CAMERA = 'default'
+frames_captured_total = Counter('carport_frames_captured_total', '采集的帧数', ['camera'])
+frames_inferred_total = Counter('carport_frames_inferred_total', '完成推理的帧数', ['camera'])
+inference_dropped_total = Counter('carport_inference_dropped_total', '推理队列已满而跳过推理的帧数', ['camera'])
+detections_total = Counter('carport_detections_total', '检测框数量', ['camera', 'class'])
+danger_frames_total = Counter(
+    'carport_danger_frames_total', '检出火情类别的推理帧数（一帧同类多个框只计一次）', ['camera', 'class']
+)
+capture_seconds = Histogram('carport_capture_seconds', '从视频源读取一帧的耗时（秒）', ['camera'])
+inference_seconds = Histogram('carport_inference_seconds', '单帧推理耗时（秒）', ['camera'])
+encode_seconds = Histogram(
+    'carport_encode_seconds', 'JPEG 编码耗时（秒，annotated 含绘制检测框）', ['camera', 'stream']
+)
+delivery_seconds = Histogram(
+    'carport_delivery_seconds', '一帧写入客户端连接的耗时（秒，含网络背压等待）', ['camera', 'client']
+)
+frames_sent_total = Counter('carport_frames_sent_total', '发送给客户端的帧数', ['camera', 'client'])
+stream_clients = Gauge('carport_stream_clients', '当前连接的视频流客户端数', ['camera', 'client'])
+frame_stage_seconds = Histogram(
+    'carport_frame_stage_seconds', '帧在流水线各阶段的耗时（秒，阶段见 frame_trace）', ['camera', 'stream', 'stage'],
+    buckets=AGE_BUCKETS
+)
+frame_age_seconds = Histogram(
+    'carport_frame_age_seconds', '帧写入客户端连接时的帧龄（秒，从视频源产生该帧算起）', ['camera', 'client'],
+    buckets=AGE_BUCKETS
+)
+Gauge('carport_capture_fps', '采集帧率').set_function(lambda: stats['current_fps'])
+Gauge('carport_inference_fps', '推理帧率').set_function(lambda: stats['inference_fps'])
+Gauge('carport_cpu_usage_percent', '整机 CPU 使用率').set_function(lambda: stats['cpu_usage'])
+Gauge('carport_memory_usage_percent', '整机内存使用率').set_function(lambda: stats['memory_usage'])
+Gauge('carport_last_detection_timestamp_seconds', '最近一次检出火情的时间（Unix 秒）').set_function(
+    lambda: stats['last_detection_time']
+)
+
+# 热路径上直接使用的子指标
+_captured = frames_captured_total.labels(CAMERA)
+_inferred = frames_inferred_total.labels(CAMERA)
+_inference_dropped = inference_dropped_total.labels(CAMERA)
+_capture_time = capture_seconds.labels(CAMERA)
+_inference_time = inference_seconds.labels(CAMERA)
+_encode_annotated = encode_seconds.labels(CAMERA, 'annotated')
+_encode_raw = encode_seconds.labels(CAMERA, 'raw')
+
+# 最近若干帧的各阶段耗时和帧龄（/api/latency）
+latency = LatencyWindow()
+
+
+def record_stages(stream, trace):
+    """记录一帧发布前各阶段的耗时（stream 为 annotated / raw，同一帧重复发布时只记一次）"""
+    latency.add_trace(stream, trace)
+    for stage, duration in trace.stages():
+        frame_stage_seconds.labels(CAMERA, stream, stage).observe(duration)
+
+
+class FrameDelivery:
+    """一个推流客户端的延迟统计：每帧写入连接后记录帧龄和 send 阶段（发布到写完）耗时"""
+
+    def __init__(self, client, raw=False):
+        self.client = client
+        self._age = frame_age_seconds.labels(CAMERA, client)
+        self._send = frame_stage_seconds.labels(CAMERA, 'raw' if raw else 'annotated', 'send')
+
+    def record(self, frame):
+        trace = frame.trace
+        if trace is None:
+            return
+        now = time.monotonic()
+        age = trace.age(now)
+        send = now - trace.marks[-1][1]
+        self._age.observe(age)
+        self._send.observe(send)
+        latency.add(self.client, 'age', age)
+        latency.add(self.client, 'send', send)
+
+
+# --- 模型管理器（后台加载，支持运行时热切换）---
+device = 'cuda' if CONFIG['use_gpu'] else 'cpu'
+model_manager = ModelManager(
+    device=device,
+    warmup_resolution=CONFIG['resolution'],
+    conf=CONFIG['detection_conf'],
+)
+
+
+def _init_model():
+    """后台启动阶段：检查GPU、加载并预热模型"""
+    global device
+    if MODEL_STUB:
+        model_manager.install(StubModel(delay=MODEL_STUB_DELAY), MODEL_PATH)
+        return
+    with startup.phase('gpu_check'):
+        if apply_gpu_check(CONFIG):
             import torch
-            if torch.cuda.is_available():
-                logging.info(f"🚀 CUDA 就绪! 使用显卡: {torch.cuda.get_device_name(0)}")
-            else:
-                logging.warning("⚠️ CUDA 不可用! 切换到 CPU")
-                device = 'cpu'
-        except:
+            device = 'cuda'
+            logging.info(f"🚀 CUDA 就绪! 使用显卡: {torch.cuda.get_device_name(0)}")
+        else:
             device = 'cpu'
-    
-    if device == 'cpu':
-        logging.info("💻 使用 CPU 模式")
-    
-    # 模型预热
-    logging.info("正在预热模型...")
-    warmup_resolution = CONFIG['resolution']
-    dummy_frame = np.zeros((warmup_resolution[1], warmup_resolution[0], 3), dtype=np.uint8)
-    _ = model(dummy_frame, conf=CONFIG['detection_conf'], verbose=False, device=device)
-    logging.info("✅ 模型预热完成")
-    
-except Exception as e:
-    logging.error(f"❌ 模型加载失败! 错误: {e}", exc_info=True)
-    sys.exit(1)
+            logging.info("💻 使用 CPU 模式")
+    model_manager.device = device
+
+    load_time, warmup_time = model_manager.load(MODEL_PATH)
+    startup.record('model_load', load_time)
+    startup.record('model_warmup', warmup_time)
+
+
+# 驱动缓冲区时间戳换算出的帧龄超过这个值（秒）时视为不可信（后端不提供时间戳或时钟不同）
+MAX_DRIVER_FRAME_AGE = 5.0
 
 
 # --- 摄像头管理类（边缘设备优化版）---
 class EdgeCamera:
-    def __init__(self, source=0):
+    def __init__(self, source=0, open_now=True):
         self.current_source = source
+        self.pace = 'realtime'  # 文件/图片目录的回放速度和是否循环（重连时沿用）
+        self.loop = True
         self.video = None
-        self.lock = threading.Lock()
+        self.lock = threading.RLock()  # get_frame 持锁时可能触发重连
         self.fail_count = 0
         self.last_frame = None
+        self.last_image = None  # last_frame 对应的图像（用于按客户端规格重新编码）
+        self.last_trace = None  # last_frame 的延迟追踪
         self.last_results = None  # 缓存检测结果
+        self.last_danger = False  # 最近一次推理是否发现火焰/烟雾
+        self.annotate = True  # 是否在服务端绘制检测框并编码（无人观看标注画面时关闭）
         self.frame_counter = 0
         self.inference_times = deque(maxlen=30)  # 推理时间统计
         
@@ -118,7 +237,8 @@ class EdgeCamera:
         self.inference_thread = None
         self.running = True
         
-        self.open_camera(source)
+        if open_now:
+            self.open_camera(source)
         self.start_inference_thread()
 
     def _choose_backend(self):
@@ -131,9 +251,23 @@ class EdgeCamera:
         else:
             return 0
 
-    def open_camera(self, source):
-        """切换摄像头"""
+    def open_camera(self, source, pace=None, loop=None):
+        """
+        切换视频源
+
+        Args:
+            source: 摄像头索引，或 rtsp/http 地址、视频文件、图片目录（见 video_source.parse_source）
+            pace: 文件/图片目录回放速度 'realtime' 或 'fast'（默认沿用当前设置）
+            loop: 文件/图片目录播完是否循环（默认沿用当前设置）
+
+        Raises:
+            ValueError: 无法识别的视频源
+        """
+        kind, target = parse_source(source)
+        pace = self.pace if pace is None else pace
+        loop = self.loop if loop is None else loop
         with self.lock:
+            self.pace, self.loop = pace, loop
             if self.video is not None:
                 try:
                     self.video.release()
@@ -141,6 +275,18 @@ class EdgeCamera:
                     logging.warning(f"释放摄像头时出错: {e}")
                 time.sleep(0.5)
 
+            if kind != 'device':
+                # 文件和网络流由独立解码线程读取，断流时自行重连
+                self.video = ThreadedSource(kind, target, pace=pace, loop=loop)
+                if self.video.wait_ready():
+                    self.current_source = source
+                    self.fail_count = 0
+                    logging.info(f"📷 视频源已切换至: {describe_source(target)}")
+                else:
+                    logging.error(f"❌ 无法打开视频源: {describe_source(target)}")
+                return
+
+            source = target
             backend = self._choose_backend()
             
             try:
@@ -175,6 +321,17 @@ class EdgeCamera:
             else:
                 logging.error(f"❌ 无法打开摄像头索引: {source}")
 
+    @property
+    def unpaced(self):
+        """视频源为不限速回放（pace=fast）时，采集线程不按目标帧率限速"""
+        return isinstance(self.video, ThreadedSource) and self.video.unpaced
+
+    def source_status(self):
+        """当前视频源状态"""
+        if isinstance(self.video, ThreadedSource):
+            return self.video.status()
+        return {'type': 'device', 'source': str(self.current_source)}
+
     def start_inference_thread(self):
         """启动推理线程（异步处理）"""
         def inference_worker():
@@ -185,53 +342,84 @@ class EdgeCamera:
                     if frame_data is None:
                         continue
                     
-                    frame, frame_id = frame_data
+                    frame, frame_id, trace = frame_data
+                    trace = trace.mark('queue')
                     
-                    # 执行推理
+                    # 执行推理（每帧取一次模型引用，热切换只发生在两帧之间）
+                    model, generation = model_manager.acquire()
                     start_time = time.time()
                     results = model(
                         frame,
                         conf=CONFIG['detection_conf'],
                         verbose=False,
-                        device=device
+                        device=model_manager.device
                     )
                     inference_time = time.time() - start_time
+                    trace = trace.mark('inference')
                     self.inference_times.append(inference_time)
+                    model_manager.report_inference(generation)
+                    _inference_time.observe(inference_time)
+                    _inferred.inc()
                     
                     # 计算推理FPS
                     if len(self.inference_times) > 1:
                         stats['inference_fps'] = 1.0 / (sum(self.inference_times) / len(self.inference_times))
                     
-                    # 处理检测结果
-                    has_danger = False
-                    if len(results[0].boxes) > 0:
-                        detected_cls_ids = results[0].boxes.cls.cpu().numpy()
-                        confidences = results[0].boxes.conf.cpu().numpy()
-                        names = results[0].names
-                        
-                        for cls_id, conf in zip(detected_cls_ids, confidences):
-                            class_name = names[int(cls_id)]
-                            if class_name == 'fire':
-                                has_danger = True
-                                stats['detected_fires'] += 1
-                                stats['last_detection_time'] = time.time()
-                                logging.warning(f"🔥 检测到火焰! 置信度: {conf:.2f}")
-                            elif class_name == 'smoke':
-                                has_danger = True
-                                stats['detected_smoke'] += 1
-                                stats['last_detection_time'] = time.time()
-                                logging.warning(f"💨 检测到烟雾! 置信度: {conf:.2f}")
+                    # 处理检测结果（告警日志和通知由告警分发器按事件合并发送，这里只计数）
+                    detections = extract_detections(results[0])
+                    for det in detections:
+                        detections_total.labels(CAMERA, det['class']).inc()
+                    danger_classes = {det['class'] for det in detections if det['class'] in DANGER_CLASSES}
+                    for cls in danger_classes:
+                        danger_frames_total.labels(CAMERA, cls).inc()
+                    has_danger = bool(danger_classes)
+                    if has_danger:
+                        stats['last_detection_time'] = time.time()
+                    
+                    self.last_danger = has_danger
+                    # 检测事件（前端据此在原始画面上自行绘制检测框）
+                    event = {
+                        "frame_id": frame_id,
+                        "timestamp": trace.wall_time,
+                        "width": frame.shape[1],
+                        "height": frame.shape[0],
+                        "has_danger": has_danger,
+                        "detections": detections,
+                        "latency": trace.to_dict(),
+                    }
+                    detection_events.publish(event)
+                    if alarms is not None:
+                        alarms.submit(event)
+                    if detection_store is not None:
+                        detection_store.record(event)
+                    # 火情事件经磁盘暂存后上报，断网期间不丢失，也不在推理线程做网络 I/O
+                    if event_spool is not None and has_danger:
+                        event_spool.append({"type": "detection", "camera": CAMERA, **event})
+                    
+                    # 没有客户端观看标注画面时，跳过绘制和编码
+                    if not self.annotate:
+                        continue
                     
                     # 绘制检测框
+                    encode_start = time.perf_counter()
                     annotated_frame = results[0].plot(line_width=3, font_size=1)
                     
                     # JPEG编码
                     encode_params = [cv2.IMWRITE_JPEG_QUALITY, CONFIG['jpeg_quality']]
                     ret, jpeg = cv2.imencode('.jpg', annotated_frame, encode_params)
+                    _encode_annotated.observe(time.perf_counter() - encode_start)
                     
                     if ret:
-                        # 将结果放入结果队列
-                        self.result_queue.put((jpeg.tobytes(), frame_id, has_danger))
+                        # 将结果放入结果队列（满了丢弃最旧的结果，推理线程不阻塞）
+                        result = (jpeg.tobytes(), frame_id, has_danger, annotated_frame, trace.mark('encode'))
+                        try:
+                            self.result_queue.put_nowait(result)
+                        except Full:
+                            try:
+                                self.result_queue.get_nowait()
+                            except Empty:
+                                pass
+                            self.result_queue.put_nowait(result)
                     
                 except Empty:
                     continue
@@ -242,45 +430,114 @@ class EdgeCamera:
         self.inference_thread.start()
         logging.info("✅ 推理线程已启动")
 
-    def get_frame(self):
+    def set_annotate(self, enabled):
+        """开关服务端标注；关闭时丢弃缓存的标注帧，重新开启时丢弃关闭前留在结果队列中的结果，避免输出过期画面"""
+        if enabled == self.annotate:
+            return
+        self.annotate = enabled
+        if not enabled:
+            self.last_frame = None
+            self.last_image = None
+            self.last_trace = None
+            return
+        while True:
+            try:
+                self.result_queue.get_nowait()
+            except Empty:
+                break
+
+    def read(self):
         """
-        获取帧（异步推理版本）
+        读取一帧原始画面，并按帧跳跃设置送入推理队列
         
         Returns:
-            tuple: (jpeg_bytes, has_danger) 或 (None, False)
+            tuple: (frame, frame_id, trace)；读取失败返回 (None, None, None)
         """
         frame = None
         
         # 读取帧
         with self.lock:
+            if isinstance(self.video, ThreadedSource) and not self.video.isOpened():
+                return None, None, None  # 解码线程自行重连，不重建视频源
             if not self.video or not self.video.isOpened():
                 self.fail_count += 1
                 if self.fail_count >= 10:
                     logging.warning("摄像头断开，尝试重连...")
                     self.open_camera(self.current_source)
-                return None, False
+                return None, None, None
             
             success, frame = self.video.read()
             if not success or frame is None:
+                if isinstance(self.video, ThreadedSource):
+                    # 码流卡住时解码线程阻塞在读取中，由它自行超时重连；重建会泄漏阻塞的解码线程
+                    return None, None, None
                 self.fail_count += 1
                 if self.fail_count >= 10:
                     self.open_camera(self.current_source)
-                return None, False
+                return None, None, None
             
             self.fail_count = 0
+            read_time = time.monotonic()
+            captured = self._source_timestamp(read_time)
 
-        # 帧跳跃：每N帧才推理一次
+        # 帧跳跃：每N帧才推理一次（模型仍在后台加载时直接输出原始画面）
         should_infer = (self.frame_counter % CONFIG['frame_skip'] == 0)
         self.frame_counter += 1
+        frame_id = self.frame_counter
+        trace = FrameTrace(frame_id, captured, read_time).mark('source', read_time)
         
-        if should_infer:
+        if should_infer and model_manager.model is not None:
             # 需要推理：将帧放入队列
             try:
-                self.frame_queue.put_nowait((frame.copy(), self.frame_counter))
-            except:
+                self.frame_queue.put_nowait((frame.copy(), frame_id, trace))
+            except Full:
                 # 队列满，跳过这一帧
-                pass
+                model_manager.note_dropped_frame()
+                _inference_dropped.inc()
+        return frame, frame_id, trace
+
+    def _source_timestamp(self, now):
+        """
+        刚读到的帧在视频源处产生的单调时钟时刻（持锁调用）
+
+        解码线程视频源取解码时刻；V4L2 摄像头取驱动缓冲区时间戳（CLOCK_MONOTONIC，与 time.monotonic()
+        同一时钟），可看出帧在驱动缓冲区中积压了多久。其他后端的 CAP_PROP_POS_MSEC 含义不同，
+        换算出的帧龄不合理时退回读取时刻。
+        """
+        if isinstance(self.video, ThreadedSource):
+            return self.video.frame_time or now
+        try:
+            stamp = self.video.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+        except Exception:
+            return now
+        if 0.0 <= now - stamp < MAX_DRIVER_FRAME_AGE:
+            return stamp
+        return now
+
+    def get_frame(self):
+        """
+        获取帧（异步推理版本）
+        
+        Returns:
+            tuple: (jpeg_bytes, has_danger, image) 或 (None, False, None)
+        """
+        frame, _, trace = self.read()
+        if frame is None:
+            return None, False, None
+        return self.annotated_frame(frame, trace)[:3]
+
+    def annotated_frame(self, frame, trace=None):
+        """
+        取最新的标注结果；还没有推理结果时编码原始帧
         
+        Args:
+            frame: 刚读到的原始帧（没有推理结果时编码它）
+            trace: 该原始帧的延迟追踪
+        
+        Returns:
+            tuple: (jpeg_bytes, has_danger, image, trace) 或 (None, False, None, None)；
+            trace 为所返回画面对应帧的追踪（标注画面来自更早送入推理的帧）
+        """
         # 尝试从结果队列获取最新结果
         latest_result = None
         latest_id = -1
@@ -296,19 +553,21 @@ class EdgeCamera:
                 break
         
         if latest_result:
-            jpeg_bytes, _, has_danger = latest_result
+            jpeg_bytes, _, has_danger, image, result_trace = latest_result
             self.last_frame = jpeg_bytes
-            return jpeg_bytes, has_danger
+            self.last_image = image
+            self.last_trace = result_trace
+            return jpeg_bytes, has_danger, image, result_trace
         elif self.last_frame:
             # 使用缓存的最后一帧
-            return self.last_frame, False
+            return self.last_frame, False, self.last_image, self.last_trace
         else:
             # 没有结果，返回原始帧
             encode_params = [cv2.IMWRITE_JPEG_QUALITY, CONFIG['jpeg_quality']]
             ret, jpeg = cv2.imencode('.jpg', frame, encode_params)
             if ret:
-                return jpeg.tobytes(), False
-            return None, False
+                return jpeg.tobytes(), False, frame, trace.mark('encode') if trace is not None else None
+            return None, False, None, None
 
     def release(self):
         """释放资源"""
@@ -322,41 +581,167 @@ class EdgeCamera:
                     logging.warning(f"释放摄像头时出错: {e}")
 
 
-# 全局摄像头实例
-global_camera = EdgeCamera()
+# 视频源：摄像头索引、rtsp/http 地址、视频文件或图片目录（CAMERA_PACE=fast 时文件不限速回放）
+CAMERA_SOURCE = os.getenv('CAMERA_SOURCE', '0')
+CAMERA_PACE = os.getenv('CAMERA_PACE', 'realtime')
+# 全局摄像头实例（摄像头在后台打开，不阻塞 HTTP 服务启动）
+global_camera = EdgeCamera(source=CAMERA_SOURCE, open_now=False)
+# 共享帧缓冲区（采集线程写，所有视频流客户端读）
+frame_buffer = get_buffer('default')
+# 原始画面缓冲区（不绘制检测框，配合 /api/events 由前端叠加）
+raw_buffer = get_buffer('default/raw')
+# 检测事件广播（/api/events）
+detection_events = EventBroadcaster('detection')
+# 告警片段录制（录制原始画面，CLIP_RECORDING=0 关闭）
+clip_recorder = ClipRecorder(raw_buffer) if os.getenv('CLIP_RECORDING', '1') != '0' else None
+# 检测历史（SQLite，DETECTION_HISTORY=0 关闭）
+detection_store = DetectionStore() if os.getenv('DETECTION_HISTORY', '1') != '0' else None
+# 告警分发（确认、合并后并发通知各渠道，ALARM=0 关闭）
+alarms = AlarmDispatcher() if os.getenv('ALARM', '1') != '0' else None
+# 火情事件暂存转发（设置 SPOOL_UPLOAD_URL 开启）
+event_spool = EventSpool() if SPOOL_UPLOAD_URL else None
+# 能源遥测采集（逆变器/BMS/环境传感器，TELEMETRY=0 关闭）
+telemetry = TelemetryService() if os.getenv('TELEMETRY', '1') != '0' else None
+# 遥测时序存储（原始样本 + 1m/15m/1h 汇总，TELEMETRY_HISTORY=0 关闭）
+timeseries = TimeSeriesStore() if telemetry is not None and os.getenv('TELEMETRY_HISTORY', '1') != '0' else None
+if timeseries is not None:
+    telemetry.add_listener(timeseries.add)
+# 遥测增量推送（/api/telemetry/stream）
+telemetry_stream = TelemetryDeltaStream() if telemetry is not None else None
+if telemetry_stream is not None:
+    telemetry.add_listener(telemetry_stream.on_sample)
+# 连续录像（DVR_RECORDING=1 开启，会持续写盘）
+dvr_recorder = dvr.DVRRecorder(raw_buffer) if os.getenv('DVR_RECORDING', '0') == '1' else None
+# 管理接口（现场诊断）的访问令牌；未设置时管理接口不可用
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
 
+# 快照长轮询最长等待时间（秒）
+MAX_SNAPSHOT_WAIT = 30.0
+# 缓冲区还没有画面、或无人观看期间画面已过时（如刚开始轮询）时等待新一帧的时间（秒）
+FIRST_SNAPSHOT_WAIT = 2.0
 
-def generate_frames():
-    """生成视频流（带帧率控制和资源监控）"""
-    target_fps = CONFIG['target_fps']
-    frame_time = 1.0 / target_fps
+
+def _parse_time(value):
+    """时间参数：Unix 秒或 ISO 8601（无时区按本地时间）"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def parse_replay_args(args):
+    """
+    解析回放参数: camera, from, to（必填）, speed=回放倍速（0 为不限速）, format=multipart|raw
+
+    Raises:
+        ValueError: 参数缺失或格式错误
+    """
+    if not args.get('from') or not args.get('to'):
+        raise ValueError("缺少 from / to 参数")
+    from_ts, to_ts = _parse_time(args['from']), _parse_time(args['to'])
+    if to_ts <= from_ts:
+        raise ValueError("to 必须晚于 from")
+    speed = max(0.0, float(args.get('speed', 1)))
+    fmt = args.get('format', 'multipart')
+    if fmt not in ('multipart', 'raw'):
+        raise ValueError(f"未知的输出格式: {fmt}")
+    return args.get('camera', 'default'), from_ts, to_ts, speed, fmt
+
+
+def generate_replay(segments, speed):
+    """按录制时间间隔（除以倍速）输出 MJPEG 回放流"""
+    first_ts = None
+    start = time.monotonic()
+    for ts_ms, jpeg in dvr.read_frames(segments):
+        if speed > 0:
+            if first_ts is None:
+                first_ts = ts_ms
+            delay = (ts_ms - first_ts) / 1000.0 / speed - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+        yield (b'--frame\r\n'
+               b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+
+
+def snapshot_buffer(camera, raw=False):
+    """快照接口使用的缓冲区：标注画面或原始画面"""
+    return find_buffer(f'{camera}/raw' if raw else camera)
+
+
+def parse_snapshot_wait(value):
+    """
+    解析长轮询等待时间参数
+
+    Raises:
+        ValueError: 参数格式错误
+    """
+    if value is None:
+        return 0.0
+    return min(MAX_SNAPSHOT_WAIT, max(0.0, float(value)))
+
+
+# 按规格编码的共享缓存（同一帧同一规格只编码一次）
+variant_cache = VariantCache()
+
+
+def _init_camera():
+    """后台启动阶段：打开摄像头"""
+    global_camera.open_camera(global_camera.current_source, pace=CAMERA_PACE)
+    if not (global_camera.video and global_camera.video.isOpened()):
+        raise RuntimeError(f"无法打开视频源: {describe_source(global_camera.current_source)}")
+
+
+def start_background_init():
+    """并行启动模型加载与摄像头打开，并启动采集线程"""
+    startup.run_in_background('model', _init_model)
+    startup.run_in_background('camera', _init_camera)
+    threading.Thread(target=capture_worker, name='capture', daemon=True).start()
+    if clip_recorder is not None:
+        clip_recorder.start()
+    if dvr_recorder is not None:
+        dvr_recorder.start()
+    if detection_store is not None:
+        detection_store.start()
+    if alarms is not None:
+        alarms.start()
+    if event_spool is not None:
+        event_spool.start()
+    if timeseries is not None:
+        timeseries.start()
+    if telemetry_stream is not None:
+        telemetry_stream.start()
+    if telemetry is not None:
+        telemetry.start()
+
+
+def capture_worker():
+    """
+    采集线程：唯一读取摄像头的线程，按目标帧率把帧发布到共享缓冲区
+    （带帧率控制和资源监控）
+    """
     last_time = time.time()
     fps_buffer = deque(maxlen=30)
+    last_annotated = None  # 上次发布的标注画面的追踪（缓存画面重复发布时不重复统计阶段耗时）
     
     # 资源监控间隔
     last_stats_time = time.time()
     stats_interval = 5.0  # 每5秒更新一次统计
     
-    while True:
+    while global_camera.running:
         current_time = time.time()
         
-        # 帧率控制
+        # 帧率控制（目标帧率可能在后台 GPU 检查后调整，每帧读取；不限速回放时不控制）
+        frame_time = 1.0 / CONFIG['target_fps']
         elapsed = current_time - last_time
-        if elapsed < frame_time:
+        if elapsed < frame_time and not global_camera.unpaced:
             time.sleep(frame_time - elapsed)
-        
         last_time = time.time()
-        fps_buffer.append(last_time)
         
-        # 计算FPS
-        if len(fps_buffer) > 1:
-            stats['current_fps'] = len(fps_buffer) / (fps_buffer[-1] - fps_buffer[0])
-        
-        # 定期更新资源使用情况
+        # 定期更新资源使用情况（非阻塞采样）
         if current_time - last_stats_time > stats_interval:
             try:
                 import psutil
-                stats['cpu_usage'] = psutil.cpu_percent(interval=0.1)
+                stats['cpu_usage'] = psutil.cpu_percent(interval=None)
                 stats['memory_usage'] = psutil.virtual_memory().percent
             except ImportError:
                 pass
@@ -364,29 +749,353 @@ def generate_frames():
                 pass
             last_stats_time = current_time
         
-        # 获取帧
-        frame_data, has_danger = global_camera.get_frame()
-        stats['total_frames'] += 1
-        
-        if frame_data is None:
+        # 获取帧；标注画面和原始画面只为有客户端在看的缓冲区生成
+        try:
+            read_start = time.perf_counter()
+            frame, frame_id, trace = global_camera.read()
+            if frame is None:
+                time.sleep(0.01)
+                continue
+            _capture_time.observe(time.perf_counter() - read_start)
+            
+            want_annotated = frame_buffer.has_readers()
+            global_camera.set_annotate(want_annotated)
+            if want_annotated:
+                frame_data, has_danger, image, annotated_trace = global_camera.annotated_frame(frame, trace)
+                if frame_data is not None:
+                    published = frame_buffer.publish(
+                        frame_data, has_danger=has_danger, image=image, frame_id=frame_id, trace=annotated_trace
+                    )
+                    if annotated_trace is not None and annotated_trace is not last_annotated:
+                        record_stages('annotated', published.trace)
+                    last_annotated = annotated_trace
+            
+            if raw_buffer.has_readers():
+                encode_start = time.perf_counter()
+                encode_params = [cv2.IMWRITE_JPEG_QUALITY, CONFIG['jpeg_quality']]
+                ret, jpeg = cv2.imencode('.jpg', frame, encode_params)
+                _encode_raw.observe(time.perf_counter() - encode_start)
+                if ret:
+                    published = raw_buffer.publish(
+                        jpeg.tobytes(), has_danger=global_camera.last_danger, image=frame, frame_id=frame_id,
+                        trace=trace.mark('encode')
+                    )
+                    record_stages('raw', published.trace)
+        except Exception as e:
+            logging.error(f"采集线程出错: {e}", exc_info=True)
             time.sleep(0.01)
             continue
         
-        # MJPEG 格式流
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_data + b'\r\n')
+        _captured.inc()
+        
+        # 计算FPS
+        fps_buffer.append(time.time())
+        if len(fps_buffer) > 1:
+            stats['current_fps'] = len(fps_buffer) / (fps_buffer[-1] - fps_buffer[0])
+
+
+def generate_frames(profile=None):
+    """
+    生成视频流（从共享缓冲区读取，不直接访问摄像头）
+    
+    Args:
+        profile: 客户端请求的规格（StreamProfile），网络拥塞时自动降级
+    """
+    profile = profile or StreamProfile()
+    stream = AdaptiveStream(profile, CONFIG['jpeg_quality'], CONFIG['target_fps'])
+    buffer = raw_buffer if profile.raw else frame_buffer
+    last_seq = buffer.stale_seq()
+    clients = stream_clients.labels(CAMERA, 'mjpeg')
+    delivery = delivery_seconds.labels(CAMERA, 'mjpeg')
+    sent = frames_sent_total.labels(CAMERA, 'mjpeg')
+    frame_delivery = FrameDelivery('mjpeg', profile.raw)
+    clients.inc()
+    try:
+        with buffer.reader():
+            while True:
+                frame = buffer.wait_next(last_seq, timeout=1.0)
+                if frame is None:
+                    continue
+                last_seq = frame.seq
+                if not stream.should_send():
+                    continue
+                
+                width, quality = stream.variant(CONFIG['resolution'][0])
+                frame_data = variant_cache.get(buffer.name, frame, width, quality, CONFIG['jpeg_quality'])
+                
+                # MJPEG 格式流；生成器恢复执行时上一块数据已写入套接字，耗时即发送阻塞时间
+                send_start = time.monotonic()
+                yield mjpeg_part(frame, frame_data)
+                send_time = time.monotonic() - send_start
+                stream.on_sent(send_time)
+                delivery.observe(send_time)
+                sent.inc()
+                frame_delivery.record(frame)
+    finally:
+        clients.dec()
 
 
 # --- API 路由 ---
 
 @app.route('/video_feed')
 def video_feed():
-    """视频流接口"""
+    """
+    视频流接口
+    
+    可选参数: size=480p|640x360, q=JPEG质量, fps=帧率上限, adaptive=0 关闭自动降级,
+             mode=raw 输出不带检测框的原始画面（配合 /api/events 在前端绘制）
+    """
+    try:
+        profile = StreamProfile.from_args(request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"无效的视频流参数: {e}"}), 400
+    return Response(
+        generate_frames(profile),
+        mimetype='multipart/x-mixed-replace; boundary=frame'
+    )
+
+@app.route('/api/events')
+def detection_event_stream():
+    """
+    检测事件流（Server-Sent Events）
+    
+    每次推理推送一条 detection 事件: frame_id, timestamp, width, height, has_danger,
+    detections=[{class, confidence, box: [x1, y1, x2, y2]}]；断线重连按 Last-Event-ID 补发
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_id')
+    return Response(
+        detection_events.sse_stream(last_event_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/snapshot', defaults={'camera': 'default'})
+@app.route('/api/snapshot/<path:camera>')
+def snapshot(camera):
+    """
+    最新一帧 JPEG（直接取自内存中的共享缓冲区）
+    
+    支持 ETag / Last-Modified 条件请求（画面未变返回 304）；
+    可选参数: raw=1 原始画面, wait=秒数 长轮询（画面与 If-None-Match 相同时等待下一帧）
+    """
+    raw = request.args.get('raw') in ('1', 'true', 'yes')
+    buffer = snapshot_buffer(camera, raw)
+    if buffer is None:
+        return jsonify({"status": "error", "message": f"未知摄像头: {camera}"}), 404
+    try:
+        wait = parse_snapshot_wait(request.args.get('wait'))
+    except ValueError:
+        return jsonify({"status": "error", "message": "无效的 wait 参数"}), 400
+    stale = buffer.stale_seq()
+    buffer.touch()
+    
+    frame = buffer.latest
+    if frame is None or frame.seq <= stale:
+        # 还没有画面，或无人观看期间缓冲区停止了更新：等采集线程发布新的一帧
+        frame = buffer.wait_next(stale, timeout=max(wait, FIRST_SNAPSHOT_WAIT)) or buffer.latest
+        if frame is None:
+            return jsonify({"status": "error", "message": "暂无画面"}), 503, {'Retry-After': '1'}
+    
+    if wait > 0:
+        known = [buffer.seq_from_etag(tag) for tag in request.if_none_match.as_set()]
+        known = [seq for seq in known if seq is not None]
+        if known and frame.seq <= max(known):
+            frame = buffer.wait_next(max(known), timeout=wait) or buffer.latest
+    
+    response = Response(frame.jpeg, mimetype='image/jpeg')
+    response.set_etag(buffer.etag(frame))
+    response.last_modified = frame.timestamp
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Timestamp'] = f'{frame.timestamp:.3f}'
+    if frame.frame_id is not None:
+        response.headers['X-Frame-Id'] = str(frame.frame_id)
+    if frame.trace is not None:
+        response.headers.update(trace_headers(frame.trace))
+    response = response.make_conditional(request)
+    if response.status_code == 200:
+        frames_sent_total.labels(camera, 'snapshot').inc()
+        if camera == CAMERA:
+            FrameDelivery('snapshot', raw).record(frame)
+    return response
+
+@app.route('/api/clips')
+def list_clips():
+    """告警片段录制状态及最近保存的片段"""
+    if clip_recorder is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **clip_recorder.status()})
+
+@app.route('/api/clips/<path:filename>')
+def download_clip(filename):
+    """下载告警片段（.mjpeg 画面或 .json 时间戳索引）"""
+    if clip_recorder is None:
+        return jsonify({"status": "error", "message": "告警片段录制未启用"}), 404
+    mimetype = 'video/x-motion-jpeg' if filename.endswith('.mjpeg') else None
+    return send_from_directory(clip_recorder.writer.directory, filename, mimetype=mimetype)
+
+@app.route('/api/replay')
+def replay():
+    """
+    录像回放
+    
+    参数: camera（默认 default）, from, to（Unix 秒或 ISO 8601）, speed=倍速（默认 1，0 为不限速）,
+          format=raw 输出连续 JPEG 数据（video/x-motion-jpeg）
+    """
+    try:
+        camera, from_ts, to_ts, speed, fmt = parse_replay_args(request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"无效的回放参数: {e}"}), 400
+    segments = dvr.find_frames(dvr.DVR_DIR, camera, from_ts, to_ts)
+    if not segments:
+        return jsonify({"status": "error", "message": "该时间段没有录像"}), 404
+    if fmt == 'raw':
+        return Response(dvr.read_ranges(segments), mimetype='video/x-motion-jpeg')
     return Response(
-        generate_frames(),
+        generate_replay(segments, speed),
         mimetype='multipart/x-mixed-replace; boundary=frame'
     )
 
+def _history_filters(args):
+    """
+    检测历史查询的公共参数: camera, class, from, to（Unix 秒或 ISO 8601）
+
+    Raises:
+        ValueError: 时间格式错误
+    """
+    return {
+        'camera': args.get('camera'),
+        'class_name': args.get('class'),
+        'from_ts': _parse_time(args['from']) if args.get('from') else None,
+        'to_ts': _parse_time(args['to']) if args.get('to') else None,
+    }
+
+@app.route('/api/detections')
+def detection_history():
+    """
+    检测历史明细（按时间倒序分页）
+    
+    参数: camera, class, from, to, limit（默认 100，最大 1000）, cursor=上一页返回的 next_cursor
+    """
+    if detection_store is None:
+        return jsonify({"status": "error", "message": "检测历史未启用"}), 404
+    try:
+        filters = _history_filters(request.args)
+        page = detection_store.query(
+            limit=int(request.args.get('limit', 100)), cursor=request.args.get('cursor'), **filters
+        )
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"无效的查询参数: {e}"}), 400
+    return jsonify(page)
+
+@app.route('/api/detections/hourly')
+def detection_hourly():
+    """按小时汇总的检测事件数（同一帧同一类别只计一次）"""
+    if detection_store is None:
+        return jsonify({"status": "error", "message": "检测历史未启用"}), 404
+    try:
+        filters = _history_filters(request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"无效的查询参数: {e}"}), 400
+    return jsonify({"items": detection_store.hourly(**filters), "store": detection_store.status()})
+
+@app.route('/api/alarms')
+def alarm_status():
+    """当前告警、最近结束的告警及各通知渠道状态"""
+    if alarms is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **alarms.status()})
+
+@app.route('/api/spool')
+def spool_status():
+    """事件暂存转发状态（待上传条数、上传/丢弃计数、最近错误）"""
+    if event_spool is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **event_spool.status()})
+
+@app.route('/api/telemetry')
+def telemetry_latest():
+    """各遥测通道最新值及设备轮询状态"""
+    if telemetry is None:
+        return jsonify({"status": "error", "message": "遥测采集未启用"}), 404
+    return jsonify({
+        "channels": telemetry.latest(),
+        **telemetry.status(),
+        "history": timeseries.status() if timeseries is not None else None,
+        "stream": telemetry_stream.status(),
+    })
+
+@app.route('/api/telemetry/stream')
+def telemetry_event_stream():
+    """
+    遥测推送（Server-Sent Events）
+    
+    连接后先收到 snapshot 事件（全部通道当前值和单位），之后只推送 delta 事件（变化的通道）；
+    各通道按各自的最短间隔和死区推送，断线重连时重新发送 snapshot
+    """
+    if telemetry_stream is None:
+        return jsonify({"status": "error", "message": "遥测采集未启用"}), 404
+    return Response(
+        telemetry_stream.sse_stream(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/telemetry/history')
+def telemetry_history():
+    """
+    遥测历史曲线（按时间范围自动选择原始样本或 1m/15m/1h 汇总，并用 LTTB 降采样）
+    
+    参数: channel, from, to（Unix 秒或 ISO 8601，默认最近 1 小时）, width=图表像素宽度（默认 600）
+    """
+    if timeseries is None:
+        return jsonify({"status": "error", "message": "遥测历史未启用"}), 404
+    channel = request.args.get('channel', '')
+    if channel not in CHANNELS:
+        return jsonify({"status": "error", "message": f"未知通道: {channel}"}), 404
+    try:
+        to_ts = _parse_time(request.args['to']) if request.args.get('to') else time.time()
+        from_ts = _parse_time(request.args['from']) if request.args.get('from') else to_ts - 3600
+        width = int(request.args.get('width', 600))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"无效的查询参数: {e}"}), 400
+    if from_ts >= to_ts:
+        return jsonify({"status": "error", "message": "from 必须早于 to"}), 400
+    return jsonify({
+        "channel": channel,
+        "unit": CHANNELS[channel][0],
+        **timeseries.query(channel, from_ts, to_ts, width),
+    })
+
+@app.route('/api/telemetry/<channel>')
+def telemetry_channel(channel):
+    """
+    单通道最近的原始样本（来自内存环形缓冲区）
+    
+    参数: seconds=最近多少秒（默认 300）
+    """
+    if telemetry is None:
+        return jsonify({"status": "error", "message": "遥测采集未启用"}), 404
+    if channel not in telemetry.rings:
+        return jsonify({"status": "error", "message": f"未知通道: {channel}"}), 404
+    try:
+        seconds = float(request.args.get('seconds', 300))
+    except ValueError:
+        return jsonify({"status": "error", "message": "无效的 seconds 参数"}), 400
+    timestamps, values = telemetry.rings[channel].window(since=time.time() - seconds)
+    return jsonify({
+        "channel": channel,
+        "unit": CHANNELS.get(channel, ('', ''))[0],
+        "timestamps": timestamps,
+        "values": values,
+    })
+
+@app.route('/api/recordings')
+def recording_status():
+    """连续录像状态"""
+    if dvr_recorder is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **dvr_recorder.status()})
+
 @app.route('/api/cameras')
 def get_cameras():
     """扫描可用摄像头"""
@@ -409,30 +1118,54 @@ def get_cameras():
 
 @app.route('/api/switch_camera', methods=['POST'])
 def switch_camera():
-    """切换摄像头"""
+    """
+    切换视频源
+    
+    请求体: {"index": 摄像头索引}，或 {"source": rtsp/http 地址、视频文件路径、图片目录,
+            "pace": "realtime" | "fast", "loop": true | false}
+    
+    按 source 切换到摄像头索引以外的视频源（可读取本机文件、访问任意地址）属于管理操作，需要 ADMIN_TOKEN
+    """
     try:
         data = request.json
         if not data:
             return jsonify({"status": "error", "message": "请求体为空"}), 400
-        new_index = int(data.get('index', 0))
-        global_camera.open_camera(new_index)
-        return jsonify({"status": "success", "message": f"已切换到 {new_index}"})
+        source = data['source'] if data.get('source') not in (None, '') else int(data.get('index', 0))
+        if not (isinstance(source, int) or str(source).strip().isdigit()):
+            # 先鉴权再解析，未授权时不透露路径是否存在
+            denied = admin_denied()
+            if denied is not None:
+                return denied
+        pace = data.get('pace', 'realtime')
+        parse_source(source)
+        if pace not in ('realtime', 'fast'):
+            raise ValueError(f"未知的回放速度: {pace}")
+    except (ValueError, TypeError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    try:
+        global_camera.open_camera(source, pace=pace, loop=bool(data.get('loop', True)))
+        return jsonify({
+            "status": "success",
+            "message": f"已切换到 {describe_source(source)}",
+            "source": global_camera.source_status(),
+        })
     except Exception as e:
         logging.error(f"切换摄像头失败: {e}", exc_info=True)
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route('/api/stats')
 def get_stats():
-    """获取统计信息"""
+    """获取统计信息（detected_fires / detected_smoke 为检出该类别的推理帧数）"""
     return jsonify({
-        "total_frames": stats['total_frames'],
-        "detected_fires": stats['detected_fires'],
-        "detected_smoke": stats['detected_smoke'],
+        "total_frames": _captured.value,
+        "detected_fires": danger_frames_total.labels(CAMERA, 'fire').value,
+        "detected_smoke": danger_frames_total.labels(CAMERA, 'smoke').value,
         "current_fps": round(stats['current_fps'], 2),
         "inference_fps": round(stats['inference_fps'], 2),
         "cpu_usage": round(stats['cpu_usage'], 1),
         "memory_usage": round(stats['memory_usage'], 1),
         "last_detection_time": stats['last_detection_time'],
+        "stream_cache": variant_cache.stats(),
         "device_config": {
             "name": CONFIG['name'],
             "resolution": f"{CONFIG['resolution'][0]}x{CONFIG['resolution'][1]}",
@@ -443,18 +1176,164 @@ def get_stats():
         }
     })
 
+@app.route('/api/latency')
+def get_latency():
+    """
+    最近若干帧的延迟分解（毫秒，p50 / p95 / max）
+
+    annotated / raw 为两种画面发布前各阶段的耗时；mjpeg / ws / snapshot 为送达各类客户端时的
+    send 阶段耗时和帧龄（age，从视频源产生该帧到写入连接）。阶段含义见 frame_trace。
+    """
+    return jsonify({"window": latency.window, **latency.summary()})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """运行指标（Prometheus 文本格式）"""
+    return Response(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+
+def admin_denied():
+    """
+    检查管理接口鉴权：请求头 Authorization: Bearer <ADMIN_TOKEN>（或 X-Admin-Token）
+
+    Returns:
+        拒绝时的错误响应；通过时返回 None
+    """
+    if not ADMIN_TOKEN:
+        return jsonify({"status": "error", "message": "管理接口未启用（未设置 ADMIN_TOKEN）"}), 404
+    auth = request.headers.get('Authorization', '')
+    token = auth[len('Bearer '):] if auth.startswith('Bearer ') else request.headers.get('X-Admin-Token', '')
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        return jsonify({"status": "error", "message": "未授权"}), 401, {'WWW-Authenticate': 'Bearer'}
+    return None
+
+def admin_required(view):
+    """管理接口鉴权装饰器（见 admin_denied）"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        denied = admin_denied()
+        if denied is not None:
+            return denied
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/api/admin/profile/cpu', methods=['POST'])
+@admin_required
+def profile_cpu():
+    """
+    采样所有线程的 CPU 调用栈（请求在采样结束后返回）
+
+    可选参数: seconds=时长（默认 10，最长 60）, hz=采样频率（默认 100）,
+             mode=cpu 按线程 CPU 时间加权（Linux 默认）| wall 按采样次数,
+             format=collapsed 折叠栈文本（默认，可生成火焰图）| json 按函数汇总
+    """
+    try:
+        seconds = profiler.parse_duration(request.args.get('seconds'))
+        hz = float(request.args.get('hz', 1.0 / profiler.DEFAULT_INTERVAL))
+        if hz <= 0:
+            raise ValueError("hz 应大于 0")
+        fmt = request.args.get('format', 'collapsed')
+        if fmt not in ('collapsed', 'json'):
+            raise ValueError(f"未知的输出格式: {fmt}")
+        logging.info(f"🩺 CPU 采样开始（{seconds:.0f} 秒）")
+        result = profiler.profile_cpu(seconds, 1.0 / hz, request.args.get('mode'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except profiler.ProfilerBusy as e:
+        return jsonify({"status": "error", "message": str(e)}), 409
+    if fmt == 'json':
+        return jsonify(result.to_dict())
+    return Response(result.collapsed(), content_type='text/plain; charset=utf-8', headers={
+        'X-Profile-Mode': result.mode,
+        'X-Profile-Samples': str(result.samples),
+    })
+
+@app.route('/api/admin/profile/memory', methods=['POST'])
+@admin_required
+def profile_memory():
+    """
+    统计一段时间内新增且未释放的内存分配（tracemalloc 快照对比，请求在统计结束后返回）
+
+    可选参数: seconds=时长（默认 10，最长 60）, top=列出的分配位置数（默认 30）,
+             group=lineno 按代码行（默认）| filename 按文件 | traceback 按调用栈
+    """
+    try:
+        seconds = profiler.parse_duration(request.args.get('seconds'))
+        top = int(request.args.get('top', profiler.DEFAULT_TOP))
+        logging.info(f"🩺 内存分配统计开始（{seconds:.0f} 秒）")
+        result = profiler.profile_memory(seconds, top, request.args.get('group', 'lineno'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except profiler.ProfilerBusy as e:
+        return jsonify({"status": "error", "message": str(e)}), 409
+    return jsonify(result)
+
+def _readiness():
+    """
+    就绪状态：启动阶段未结束为 starting，模型已加载且摄像头在线为 ready，否则 not_ready
+    """
+    if startup.readiness() == 'starting':
+        return 'starting'
+    camera_ok = global_camera.video is not None and global_camera.video.isOpened()
+    if model_manager.model is not None and camera_ok:
+        return 'ready'
+    return 'not_ready'
+
 @app.route('/api/health')
 def health_check():
     """健康检查接口"""
     camera_status = "ok" if (global_camera.video and global_camera.video.isOpened()) else "error"
+    readiness = _readiness()
     return jsonify({
-        "status": "ok",
+        "status": "ok" if readiness == 'ready' else readiness,
+        "liveness": "alive",
+        "readiness": readiness,
         "camera": camera_status,
-        "model_loaded": model is not None,
+        "video_source": global_camera.source_status(),
+        "model_loaded": model_manager.model is not None,
+        "model_path": model_manager.model_path,
         "device": device,
         "device_type": detected_device_type,
+        "startup": startup.summary(),
     })
 
+@app.route('/api/health/live')
+def liveness_probe():
+    """存活探针：进程能响应 HTTP 即为存活"""
+    return jsonify({"liveness": "alive"})
+
+@app.route('/api/health/ready')
+def readiness_probe():
+    """就绪探针：未就绪时返回 503，便于负载均衡/守护进程判断"""
+    readiness = _readiness()
+    return jsonify({"readiness": readiness}), (200 if readiness == 'ready' else 503)
+
+@app.route('/api/model')
+def get_model_status():
+    """获取当前模型及热切换状态"""
+    return jsonify(model_manager.status())
+
+@app.route('/api/model/swap', methods=['POST'])
+def swap_model():
+    """热切换模型：后台加载预热新模型，旧模型继续服务，成功后原子替换"""
+    try:
+        data = request.json
+        if not data:
+            return jsonify({"status": "error", "message": "请求体为空"}), 400
+        if data.get('model'):
+            model_path = resolve_model_file(data['model'])
+        else:
+            model_path = get_model_path(data.get('model_size', CONFIG['model_size']))
+    except (ValueError, FileNotFoundError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    if not model_manager.swap_async(model_path):
+        return jsonify({"status": "error", "message": "已有模型切换正在进行"}), 409
+    return jsonify({
+        "status": "accepted",
+        "message": f"正在后台加载 {model_path}",
+        "model": model_manager.status(),
+    }), 202
+
 @app.route('/api/config')
 def get_config():
     """获取当前配置"""
@@ -462,9 +1341,9 @@ def get_config():
 
 @app.route('/api/debug_frame')
 def debug_frame():
-    """调试接口（兼容原版）"""
+    """调试接口：返回最近一次检测结果（实时推送见 /api/events）"""
     return jsonify({
-        "message": "请查看终端日志输出",
+        "last_detection": detection_events.latest(),
         "stats": stats,
         "config": CONFIG,
         "device_type": detected_device_type
@@ -476,13 +1355,18 @@ def _cleanup_and_exit(signum, frame):
     """清理资源并退出"""
     logging.info('👋 服务正在停止...')
     global_camera.release()
+    # 写完队列中尚未落盘的数据再退出
+    if detection_store is not None:
+        detection_store.stop()
+    if event_spool is not None:
+        event_spool.stop()
     sys.exit(0)
 
 signal.signal(signal.SIGINT, _cleanup_and_exit)
 signal.signal(signal.SIGTERM, _cleanup_and_exit)
 
 if __name__ == '__main__':
-    logging.info(f"🚀 启动边缘设备服务器 (端口: 5000)")
+    logging.info(f"🚀 启动边缘设备服务器 (端口: {PORT})")
     logging.info(f"📊 设备: {CONFIG['name']}")
     logging.info(f"📊 模型: {MODEL_PATH}")
     
@@ -493,5 +1377,7 @@ if __name__ == '__main__':
         logging.warning("psutil 未安装，资源监控功能将不可用")
         logging.warning("建议安装: pip install psutil")
     
-    app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
+    start_background_init()
+    startup.record('http_start', time.time() - PROCESS_START)
+    app.run(host='0.0.0.0', port=PORT, debug=False, threaded=True)
 
@@ -9,7 +9,11 @@
 6. 改进异常处理
 7. 资源清理
 8. 统计信息
+9. 快速启动（模型加载与摄像头打开在后台并行进行）
 """
+# 最先导入，用于统计各启动阶段耗时
+from startup import StartupTracker, PROCESS_START
+
 import cv2
 import threading
 import platform
@@ -21,11 +25,14 @@ import numpy as np
 from collections import deque
 from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
-from ultralytics import YOLO
 
 app = Flask(__name__)
 CORS(app)
 
+# 启动阶段统计（HTTP 服务先监听，模型和摄像头在后台并行初始化）
+startup = StartupTracker(required=('model', 'camera'))
+startup.record('imports', time.time() - PROCESS_START)
+
 # --- 配置参数 ---
 CONFIG = {
     'DETECTION_CONF': 0.15,  # 检测置信度阈值
@@ -53,44 +60,56 @@ stats = {
     'last_detection_time': None,
 }
 
-# --- 加载模型 ---
-logging.info("正在加载 YOLO 模型 (fire_m.pt)...")
-try:
-    model = YOLO('fire_m.pt')
+# --- 加载模型（后台进行）---
+model = None
+device = 'cpu'
+
+
+def _load_model():
+    """后台启动阶段：加载并预热模型，检查 CUDA 状态"""
+    global model, device
+    from ultralytics import YOLO
+
+    logging.info("正在加载 YOLO 模型 (fire_m.pt)...")
+    start_time = time.time()
+    loaded_model = YOLO('fire_m.pt')
+    startup.record('model_load', time.time() - start_time)
     logging.info("模型加载成功，正在预热...")
-    
+
     # 模型预热：使用虚拟帧进行推理
+    start_time = time.time()
     dummy_frame = np.zeros((CONFIG['CAMERA_HEIGHT'], CONFIG['CAMERA_WIDTH'], 3), dtype=np.uint8)
-    _ = model(dummy_frame, conf=CONFIG['DETECTION_CONF'], verbose=False)
+    _ = loaded_model(dummy_frame, conf=CONFIG['DETECTION_CONF'], verbose=False)
+    startup.record('model_warmup', time.time() - start_time)
     logging.info("✅ 模型预热完成")
-except Exception as e:
-    logging.error(f"❌ 模型加载失败! 请检查文件名是否正确: {e}")
-    sys.exit(1)
-
-# 检查 CUDA 状态
-try:
-    import torch
-    if torch.cuda.is_available():
-        logging.info(f"🚀 CUDA 就绪! 使用显卡: {torch.cuda.get_device_name(0)}")
-        device = 'cuda'
-    else:
-        logging.warning("⚠️ CUDA 不可用! 正在使用 CPU")
+
+    # 检查 CUDA 状态
+    try:
+        import torch
+        if torch.cuda.is_available():
+            logging.info(f"🚀 CUDA 就绪! 使用显卡: {torch.cuda.get_device_name(0)}")
+            device = 'cuda'
+        else:
+            logging.warning("⚠️ CUDA 不可用! 正在使用 CPU")
+            device = 'cpu'
+    except Exception as e:
+        logging.info(f"无法确定 torch/cuda 状态: {e}")
         device = 'cpu'
-except Exception as e:
-    logging.info(f"无法确定 torch/cuda 状态: {e}")
-    device = 'cpu'
+
+    model = loaded_model
 
 
 # --- 摄像头管理类（优化版）---
 class Camera:
-    def __init__(self, source=0):
+    def __init__(self, source=0, open_now=True):
         self.current_source = source
         self.video = None
-        self.lock = threading.Lock()
+        self.lock = threading.RLock()  # get_frame 持锁时可能触发重连
         self.fail_count = 0
         self.last_frame = None  # 缓存最后一帧
         self.frame_counter = 0  # 帧计数器（用于帧跳跃）
-        self.open_camera(source)
+        if open_now:
+            self.open_camera(source)
 
     def _choose_backend(self):
         """根据系统选择最佳的摄像头后端"""
@@ -183,6 +202,13 @@ class Camera:
         should_infer = (self.frame_counter % CONFIG['FRAME_SKIP'] == 0) and not skip_inference
         self.frame_counter += 1
         
+        # 模型仍在后台加载：直接输出原始画面
+        if model is None:
+            ret, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, CONFIG['JPEG_QUALITY']])
+            if ret:
+                return jpeg.tobytes(), False
+            return None, False
+        
         # 如果不需要推理，直接返回原始帧（使用上次的检测结果）
         if not should_infer and self.last_frame is not None:
             # 使用缓存的最后一帧（已标注）
@@ -263,8 +289,15 @@ class Camera:
                     logging.warning(f"释放摄像头时出错: {e}")
 
 
-# 全局摄像头实例
-global_camera = Camera()
+# 全局摄像头实例（摄像头在后台打开，不阻塞 HTTP 服务启动）
+global_camera = Camera(open_now=False)
+
+
+def _open_camera():
+    """后台启动阶段：打开摄像头"""
+    global_camera.open_camera(global_camera.current_source)
+    if not (global_camera.video and global_camera.video.isOpened()):
+        raise RuntimeError(f"无法打开摄像头索引: {global_camera.current_source}")
 
 
 def generate_frames():
@@ -371,17 +404,39 @@ def get_stats():
         }
     })
 
+def _readiness():
+    """就绪状态：启动阶段未结束为 starting，模型已加载且摄像头在线为 ready，否则 not_ready"""
+    if startup.readiness() == 'starting':
+        return 'starting'
+    camera_ok = global_camera.video is not None and global_camera.video.isOpened()
+    return 'ready' if (model is not None and camera_ok) else 'not_ready'
+
 @app.route('/api/health')
 def health_check():
     """健康检查接口"""
     camera_status = "ok" if (global_camera.video and global_camera.video.isOpened()) else "error"
+    readiness = _readiness()
     return jsonify({
-        "status": "ok",
+        "status": "ok" if readiness == 'ready' else readiness,
+        "liveness": "alive",
+        "readiness": readiness,
         "camera": camera_status,
         "model_loaded": model is not None,
-        "device": device
+        "device": device,
+        "startup": startup.summary(),
     })
 
+@app.route('/api/health/live')
+def liveness_probe():
+    """存活探针"""
+    return jsonify({"liveness": "alive"})
+
+@app.route('/api/health/ready')
+def readiness_probe():
+    """就绪探针：未就绪时返回 503"""
+    readiness = _readiness()
+    return jsonify({"readiness": readiness}), (200 if readiness == 'ready' else 503)
+
 @app.route('/api/debug_frame')
 def debug_frame():
     """调试接口：查看原始检测数据"""
@@ -405,5 +460,8 @@ signal.signal(signal.SIGTERM, _cleanup_and_exit)
 if __name__ == '__main__':
     logging.info(f"🚀 启动服务器 (端口: 5000)")
     logging.info(f"📊 配置: 帧跳跃={CONFIG['FRAME_SKIP']}, 目标FPS={CONFIG['TARGET_FPS']}, 置信度={CONFIG['DETECTION_CONF']}")
+    startup.run_in_background('model', _load_model)
+    startup.run_in_background('camera', _open_camera)
+    startup.record('http_start', time.time() - PROCESS_START)
     app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
 
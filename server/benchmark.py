@@ -0,0 +1,318 @@
+"""
+流水线基准测试 - 逐段测量视频流热路径的耗时，并与保存的基线比较
+各阶段执行的代码与 app_edge 实际运行的代码相同：
+
+    capture      从视频源取帧（ThreadedSource 解码线程，pace=fast）
+    preprocess   letterbox 缩放填充 + BGR→RGB + 归一化（同 ultralytics 推理前处理）
+    inference    模型推理（默认 model_manager.StubModel，纯 CPU、不需要模型文件；--model 用真实模型）
+    postprocess  extract_detections 转换检测结果
+    plot         results[0].plot() 绘制检测框
+    encode       cv2.imencode JPEG 编码
+    multipart    generate_frames() 的 MJPEG 分块拼接（frame_buffer.mjpeg_part）
+    pipeline     capture → inference → postprocess → plot → encode → multipart 整帧
+
+每个阶段报告 p50 / p99 延迟和吞吐；与基线相比退化超过容差时退出码为 1，可直接用于 CI。
+基线与本机硬件绑定（按 device_fingerprint 区分），其他设备上的基线不参与比较。
+
+用法:
+    python3 benchmark.py                                   # 合成帧 + 桩模型，与基线比较
+    python3 benchmark.py --save-baseline                   # 把本次结果保存为基线
+    python3 benchmark.py --frames recorded/ --model yolov8n.pt --iterations 300
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from calibration import synthetic_frames
+from device_config import DEVICE_PRESETS, MODEL_FILES, device_fingerprint, get_model_path, resolve_model_file
+from frame_buffer import Frame, mjpeg_part
+from model_manager import StubModel, extract_detections
+from video_source import ThreadedSource, parse_source
+
+BASELINE_PATH = os.getenv(
+    'BENCHMARK_BASELINE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+)
+STAGES = ('capture', 'preprocess', 'inference', 'postprocess', 'plot', 'encode', 'multipart', 'pipeline')
+# 各阶段轮流使用的输入帧数
+FRAME_POOL = 8
+# 绝对容差（毫秒）：亚毫秒级的阶段受计时抖动影响大，差值小于此值不算退化
+MIN_REGRESSION_MS = 0.05
+
+
+def letterbox(image, size=640, stride=32):
+    """推理前处理：等比缩放、填充到 stride 的整数倍、BGR→RGB、HWC→CHW、归一化到 [0, 1]"""
+    height, width = image.shape[:2]
+    scale = min(size / height, size / width)
+    new_width, new_height = int(round(width * scale)), int(round(height * scale))
+    if (new_width, new_height) != (width, height):
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    pad_w, pad_h = (size - new_width) % stride, (size - new_height) % stride
+    image = cv2.copyMakeBorder(
+        image, pad_h // 2, pad_h - pad_h // 2, pad_w // 2, pad_w - pad_w // 2,
+        cv2.BORDER_CONSTANT, value=(114, 114, 114)
+    )
+    tensor = np.ascontiguousarray(image[:, :, ::-1].transpose(2, 0, 1))
+    return tensor.astype(np.float32) / 255.0
+
+
+def measure(func, inputs, iterations, warmup):
+    """
+    轮流以 inputs 中的元素调用 func
+
+    Returns:
+        tuple: (每次调用耗时（秒）列表, 总耗时)
+    """
+    for i in range(warmup):
+        func(inputs[i % len(inputs)])
+    samples = []
+    start_time = time.perf_counter()
+    for i in range(iterations):
+        call_start = time.perf_counter()
+        func(inputs[i % len(inputs)])
+        samples.append(time.perf_counter() - call_start)
+    return samples, time.perf_counter() - start_time
+
+
+def summarize(samples, elapsed):
+    """延迟分位数（毫秒）和吞吐（次/秒）"""
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    return {
+        'p50_ms': round(percentile(50), 3),
+        'p99_ms': round(percentile(99), 3),
+        'mean_ms': round(sum(samples) / len(samples) * 1000, 3),
+        'fps': round(len(samples) / elapsed, 1) if elapsed > 0 else 0.0,
+    }
+
+
+class FrameSource:
+    """
+    capture 阶段的视频源：图片目录或视频文件循环回放（不限速、不丢帧）
+
+    未指定录制素材时，把合成帧写成 JPEG 图片目录，解码开销接近 MJPEG 摄像头。
+    """
+
+    def __init__(self, path=None, resolution=(640, 480)):
+        self._tempdir = None
+        if path is None:
+            self._tempdir = tempfile.mkdtemp(prefix='benchmark-')
+            for i, frame in enumerate(synthetic_frames(*resolution, count=FRAME_POOL)):
+                cv2.imwrite(os.path.join(self._tempdir, f'{i:04d}.jpg'), frame, [cv2.IMWRITE_JPEG_QUALITY, 95])
+            path = self._tempdir
+        kind, uri = parse_source(path)
+        if kind not in ('file', 'images'):
+            raise ValueError(f"基准测试只支持视频文件或图片目录: {path}")
+        self.label = 'synthetic' if self._tempdir else os.path.basename(os.path.normpath(path))
+        self.video = ThreadedSource(kind, uri, pace='fast', loop=True)
+        if not self.video.wait_ready():
+            self.close()
+            raise RuntimeError(f"无法打开视频源: {path}")
+
+    def read(self, _=None):
+        ok, frame = self.video.read()
+        if not ok:
+            raise RuntimeError('视频源没有更多帧')
+        return frame
+
+    def close(self):
+        self.video.release()
+        if self._tempdir:
+            shutil.rmtree(self._tempdir, ignore_errors=True)
+
+
+def run_benchmark(source, model, device='cpu', conf=0.25, jpeg_quality=80, imgsz=640,
+                  iterations=200, warmup=10, stages=STAGES):
+    """
+    逐段测量
+
+    Returns:
+        dict: {阶段: {p50_ms, p99_ms, mean_ms, fps}}
+    """
+    encode_params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+
+    def infer(frame):
+        return model(frame, conf=conf, verbose=False, device=device)
+
+    # 各阶段的输入取自上一阶段的真实输出
+    frames = [source.read() for _ in range(FRAME_POOL)]
+    results = [infer(frame) for frame in frames]
+    annotated = [result[0].plot(line_width=3, font_size=1) for result in results]
+    encoded = [Frame(i, cv2.imencode('.jpg', image, encode_params)[1].tobytes(), time.time())
+             for i, image in enumerate(annotated)]
+
+    def pipeline(_):
+        result = infer(source.read())
+        extract_detections(result[0])
+        _, jpeg = cv2.imencode('.jpg', result[0].plot(line_width=3, font_size=1), encode_params)
+        return mjpeg_part(Frame(0, jpeg.tobytes(), time.time()))
+
+    plan = {
+        'capture': (source.read, [None]),
+        'preprocess': (lambda frame: letterbox(frame, imgsz), frames),
+        'inference': (infer, frames),
+        'postprocess': (lambda result: extract_detections(result[0]), results),
+        'plot': (lambda result: result[0].plot(line_width=3, font_size=1), results),
+        'encode': (lambda image: cv2.imencode('.jpg', image, encode_params), annotated),
+        'multipart': (mjpeg_part, encoded),
+        'pipeline': (pipeline, [None]),
+    }
+    report = {}
+    for name in stages:
+        func, inputs = plan[name]
+        report[name] = summarize(*measure(func, inputs, iterations, warmup))
+        logging.info(
+            f"  {name:<12} p50 {report[name]['p50_ms']:>9.3f}ms  p99 {report[name]['p99_ms']:>9.3f}ms  "
+            f"{report[name]['fps']:>9.1f} 次/秒"
+        )
+    return report
+
+
+def load_baseline(path=BASELINE_PATH):
+    """读取基线文件，不存在或格式错误时返回 None"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"⚠️ 基线文件无法读取，忽略: {e}")
+        return None
+
+
+def save_baseline(key, report, path=BASELINE_PATH):
+    """
+    保存本次结果为基线（同一设备的其他配置保留，设备变化时整个文件重写）
+
+    Returns:
+        str: 基线文件路径
+    """
+    fingerprint = device_fingerprint()
+    baseline = load_baseline(path)
+    if not baseline or baseline.get('fingerprint') != fingerprint:
+        baseline = {'fingerprint': fingerprint, 'runs': {}}
+    baseline['runs'][key] = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'stages': report,
+    }
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def compare(report, baseline_stages, tolerance=0.2, p99_tolerance=0.5):
+    """
+    与基线比较
+
+    p50 和吞吐的相对退化超过 tolerance、或 p99 超过 p99_tolerance 记为退化
+    （同时要求绝对差值超过 MIN_REGRESSION_MS）
+
+    Returns:
+        list: 退化描述
+    """
+    regressions = []
+    for name, current in report.items():
+        base = baseline_stages.get(name)
+        if not base:
+            continue
+        for key, limit in (('p50_ms', tolerance), ('p99_ms', p99_tolerance)):
+            allowed = max(base[key] * (1 + limit), base[key] + MIN_REGRESSION_MS)
+            if current[key] > allowed:
+                regressions.append(f"{name} {key}: {current[key]:.3f} > {allowed:.3f}（基线 {base[key]:.3f}）")
+        if base['fps'] > 0 and current['fps'] > 0:
+            allowed = base['fps'] / (1 + tolerance)
+            if current['fps'] < allowed and 1000 / current['fps'] - 1000 / base['fps'] > MIN_REGRESSION_MS:
+                regressions.append(f"{name} fps: {current['fps']:.1f} < {allowed:.1f}（基线 {base['fps']:.1f}）")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='逐段测量视频流流水线耗时并与基线比较')
+    parser.add_argument('--frames', default=None, help='录制素材：图片目录或视频文件（默认用合成帧）')
+    parser.add_argument('--model', default=None,
+                        help=f"模型大小（{'/'.join(MODEL_FILES)}）或模型文件名；不指定则用 CPU 桩模型")
+    parser.add_argument('--device', default='cpu', help='推理设备: cpu / cuda')
+    parser.add_argument('--preset', default='auto', choices=sorted(DEVICE_PRESETS),
+                        help='取分辨率、JPEG质量和置信度的设备预设')
+    parser.add_argument('--iterations', type=int, default=200, help='每个阶段测量的次数')
+    parser.add_argument('--warmup', type=int, default=10, help='每个阶段预热的次数')
+    parser.add_argument('--stages', default=','.join(STAGES), help='要测量的阶段（逗号分隔）')
+    parser.add_argument('--threads', type=int, default=None, help='OpenCV 线程数（固定后结果更稳定）')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='基线文件路径')
+    parser.add_argument('--save-baseline', action='store_true', help='把本次结果保存为基线')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='p50 / 吞吐允许的相对退化')
+    parser.add_argument('--p99-tolerance', type=float, default=0.5, help='p99 允许的相对退化')
+    parser.add_argument('--output', default=None, help='把本次结果写入 JSON 文件')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+    stages = [name.strip() for name in args.stages.split(',') if name.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"未知的阶段: {', '.join(sorted(unknown))}")
+    if args.threads:
+        cv2.setNumThreads(args.threads)
+
+    preset = DEVICE_PRESETS[args.preset]
+    if args.model is None:
+        model, model_label = StubModel(), 'stub'
+    else:
+        from ultralytics import YOLO
+        model_path = get_model_path(args.model) if args.model in MODEL_FILES else resolve_model_file(args.model)
+        model, model_label = YOLO(model_path), os.path.basename(model_path)
+
+    source = FrameSource(args.frames, preset['resolution'])
+    try:
+        width, height = preset['resolution']
+        key = f"{model_label}/{args.device}/{source.label}/{width}x{height}/q{preset['jpeg_quality']}"
+        logging.info(f"基准测试 {key}，每阶段 {args.iterations} 次")
+        report = run_benchmark(
+            source, model, device=args.device, conf=preset['detection_conf'],
+            jpeg_quality=preset['jpeg_quality'], iterations=max(1, args.iterations),
+            warmup=max(0, args.warmup), stages=stages,
+        )
+    finally:
+        source.close()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'key': key, 'fingerprint': device_fingerprint(), 'stages': report},
+                      f, ensure_ascii=False, indent=2)
+
+    if args.save_baseline:
+        path = save_baseline(key, report, args.baseline)
+        logging.info(f"✅ 基线已保存到 {path}")
+        return 0
+
+    baseline = load_baseline(args.baseline)
+    if not baseline or baseline.get('fingerprint') != device_fingerprint():
+        logging.warning("⚠️ 没有本机的基线，跳过比较（用 --save-baseline 保存）")
+        return 0
+    run = baseline['runs'].get(key)
+    if not run:
+        logging.warning(f"⚠️ 基线中没有 {key} 的结果，跳过比较（用 --save-baseline 保存）")
+        return 0
+    regressions = compare(report, run['stages'], args.tolerance, args.p99_tolerance)
+    if regressions:
+        logging.error(f"❌ 相对基线（{run['created_at']}）性能退化:")
+        for line in regressions:
+            logging.error(f"   {line}")
+        return 1
+    logging.info(f"✅ 未超出基线（{run['created_at']}）容差")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
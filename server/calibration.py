@@ -0,0 +1,229 @@
+"""
+设备校准 - 在本机实测候选配置，选出最佳配置并缓存
+对候选的 推理后端 × 模型大小 × 分辨率 组合，用合成帧实测推理、JPEG编码和摄像头采集速率，
+把最佳配置写入校准缓存（device_config.PROFILE_CACHE_PATH），之后启动直接加载，无需再检测设备。
+
+用法:
+    python3 calibration.py [--frames 20] [--camera 0]
+    python3 app_edge.py calibrate
+"""
+import argparse
+import logging
+import math
+import os
+import time
+
+import cv2
+import numpy as np
+
+from device_config import (
+    DEVICE_PRESETS, MODEL_FILES, PROFILE_CACHE_PATH,
+    detect_device_type, resolve_model_file, save_calibrated_profile,
+)
+
+# 候选分辨率（由低到高）
+CANDIDATE_RESOLUTIONS = [(640, 480), (1280, 720), (1920, 1080)]
+# 候选模型（按精度由低到高排列，越靠后越优先）
+CANDIDATE_MODELS = ['nano', 'small', 'medium']
+# 每秒至少推理多少帧，火情检测才有意义
+MIN_DETECTION_FPS = 3.0
+# 视频流帧率上限
+MAX_STREAM_FPS = 30
+# 编码速率只用一半做视频流，留出余量给推理和其他线程
+ENCODE_HEADROOM = 0.5
+
+
+def synthetic_frames(width, height, count=4):
+    """生成确定性的合成帧（噪声背景 + 类似火焰的暖色块）"""
+    rng = np.random.default_rng(0)
+    frames = []
+    for i in range(count):
+        frame = rng.integers(0, 80, size=(height, width, 3), dtype=np.uint8)
+        center = (width // 4 + i * width // 8, height // 2)
+        cv2.circle(frame, center, max(8, height // 10), (0, 140, 255), -1)
+        cv2.circle(frame, center, max(4, height // 20), (0, 220, 255), -1)
+        frames.append(frame)
+    return frames
+
+
+def available_backends():
+    """返回可用的推理后端列表"""
+    backends = ['cpu']
+    try:
+        import torch
+        if torch.cuda.is_available():
+            backends.append('cuda')
+    except ImportError:
+        pass
+    return backends
+
+
+def measure_inference(model, frames, backend, conf, n):
+    """测量推理速率（先预热两帧）"""
+    for frame in frames[:2]:
+        model(frame, conf=conf, verbose=False, device=backend)
+    start_time = time.perf_counter()
+    for i in range(n):
+        model(frames[i % len(frames)], conf=conf, verbose=False, device=backend)
+    elapsed = time.perf_counter() - start_time
+    return n / elapsed if elapsed > 0 else 0.0
+
+
+def measure_encode(frames, quality, n):
+    """测量 JPEG 编码速率"""
+    encode_params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    start_time = time.perf_counter()
+    for i in range(n):
+        cv2.imencode('.jpg', frames[i % len(frames)], encode_params)
+    elapsed = time.perf_counter() - start_time
+    return n / elapsed if elapsed > 0 else 0.0
+
+
+def measure_capture(source, width, height, n):
+    """
+    测量摄像头在指定分辨率下的采集速率
+
+    Returns:
+        float: 采集帧率；摄像头不可用时返回 None
+    """
+    cap = cv2.VideoCapture(source)
+    try:
+        if not cap.isOpened():
+            return None
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        # 丢弃前几帧（自动曝光稳定）
+        for _ in range(3):
+            cap.read()
+        start_time = time.perf_counter()
+        got = 0
+        for _ in range(n):
+            ret, _ = cap.read()
+            if ret:
+                got += 1
+        elapsed = time.perf_counter() - start_time
+        return got / elapsed if got and elapsed > 0 else None
+    finally:
+        cap.release()
+
+
+def select_best(results):
+    """
+    从测量结果中选出最佳候选
+
+    满足最低检测帧率的候选中，优先模型更大、分辨率更高、使用GPU、推理更快；
+    全部不满足时退而选择推理最快的候选。
+    """
+    viable = [r for r in results if r['inference_fps'] >= MIN_DETECTION_FPS]
+    if not viable:
+        return max(results, key=lambda r: r['inference_fps'])
+    return max(viable, key=lambda r: (
+        CANDIDATE_MODELS.index(r['model_size']),
+        r['resolution'][0] * r['resolution'][1],
+        r['backend'] == 'cuda',
+        r['inference_fps'],
+    ))
+
+
+def build_config(best, base_type):
+    """根据最佳候选的实测速率生成设备配置"""
+    config = DEVICE_PRESETS[base_type].copy()
+    stream_fps = min(MAX_STREAM_FPS, best['encode_fps'] * ENCODE_HEADROOM)
+    if best['capture_fps']:
+        stream_fps = min(stream_fps, best['capture_fps'])
+    target_fps = max(1, int(stream_fps))
+    config.update({
+        'name': f"{config['name']} (calibrated)",
+        'resolution': tuple(best['resolution']),
+        'model_size': best['model_size'],
+        'use_gpu': best['backend'] == 'cuda',
+        'target_fps': target_fps,
+        # 推理速率留 20% 余量，保证推理队列不会堆积
+        'frame_skip': max(1, math.ceil(target_fps / max(best['inference_fps'] * 0.8, 0.1))),
+        'max_threads': min(config['max_threads'], os.cpu_count() or 1),
+    })
+    return config
+
+
+def run_calibration(frames=20, camera=0, base_type=None):
+    """
+    执行校准
+
+    Args:
+        frames: 每个候选测量的帧数
+        camera: 用于测量采集速率的摄像头索引
+        base_type: 作为基础的设备预设，None 则自动检测
+
+    Returns:
+        tuple: (最佳配置, 所有候选的测量结果)
+    """
+    from ultralytics import YOLO
+
+    base_type = base_type or detect_device_type()
+    base_config = DEVICE_PRESETS.get(base_type, DEVICE_PRESETS['auto'])
+    logging.info(f"开始校准（基础预设: {base_type}）")
+
+    frame_sets = {res: synthetic_frames(*res) for res in CANDIDATE_RESOLUTIONS}
+
+    encode_rates = {}
+    capture_rates = {}
+    for res in CANDIDATE_RESOLUTIONS:
+        encode_rates[res] = measure_encode(frame_sets[res], base_config['jpeg_quality'], frames)
+        capture_rates[res] = measure_capture(camera, res[0], res[1], frames)
+        capture_text = f"{capture_rates[res]:.1f} FPS" if capture_rates[res] else '不可用'
+        logging.info(f"  {res[0]}x{res[1]}: 编码 {encode_rates[res]:.1f} FPS, 采集 {capture_text}")
+
+    results = []
+    for backend in available_backends():
+        for model_size in CANDIDATE_MODELS:
+            try:
+                model_path = resolve_model_file(MODEL_FILES[model_size])
+            except FileNotFoundError:
+                logging.info(f"  跳过 {model_size}: 找不到 {MODEL_FILES[model_size]}")
+                continue
+            model = YOLO(model_path)
+            for res in CANDIDATE_RESOLUTIONS:
+                inference_fps = measure_inference(
+                    model, frame_sets[res], backend, base_config['detection_conf'], frames
+                )
+                results.append({
+                    'backend': backend,
+                    'model_size': model_size,
+                    'resolution': list(res),
+                    'inference_fps': round(inference_fps, 2),
+                    'encode_fps': round(encode_rates[res], 2),
+                    'capture_fps': round(capture_rates[res], 2) if capture_rates[res] else None,
+                })
+                logging.info(
+                    f"  {backend}/{model_size}/{res[0]}x{res[1]}: 推理 {inference_fps:.2f} FPS"
+                )
+
+    if not results:
+        raise RuntimeError("没有可用于校准的模型文件")
+
+    best = select_best(results)
+    return build_config(best, base_type), results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='实测候选配置并缓存最佳设备配置')
+    parser.add_argument('--frames', type=int, default=20, help='每个候选测量的帧数')
+    parser.add_argument('--camera', type=int, default=0, help='测量采集速率使用的摄像头索引')
+    parser.add_argument('--base', default=None, choices=sorted(DEVICE_PRESETS), help='基础设备预设')
+    parser.add_argument('--output', default=PROFILE_CACHE_PATH, help='校准缓存文件路径')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+    config, results = run_calibration(args.frames, args.camera, args.base)
+    path = save_calibrated_profile(config, results, args.output)
+    logging.info(f"✅ 校准完成，最佳配置已写入 {path}")
+    logging.info(
+        f"   {config['model_size']} @ {config['resolution'][0]}x{config['resolution'][1]}, "
+        f"GPU={config['use_gpu']}, 目标 {config['target_fps']} FPS, 每 {config['frame_skip']} 帧推理一次"
+    )
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
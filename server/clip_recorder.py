@@ -0,0 +1,295 @@
+"""
+告警片段录制 - 火焰/烟雾告警时保存告警前后的画面
+内存中保留最近若干秒已编码的 JPEG 帧（按字节数和时长双重限制），
+检测到危险时把预录部分和告警后的画面交给后台写盘线程，采集和推理线程不会被磁盘 IO 阻塞。
+
+片段保存为连续 JPEG 组成的 .mjpeg 文件（ffplay / VLC 可直接播放，无需重新编码），
+同名 .json 记录每帧时间戳和触发信息。超过保留天数的片段，以及超出磁盘配额时最旧的片段，由写盘线程删除。
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from queue import Queue, Empty
+
+CLIP_DIR = os.getenv('CLIP_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'clips'))
+# 告警前预录时长（秒）
+PRE_ROLL_SECONDS = float(os.getenv('CLIP_PRE_SECONDS', '10'))
+# 最后一次检测到危险后继续录制的时长（秒）
+POST_ROLL_SECONDS = float(os.getenv('CLIP_POST_SECONDS', '10'))
+# 预录缓冲区内存上限（MB）
+RING_MAX_MB = float(os.getenv('CLIP_RING_MB', '32'))
+# 单个片段最长时长（秒），持续告警时分段保存
+MAX_CLIP_SECONDS = 120.0
+# 写盘队列积压超过这个帧数时丢弃后续帧（磁盘过慢时保护内存）
+MAX_PENDING_WRITES = 256
+# 片段目录磁盘配额（MB），超出后删除最旧的片段
+CLIP_QUOTA_MB = float(os.getenv('CLIP_QUOTA_MB', '2048'))
+# 片段保留天数，0 为不按时间删除
+CLIP_RETENTION_DAYS = float(os.getenv('CLIP_RETENTION_DAYS', '30'))
+# 空闲时检查过期片段的间隔（秒）
+RETENTION_CHECK_INTERVAL = 3600.0
+# 一个片段包含的文件
+CLIP_SUFFIXES = ('.mjpeg', '.json', '.json.tmp')
+
+
+class FrameRing:
+    """已编码帧的环形缓冲区，同时按总字节数和帧龄淘汰"""
+
+    def __init__(self, max_bytes, max_age):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._frames = deque()  # (timestamp, jpeg)
+        self.total_bytes = 0
+
+    def append(self, timestamp, jpeg):
+        self._frames.append((timestamp, jpeg))
+        self.total_bytes += len(jpeg)
+        self._evict(timestamp)
+
+    def _evict(self, now):
+        frames = self._frames
+        while frames and (self.total_bytes > self.max_bytes or now - frames[0][0] > self.max_age):
+            _, jpeg = frames.popleft()
+            self.total_bytes -= len(jpeg)
+
+    def drain(self):
+        """取出全部帧并清空"""
+        frames = list(self._frames)
+        self._frames.clear()
+        self.total_bytes = 0
+        return frames
+
+    def __len__(self):
+        return len(self._frames)
+
+
+class _ClipWriter:
+    """后台写盘线程：按顺序执行 open / frame / close 操作，并清理过期和超出配额的片段"""
+
+    def __init__(self, directory, quota_mb=CLIP_QUOTA_MB, retention_days=CLIP_RETENTION_DAYS):
+        self.directory = directory
+        self.quota_bytes = int(quota_mb * 1024 * 1024)
+        self.retention_days = retention_days
+        self.queue = Queue()
+        self.dropped_frames = 0
+        self.removed_clips = 0
+        self.clips = deque(maxlen=50)  # 最近完成的片段信息
+        self._files = {}
+        self._thread = threading.Thread(target=self._run, name='clip-writer', daemon=True)
+        self._thread.start()
+
+    def open(self, name, meta, frames):
+        self.queue.put(('open', name, meta, frames))
+
+    def frame(self, name, timestamp, jpeg):
+        if self.queue.qsize() > MAX_PENDING_WRITES:
+            self.dropped_frames += 1
+            return
+        self.queue.put(('frame', name, timestamp, jpeg))
+
+    def close(self, name, end_time):
+        self.queue.put(('close', name, end_time, None))
+
+    def _run(self):
+        last_check = 0.0
+        while True:
+            now = time.time()
+            if now - last_check > RETENTION_CHECK_INTERVAL:
+                last_check = now
+                self._enforce_retention(now)
+            try:
+                op, name, arg1, arg2 = self.queue.get(timeout=1.0)
+            except Empty:
+                continue
+            try:
+                if op == 'open':
+                    self._open(name, arg1, arg2)
+                elif op == 'frame':
+                    self._write(name, arg1, arg2)
+                elif op == 'close':
+                    self._close(name, arg1)
+                    self._enforce_retention(time.time())
+            except OSError as e:
+                logging.error(f"写入告警片段 {name} 失败: {e}")
+
+    def _enforce_retention(self, now):
+        """删除超过保留天数的片段，再从最旧的开始删除直到总占用不超过配额（正在写入的片段不删）"""
+        try:
+            filenames = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        clips = {}  # 片段名 -> [修改时间, 字节数, 文件路径...]
+        for filename in filenames:
+            suffix = next((suffix for suffix in CLIP_SUFFIXES if filename.endswith(suffix)), None)
+            if suffix is None:
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entry = clips.setdefault(filename[:-len(suffix)], [0.0, 0])
+            entry[0] = max(entry[0], stat.st_mtime)
+            entry[1] += stat.st_size
+            entry.append(path)
+
+        total = sum(entry[1] for entry in clips.values())
+        expire_before = now - self.retention_days * 86400 if self.retention_days > 0 else None
+        removed = set()
+        for name, (mtime, size, *paths) in sorted(clips.items(), key=lambda item: item[1][0]):
+            if name in self._files:
+                continue
+            if total <= self.quota_bytes and (expire_before is None or mtime >= expire_before):
+                break
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+            removed.add(name)
+        if removed:
+            self.removed_clips += len(removed)
+            self.clips = deque((clip for clip in self.clips if clip['name'] not in removed), maxlen=self.clips.maxlen)
+            logging.info(f"🗑️ 已删除 {len(removed)} 个过期或超出配额的告警片段")
+
+    def _open(self, name, meta, frames):
+        os.makedirs(self.directory, exist_ok=True)
+        handle = open(os.path.join(self.directory, f'{name}.mjpeg'), 'wb')
+        self._files[name] = (handle, meta)
+        for timestamp, jpeg in frames:
+            self._write(name, timestamp, jpeg)
+
+    def _write(self, name, timestamp, jpeg):
+        entry = self._files.get(name)
+        if entry is None:
+            return
+        handle, meta = entry
+        meta['frames'].append([round(timestamp, 3), handle.tell(), len(jpeg)])
+        handle.write(jpeg)
+
+    def _close(self, name, end_time):
+        entry = self._files.pop(name, None)
+        if entry is None:
+            return
+        handle, meta = entry
+        meta['end_time'] = end_time
+        meta['bytes'] = handle.tell()
+        handle.close()
+        tmp_path = os.path.join(self.directory, f'{name}.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(self.directory, f'{name}.json'))
+        self.clips.append({
+            'name': name,
+            'camera': meta['camera'],
+            'trigger_time': meta['trigger_time'],
+            'start_time': meta['start_time'],
+            'end_time': end_time,
+            'frame_count': len(meta['frames']),
+            'bytes': meta['bytes'],
+        })
+        logging.info(f"🎬 告警片段已保存: {name}.mjpeg ({len(meta['frames'])} 帧)")
+
+
+class ClipRecorder:
+    """
+    告警片段录制器
+
+    独立线程从帧缓冲区读取已编码帧（作为一个读者，缓冲区因此持续编码），
+    帧带 has_danger 标记时触发录制；触发后继续录制到最后一次危险之后 POST_ROLL_SECONDS 秒。
+    """
+
+    def __init__(self, buffer, camera='default', directory=CLIP_DIR,
+                 pre_roll=PRE_ROLL_SECONDS, post_roll=POST_ROLL_SECONDS, ring_mb=RING_MAX_MB,
+                 quota_mb=CLIP_QUOTA_MB, retention_days=CLIP_RETENTION_DAYS):
+        self.buffer = buffer
+        self.camera = camera
+        self.post_roll = post_roll
+        self.ring = FrameRing(int(ring_mb * 1024 * 1024), pre_roll)
+        self.writer = _ClipWriter(directory, quota_mb, retention_days)
+        self.running = False
+        self._clip = None  # 正在录制的片段: {'name', 'start', 'deadline'}
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name=f'clip-{self.camera}', daemon=True)
+        self._thread.start()
+        logging.info(f"✅ 告警片段录制已启动（预录 {self.ring.max_age:.0f}s，后录 {self.post_roll:.0f}s）")
+
+    def stop(self):
+        self.running = False
+
+    def _run(self):
+        last_seq = 0
+        with self.buffer.reader():
+            while self.running:
+                frame = self.buffer.wait_next(last_seq, timeout=1.0)
+                if frame is None:
+                    self._check_deadline(time.time())
+                    continue
+                last_seq = frame.seq
+                self.add(frame.timestamp, frame.jpeg, frame.has_danger)
+
+    def add(self, timestamp, jpeg, has_danger=False):
+        """送入一帧；录制中直接交给写盘线程，否则进入预录缓冲区"""
+        clip = self._clip
+        if clip is not None and timestamp - clip['start'] > MAX_CLIP_SECONDS:
+            # 持续告警：结束当前片段，后续画面进入新片段
+            self._finish(timestamp)
+            clip = None
+
+        if has_danger:
+            if clip is None:
+                clip = self._begin(timestamp)
+            clip['deadline'] = timestamp + self.post_roll
+
+        if clip is None:
+            self.ring.append(timestamp, jpeg)
+            return
+        self.writer.frame(clip['name'], timestamp, jpeg)
+        self._check_deadline(timestamp)
+
+    def _begin(self, timestamp):
+        name = time.strftime('%Y%m%d_%H%M%S', time.localtime(timestamp)) + f'_{self.camera}'
+        frames = self.ring.drain()
+        start = frames[0][0] if frames else timestamp
+        meta = {
+            'camera': self.camera,
+            'trigger_time': timestamp,
+            'start_time': start,
+            'frames': [],  # [时间戳, 文件偏移, 字节数]
+        }
+        self.writer.open(name, meta, frames)
+        self._clip = {'name': name, 'start': start, 'deadline': timestamp + self.post_roll}
+        logging.warning(f"🎬 检测到危险，开始保存告警片段: {name}（预录 {len(frames)} 帧）")
+        return self._clip
+
+    def _check_deadline(self, now):
+        clip = self._clip
+        if clip is not None and now >= clip['deadline']:
+            self._finish(now)
+
+    def _finish(self, now):
+        self.writer.close(self._clip['name'], now)
+        self._clip = None
+
+    def status(self):
+        return {
+            'recording': self._clip is not None,
+            'current_clip': self._clip['name'] if self._clip else None,
+            'ring_frames': len(self.ring),
+            'ring_bytes': self.ring.total_bytes,
+            'pending_writes': self.writer.queue.qsize(),
+            'dropped_frames': self.writer.dropped_frames,
+            'quota_mb': round(self.writer.quota_bytes / 1024 / 1024),
+            'retention_days': self.writer.retention_days,
+            'removed_clips': self.writer.removed_clips,
+            'clips': list(self.writer.clips),
+        }
@@ -0,0 +1,301 @@
+"""
+检测历史存储 - SQLite（WAL 模式）
+推理线程只把检测结果放入内存队列，后台写入线程按批在一个事务中写入，
+同时更新按小时汇总的统计表，小时统计查询不随明细行数增长而变慢。
+
+表结构:
+- detections: 每个检测框一行（摄像头、时间、帧号、类别、置信度、检测框），按 (camera, ts) 和 ts 建索引
+- hourly: (camera, hour, class) -> 出现该类别的推理帧数、检测框数、最高/平均置信度
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from queue import SimpleQueue, Empty
+
+DETECTION_DB = os.getenv(
+    'DETECTION_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'detections.db')
+)
+# 明细保留天数（小时统计永久保留）
+RETENTION_DAYS = float(os.getenv('DETECTION_RETENTION_DAYS', '90'))
+# 每批最多写入的检测事件数 / 最长攒批时间（秒）
+BATCH_SIZE = 200
+FLUSH_INTERVAL = 1.0
+# 单页最大条数
+MAX_PAGE_SIZE = 1000
+# 停止时等待写完队列的最长时间（秒）
+STOP_TIMEOUT = 5.0
+# 放入队列表示停止写入线程
+_STOP = object()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS detections (
+    id INTEGER PRIMARY KEY,
+    camera TEXT NOT NULL,
+    ts REAL NOT NULL,
+    frame_id INTEGER,
+    class TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    x1 REAL, y1 REAL, x2 REAL, y2 REAL
+);
+CREATE INDEX IF NOT EXISTS idx_detections_camera_ts ON detections (camera, ts);
+CREATE INDEX IF NOT EXISTS idx_detections_ts ON detections (ts);
+CREATE TABLE IF NOT EXISTS hourly (
+    camera TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    class TEXT NOT NULL,
+    frames INTEGER NOT NULL,
+    boxes INTEGER NOT NULL,
+    max_confidence REAL NOT NULL,
+    sum_confidence REAL NOT NULL,
+    PRIMARY KEY (camera, hour, class)
+) WITHOUT ROWID;
+"""
+
+HOURLY_UPSERT = """
+INSERT INTO hourly (camera, hour, class, frames, boxes, max_confidence, sum_confidence)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (camera, hour, class) DO UPDATE SET
+    frames = frames + excluded.frames,
+    boxes = boxes + excluded.boxes,
+    max_confidence = MAX(max_confidence, excluded.max_confidence),
+    sum_confidence = sum_confidence + excluded.sum_confidence
+"""
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+def encode_cursor(ts, row_id):
+    return f'{ts!r}:{row_id}'
+
+
+def decode_cursor(cursor):
+    """
+    Raises:
+        ValueError: 游标格式错误
+    """
+    ts, _, row_id = cursor.rpartition(':')
+    return float(ts), int(row_id)
+
+
+class DetectionStore:
+    """检测历史存储：record() 非阻塞入队，后台线程批量写入"""
+
+    def __init__(self, path=DETECTION_DB, retention_days=RETENTION_DAYS):
+        self.path = path
+        self.retention_days = retention_days
+        self._queue = SimpleQueue()
+        self._local = threading.local()
+        self._thread = None
+        self.written_events = 0
+        self.written_boxes = 0
+        self.last_error = None
+
+        conn = _connect(path)
+        with conn:
+            conn.executescript(SCHEMA)
+        conn.close()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='detection-store', daemon=True)
+        self._thread.start()
+        logging.info(f"✅ 检测历史存储已启动: {self.path}")
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """写完队列中已有的检测结果后停止写入线程（进程退出前调用）"""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.warning(f"⚠️ 检测历史未能在 {timeout:.0f} 秒内写完，剩余 {self._queue.qsize()} 条")
+        self._thread = None
+
+    def record(self, event, camera='default'):
+        """记录一次推理的检测结果（没有检测框的推理帧不记录）"""
+        if event['detections']:
+            self._queue.put((camera, event))
+
+    # --- 写入 ---
+
+    def _run(self):
+        conn = _connect(self.path)
+        last_prune = 0.0
+        while True:
+            batch = self._next_batch()
+            stopping = bool(batch) and batch[-1] is _STOP
+            if stopping:
+                batch.pop()
+            if batch:
+                try:
+                    self._write(conn, batch)
+                except sqlite3.Error as e:
+                    self.last_error = str(e)
+                    logging.error(f"写入检测历史失败: {e}")
+            if stopping:
+                conn.close()
+                return
+            now = time.time()
+            if now - last_prune > 3600:
+                last_prune = now
+                self._prune(conn, now)
+
+    def _next_batch(self):
+        """取一批待写入的检测结果；收到停止标记时以它结尾"""
+        try:
+            batch = [self._queue.get(timeout=FLUSH_INTERVAL)]
+        except Empty:
+            return []
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        while len(batch) < BATCH_SIZE and batch[-1] is not _STOP:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except Empty:
+                break
+        return batch
+
+    def _write(self, conn, batch):
+        rows = []
+        hourly = {}
+        for camera, event in batch:
+            ts = event['timestamp']
+            hour = int(ts // 3600) * 3600
+            per_class = {}
+            for det in event['detections']:
+                x1, y1, x2, y2 = det['box']
+                rows.append((camera, ts, event['frame_id'], det['class'], det['confidence'], x1, y1, x2, y2))
+                per_class.setdefault(det['class'], []).append(det['confidence'])
+            # 同一帧同一类别的多个检测框在小时统计中只算一次事件
+            for class_name, confidences in per_class.items():
+                totals = hourly.setdefault((camera, hour, class_name), [0, 0, 0.0, 0.0])
+                totals[0] += 1
+                totals[1] += len(confidences)
+                totals[2] = max(totals[2], max(confidences))
+                totals[3] += sum(confidences)
+
+        with conn:
+            conn.executemany(
+                'INSERT INTO detections (camera, ts, frame_id, class, confidence, x1, y1, x2, y2) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows
+            )
+            conn.executemany(HOURLY_UPSERT, [key + tuple(totals) for key, totals in hourly.items()])
+        self.written_events += len(batch)
+        self.written_boxes += len(rows)
+
+    def _prune(self, conn, now):
+        if self.retention_days <= 0:
+            return
+        try:
+            with conn:
+                cursor = conn.execute('DELETE FROM detections WHERE ts < ?', (now - self.retention_days * 86400,))
+            if cursor.rowcount:
+                logging.info(f"🗑️ 已清理 {cursor.rowcount} 条过期检测记录")
+        except sqlite3.Error as e:
+            logging.error(f"清理检测历史失败: {e}")
+
+    # --- 查询 ---
+
+    def _reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = _connect(self.path)
+        return conn
+
+    def query(self, camera=None, from_ts=None, to_ts=None, class_name=None, limit=100, cursor=None):
+        """
+        按时间倒序分页查询检测明细（键集分页，翻页代价与页码无关）
+
+        Args:
+            cursor: 上一页返回的 next_cursor
+
+        Returns:
+            dict: {'items': [...], 'next_cursor': str 或 None}
+        """
+        limit = max(1, min(MAX_PAGE_SIZE, int(limit)))
+        where, params = [], []
+        if camera:
+            where.append('camera = ?')
+            params.append(camera)
+        if from_ts is not None:
+            where.append('ts >= ?')
+            params.append(from_ts)
+        if to_ts is not None:
+            where.append('ts <= ?')
+            params.append(to_ts)
+        if class_name:
+            where.append('class = ?')
+            params.append(class_name)
+        if cursor:
+            ts, row_id = decode_cursor(cursor)
+            where.append('(ts < ? OR (ts = ? AND id < ?))')
+            params.extend([ts, ts, row_id])
+
+        sql = 'SELECT id, camera, ts, frame_id, class, confidence, x1, y1, x2, y2 FROM detections'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY ts DESC, id DESC LIMIT ?'
+        rows = self._reader().execute(sql, params + [limit + 1]).fetchall()
+
+        items = [{
+            'id': row[0],
+            'camera': row[1],
+            'timestamp': row[2],
+            'frame_id': row[3],
+            'class': row[4],
+            'confidence': row[5],
+            'box': [row[6], row[7], row[8], row[9]],
+        } for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = items[-1]
+            next_cursor = encode_cursor(last['timestamp'], last['id'])
+        return {'items': items, 'next_cursor': next_cursor}
+
+    def hourly(self, camera=None, from_ts=None, to_ts=None, class_name=None):
+        """按小时汇总（来自汇总表，不扫描明细）"""
+        where, params = [], []
+        if camera:
+            where.append('camera = ?')
+            params.append(camera)
+        if from_ts is not None:
+            where.append('hour >= ?')
+            params.append(int(from_ts // 3600) * 3600)
+        if to_ts is not None:
+            where.append('hour <= ?')
+            params.append(to_ts)
+        if class_name:
+            where.append('class = ?')
+            params.append(class_name)
+        sql = 'SELECT camera, hour, class, frames, boxes, max_confidence, sum_confidence FROM hourly'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY hour, camera, class'
+        return [{
+            'camera': row[0],
+            'hour': row[1],
+            'class': row[2],
+            'events': row[3],
+            'boxes': row[4],
+            'max_confidence': round(row[5], 3),
+            'avg_confidence': round(row[6] / row[4], 3) if row[4] else None,
+        } for row in self._reader().execute(sql, params)]
+
+    def status(self):
+        return {
+            'path': self.path,
+            'pending': self._queue.qsize(),
+            'written_events': self.written_events,
+            'written_boxes': self.written_boxes,
+            'last_error': self.last_error,
+        }
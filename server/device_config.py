@@ -4,6 +4,7 @@
 """
 import platform
 import os
+import json
 import subprocess
 import logging
 
@@ -122,6 +123,30 @@ DEVICE_PRESETS = {
 }
 
 
+# 设备校准结果缓存文件（由 calibration.py 生成，存在时启动直接加载，跳过设备检测）
+PROFILE_CACHE_PATH = os.getenv(
+    'DEVICE_PROFILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'device_profile.json')
+)
+
+
+def _read_proc_text(path):
+    """读取 /proc 下的文本文件（不存在或不可读时返回空字符串）"""
+    try:
+        with open(path, 'r') as f:
+            return f.read().lower()
+    except OSError:
+        return ''
+
+
+# 模型大小与权重文件的对应关系
+MODEL_FILES = {
+    'nano': 'yolov8n.pt',  # 最小模型
+    'small': 'yolov8s.pt',
+    'medium': 'fire_m.pt',  # 当前使用的模型
+}
+
+
 def detect_device_type():
     """
     自动检测设备类型
@@ -130,49 +155,29 @@ def detect_device_type():
     system = platform.system()
     machine = platform.machine().lower()
     
+    device_model = _read_proc_text('/proc/device-tree/model')
+    
     # 检测Jetson设备
-    try:
-        if os.path.exists('/proc/device-tree/model'):
-            with open('/proc/device-tree/model', 'r') as f:
-                model = f.read().lower()
-                if 'jetson' in model:
-                    if 'nano' in model:
-                        return 'jetson_nano'
-                    elif 'xavier' in model or 'orin' in model:
-                        return 'jetson_xavier'
-                    return 'jetson_nano'  # 默认
-    except:
-        pass
+    if 'jetson' in device_model:
+        if 'nano' in device_model:
+            return 'jetson_nano'
+        elif 'xavier' in device_model or 'orin' in device_model:
+            return 'jetson_xavier'
+        return 'jetson_nano'  # 默认
     
     # 检测树莓派
-    try:
-        if os.path.exists('/proc/cpuinfo'):
-            with open('/proc/cpuinfo', 'r') as f:
-                cpuinfo = f.read().lower()
-                if 'raspberry pi' in cpuinfo or 'bcm' in cpuinfo:
-                    return 'raspberry_pi'
-    except:
-        pass
+    if 'raspberry pi' in device_model or 'raspberry pi' in _read_proc_text('/proc/cpuinfo'):
+        return 'raspberry_pi'
     
-    # 检测海思芯片
-    try:
-        if os.path.exists('/proc/device-tree/compatible'):
-            with open('/proc/device-tree/compatible', 'r') as f:
-                compatible = f.read().lower()
-                if 'hisilicon' in compatible or 'hi' in compatible:
-                    return 'hisilicon'
-    except:
-        pass
-    
-    # 检测瑞芯微
-    try:
-        if os.path.exists('/proc/device-tree/compatible'):
-            with open('/proc/device-tree/compatible', 'r') as f:
-                compatible = f.read().lower()
-                if 'rockchip' in compatible or 'rk' in compatible:
-                    return 'rockchip'
-    except:
-        pass
+    # 检测SoC厂商：compatible 是以 NUL 分隔的 "厂商,型号" 列表，
+    # 按厂商字段精确匹配，避免 'hi'/'rk' 之类的子串误判
+    vendors = {entry.split(',', 1)[0] for entry in _read_proc_text('/proc/device-tree/compatible').split('\0')}
+    if 'hisilicon' in vendors or 'hisi' in vendors:
+        return 'hisilicon'
+    if 'rockchip' in vendors:
+        return 'rockchip'
+    if 'brcm' in vendors and 'raspberrypi' in vendors:
+        return 'raspberry_pi'
     
     # 根据架构判断
     if 'arm' in machine or 'aarch64' in machine:
@@ -205,16 +210,111 @@ def detect_device_type():
     return 'auto'
 
 
-def get_device_config(device_type=None):
+def device_fingerprint():
+    """
+    生成本机硬件指纹，用于判断校准缓存是否属于当前设备
+    """
+    return {
+        'system': platform.system(),
+        'machine': platform.machine().lower(),
+        'cpu_count': os.cpu_count(),
+        'model': _read_proc_text('/proc/device-tree/model').strip('\0').strip(),
+    }
+
+
+def load_calibrated_profile(path=None):
+    """
+    读取校准结果缓存
+
+    Returns:
+        dict: 设备配置；缓存不存在、损坏或不属于本机时返回 None
+    """
+    path = path or PROFILE_CACHE_PATH
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            profile = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"校准缓存读取失败，忽略: {e}")
+        return None
+
+    if profile.get('fingerprint') != device_fingerprint():
+        logging.warning("校准缓存与当前硬件不匹配，忽略（请重新运行 calibrate）")
+        return None
+
+    config = profile['config']
+    config['resolution'] = tuple(config['resolution'])
+    return config
+
+
+def save_calibrated_profile(config, calibration, path=None):
+    """
+    写入校准结果缓存
+
+    Args:
+        config: 选出的最佳设备配置
+        calibration: 校准测量数据（各候选配置的实测速率）
+    """
+    path = path or PROFILE_CACHE_PATH
+    profile = {
+        'fingerprint': device_fingerprint(),
+        'config': config,
+        'calibration': calibration,
+    }
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def apply_gpu_check(config):
+    """
+    检查GPU可用性，不可用时原地降级配置
+
+    导入 torch 较慢，服务入口可以先启动HTTP监听，再在后台线程中调用本函数
+
+    Returns:
+        bool: 配置是否仍使用GPU
+    """
+    if not config['use_gpu']:
+        return False
+    try:
+        import torch
+        if not torch.cuda.is_available():
+            logging.warning("配置要求GPU但CUDA不可用，切换到CPU模式")
+            config['use_gpu'] = False
+            # 降低性能参数
+            config['target_fps'] = max(10, config['target_fps'] // 2)
+            config['frame_skip'] = config['frame_skip'] * 2
+    except:
+        config['use_gpu'] = False
+    return config['use_gpu']
+
+
+def get_device_config(device_type=None, check_gpu=True):
     """
     获取设备配置
     
     Args:
-        device_type: 设备类型，如果为None则自动检测
+        device_type: 设备类型，如果为None则优先使用校准缓存，否则自动检测
+        check_gpu: 是否立即检查GPU可用性（为False时由调用方稍后调用 apply_gpu_check）
     
     Returns:
         dict: 设备配置字典
     """
+    if device_type in (None, 'calibrated'):
+        config = load_calibrated_profile()
+        if config is not None:
+            logging.info(f"使用校准缓存: {PROFILE_CACHE_PATH}")
+            if check_gpu:
+                apply_gpu_check(config)
+            return config, 'calibrated'
+        if device_type == 'calibrated':
+            logging.warning("未找到可用的校准缓存，改为自动检测")
+            device_type = None
+    
     if device_type is None:
         device_type = detect_device_type()
     
@@ -225,17 +325,8 @@ def get_device_config(device_type=None):
     config = DEVICE_PRESETS[device_type].copy()
     
     # 检查GPU可用性
-    if config['use_gpu']:
-        try:
-            import torch
-            if not torch.cuda.is_available():
-                logging.warning("配置要求GPU但CUDA不可用，切换到CPU模式")
-                config['use_gpu'] = False
-                # 降低性能参数
-                config['target_fps'] = max(10, config['target_fps'] // 2)
-                config['frame_skip'] = config['frame_skip'] * 2
-        except:
-            config['use_gpu'] = False
+    if check_gpu:
+        apply_gpu_check(config)
     
     # 根据实际CPU核心数调整线程数
     if HAS_PSUTIL:
@@ -276,11 +367,7 @@ def get_model_path(model_size='nano'):
     Returns:
         str: 模型文件路径
     """
-    model_map = {
-        'nano': 'yolov8n.pt',  # 最小模型
-        'small': 'yolov8s.pt',
-        'medium': 'fire_m.pt',  # 当前使用的模型
-    }
+    model_map = MODEL_FILES
     
     model_file = model_map.get(model_size, model_map['nano'])
     
@@ -338,6 +425,33 @@ def get_model_path(model_size='nano'):
     )
 
 
+def resolve_model_file(model_file):
+    """
+    按文件名查找模型文件（用于运行时热切换）
+
+    只接受纯文件名，避免通过接口加载任意路径下的权重文件
+
+    Args:
+        model_file: 模型文件名，如 'fire_m.pt'
+
+    Returns:
+        str: 模型文件路径
+    """
+    if not model_file or os.path.basename(model_file) != model_file or not model_file.endswith('.pt'):
+        raise ValueError(f"无效的模型文件名: {model_file}")
+
+    server_dir = os.path.dirname(__file__)
+    for candidate in (
+        os.path.join(server_dir, 'models', model_file),
+        model_file,
+        os.path.join(server_dir, model_file),
+    ):
+        if os.path.exists(candidate):
+            return candidate
+
+    raise FileNotFoundError(f"找不到模型文件: {model_file}")
+
+
 def print_device_info(config, device_type):
     """打印设备信息"""
     logging.info("=" * 60)
@@ -0,0 +1,305 @@
+"""
+连续录像（DVR）- 按固定时长分段保存已编码画面，支持按时间段回放
+每个摄像头一个目录，每段两个文件：
+- <起始毫秒>.mjpeg：连续 JPEG 数据（追加写入，段内帧在文件中连续存放）
+- <起始毫秒>.idx：定长索引记录（时间戳毫秒 int64, 文件偏移 uint64, 字节数 uint32），
+  可直接 mmap 后二分查找，定位任意时刻为 O(log n)
+磁盘占用超过配额时从最旧的段开始删除。
+"""
+import bisect
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+DVR_DIR = os.getenv('DVR_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recordings'))
+# 每段时长（秒）
+SEGMENT_SECONDS = float(os.getenv('DVR_SEGMENT_SECONDS', '60'))
+# 录像帧率（低于视频流帧率以节省存储）
+DVR_FPS = float(os.getenv('DVR_FPS', '5'))
+# 磁盘配额（MB），超出后删除最旧的段
+DVR_QUOTA_MB = float(os.getenv('DVR_QUOTA_MB', '16384'))
+
+INDEX_RECORD = struct.Struct('<qQI')  # 时间戳(毫秒), 偏移, 字节数
+DATA_SUFFIX = '.mjpeg'
+INDEX_SUFFIX = '.idx'
+
+
+class SegmentIndex:
+    """mmap 映射的段索引（只读，映射时的文件长度为准）"""
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        # 正在写入的段可能有半条记录，只映射完整记录
+        self._count = size // INDEX_RECORD.size
+        self._mm = None
+        if self._count:
+            self._mm = mmap.mmap(self._file.fileno(), self._count * INDEX_RECORD.size, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        return INDEX_RECORD.unpack_from(self._mm, i * INDEX_RECORD.size)
+
+    def timestamp(self, i):
+        return struct.unpack_from('<q', self._mm, i * INDEX_RECORD.size)[0]
+
+    def bisect(self, ts_ms):
+        """第一条时间戳 >= ts_ms 的记录下标"""
+        timestamps = _TimestampView(self)
+        return bisect.bisect_left(timestamps, ts_ms)
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _TimestampView:
+    """让 bisect 直接在 mmap 上按下标读取时间戳"""
+    __slots__ = ('index',)
+
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        return self.index.timestamp(i)
+
+
+def list_segments(directory, camera):
+    """按起始时间排序的段起始毫秒列表"""
+    camera_dir = os.path.join(directory, camera)
+    try:
+        names = os.listdir(camera_dir)
+    except FileNotFoundError:
+        return []
+    return sorted(int(name[:-len(INDEX_SUFFIX)]) for name in names
+                  if name.endswith(INDEX_SUFFIX) and name[:-len(INDEX_SUFFIX)].isdigit())
+
+
+def segment_paths(directory, camera, start_ms):
+    base = os.path.join(directory, camera, str(start_ms))
+    return base + DATA_SUFFIX, base + INDEX_SUFFIX
+
+
+def find_frames(directory, camera, from_ts, to_ts):
+    """
+    查找时间段内的帧
+
+    Args:
+        from_ts, to_ts: 起止时间（Unix 秒）
+
+    Returns:
+        list: [(数据文件路径, [(时间戳毫秒, 偏移, 字节数), ...]), ...]，按时间顺序；
+              同一段内的帧在数据文件中是连续的
+    """
+    from_ms, to_ms = int(from_ts * 1000), int(to_ts * 1000)
+    starts = list_segments(directory, camera)
+    # 起始时间不晚于 from 的最后一段也可能包含 from 之后的帧
+    first = max(0, bisect.bisect_right(starts, from_ms) - 1)
+    result = []
+    for start_ms in starts[first:]:
+        if start_ms > to_ms:
+            break
+        data_path, index_path = segment_paths(directory, camera, start_ms)
+        try:
+            index = SegmentIndex(index_path)
+        except FileNotFoundError:
+            continue  # 已被配额清理
+        with index:
+            begin = index.bisect(from_ms)
+            end = index.bisect(to_ms + 1)
+            records = [index[i] for i in range(begin, end)]
+        if records:
+            result.append((data_path, records))
+    return result
+
+
+def read_frames(segments):
+    """
+    按顺序读取 find_frames() 返回的帧（通过 mmap 切片，不经过文件对象缓冲）
+
+    Yields:
+        tuple: (时间戳毫秒, JPEG 数据)
+    """
+    for data_path, records in segments:
+        try:
+            f = open(data_path, 'rb')
+        except FileNotFoundError:
+            continue
+        with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for ts_ms, offset, length in records:
+                yield ts_ms, mm[offset:offset + length]
+
+
+def read_ranges(segments, chunk_size=1024 * 1024):
+    """按段读取连续字节区间（段内帧连续存放，整段一次切片），用于原始 MJPEG 输出"""
+    for data_path, records in segments:
+        begin = records[0][1]
+        end = records[-1][1] + records[-1][2]
+        try:
+            f = open(data_path, 'rb')
+        except FileNotFoundError:
+            continue
+        with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for pos in range(begin, end, chunk_size):
+                yield mm[pos:min(pos + chunk_size, end)]
+
+
+def enforce_quota(directory, quota_bytes, keep=()):
+    """
+    删除最旧的段直到总占用不超过配额
+
+    Args:
+        keep: 不可删除的段（正在写入的段）的索引文件路径
+    """
+    segments = []
+    total = 0
+    try:
+        cameras = os.listdir(directory)
+    except FileNotFoundError:
+        return 0
+    for camera in cameras:
+        for start_ms in list_segments(directory, camera):
+            data_path, index_path = segment_paths(directory, camera, start_ms)
+            size = 0
+            for path in (data_path, index_path):
+                try:
+                    size += os.path.getsize(path)
+                except OSError:
+                    pass
+            segments.append((start_ms, data_path, index_path, size))
+            total += size
+
+    removed = 0
+    for start_ms, data_path, index_path, size in sorted(segments):
+        if total <= quota_bytes:
+            break
+        if index_path in keep:
+            continue
+        for path in (index_path, data_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total -= size
+        removed += 1
+    if removed:
+        logging.info(f"🗑️ 录像超出配额，已删除 {removed} 个最旧的分段")
+    return removed
+
+
+class DVRRecorder:
+    """
+    连续录像线程
+
+    作为帧缓冲区的读者按 DVR_FPS 采样已编码帧写入当前段，段满 SEGMENT_SECONDS 后切换新段并执行配额清理。
+    """
+
+    def __init__(self, buffer, camera='default', directory=DVR_DIR,
+                 segment_seconds=SEGMENT_SECONDS, fps=DVR_FPS, quota_mb=DVR_QUOTA_MB):
+        self.buffer = buffer
+        self.camera = camera
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.frame_interval = 1.0 / fps
+        self.quota_bytes = int(quota_mb * 1024 * 1024)
+        self.running = False
+        self.frames_written = 0
+        self.bytes_written = 0
+        self._segment_start = None
+        self._data = None
+        self._index = None
+        self._index_path = None
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        os.makedirs(os.path.join(self.directory, self.camera), exist_ok=True)
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name=f'dvr-{self.camera}', daemon=True)
+        self._thread.start()
+        logging.info(f"✅ 连续录像已启动（{1.0 / self.frame_interval:.0f} FPS，"
+                     f"每段 {self.segment_seconds:.0f}s，配额 {self.quota_bytes / 1024 / 1024:.0f}MB）")
+
+    def stop(self):
+        self.running = False
+
+    def _run(self):
+        last_seq = 0
+        next_write = 0.0
+        with self.buffer.reader():
+            while self.running:
+                frame = self.buffer.wait_next(last_seq, timeout=1.0)
+                if frame is None:
+                    continue
+                last_seq = frame.seq
+                if frame.timestamp < next_write:
+                    continue
+                next_write = max(next_write, frame.timestamp - self.frame_interval) + self.frame_interval
+                try:
+                    self.write(frame.timestamp, frame.jpeg)
+                except OSError as e:
+                    logging.error(f"写入录像失败: {e}")
+                    self._close_segment()
+                    time.sleep(1.0)
+        self._close_segment()
+
+    def write(self, timestamp, jpeg):
+        """追加一帧（必要时切换新段）"""
+        if self._segment_start is None or timestamp - self._segment_start >= self.segment_seconds:
+            self._open_segment(timestamp)
+        offset = self._data.tell()
+        self._data.write(jpeg)
+        self._data.flush()
+        # 先写数据再写索引，读者看到的索引记录总是指向完整的帧
+        self._index.write(INDEX_RECORD.pack(int(timestamp * 1000), offset, len(jpeg)))
+        self._index.flush()
+        self.frames_written += 1
+        self.bytes_written += len(jpeg) + INDEX_RECORD.size
+
+    def _open_segment(self, timestamp):
+        self._close_segment()
+        start_ms = int(timestamp * 1000)
+        data_path, index_path = segment_paths(self.directory, self.camera, start_ms)
+        self._data = open(data_path, 'ab')
+        self._index = open(index_path, 'ab')
+        self._index_path = index_path
+        self._segment_start = timestamp
+        enforce_quota(self.directory, self.quota_bytes, keep=(index_path,))
+
+    def _close_segment(self):
+        for handle in (self._data, self._index):
+            if handle is not None:
+                handle.close()
+        self._data = self._index = None
+        self._segment_start = None
+
+    def status(self):
+        starts = list_segments(self.directory, self.camera)
+        return {
+            'recording': self._segment_start is not None,
+            'fps': round(1.0 / self.frame_interval, 2),
+            'segment_seconds': self.segment_seconds,
+            'quota_mb': round(self.quota_bytes / 1024 / 1024),
+            'segments': len(starts),
+            'oldest': starts[0] / 1000.0 if starts else None,
+            'frames_written': self.frames_written,
+            'bytes_written': self.bytes_written,
+        }
@@ -0,0 +1,129 @@
+"""
+事件广播（Server-Sent Events）
+发布方（推理线程等）每条事件只序列化一次，所有 SSE 客户端共享同一份编码结果；
+保留最近若干条事件，客户端断线重连时可按 Last-Event-ID 补发。
+"""
+import asyncio
+import json
+import threading
+from collections import deque
+
+# SSE 心跳间隔（秒），防止代理/浏览器因长时间无数据断开连接
+KEEPALIVE_INTERVAL = 15.0
+
+
+def format_sse(data, event=None, event_id=None):
+    """把数据编码为一条 SSE 消息"""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    if event:
+        lines.append(f'event: {event}')
+    payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    for line in payload.split('\n'):
+        lines.append(f'data: {line}')
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+def _offer_latest(queue, item):
+    """向有界队列投递；队列满时丢弃最旧的一条"""
+    if queue.full():
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+    queue.put_nowait(item)
+
+
+class EventBroadcaster:
+    """
+    事件广播器
+
+    线程式客户端（Flask 生成器）用 wait_since() 按序号等待新事件；
+    asyncio 客户端用 subscribe() 获得独立的有界队列。
+    """
+
+    def __init__(self, event='message', history=100):
+        self.event = event
+        self._history = deque(maxlen=history)  # (seq, event, payload)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._subscribers = {}  # asyncio.Queue -> event loop
+        self._sub_lock = threading.Lock()
+
+    @property
+    def last_seq(self):
+        return self._seq
+
+    def publish(self, data):
+        """发布一条事件，返回其序号"""
+        with self._cond:
+            self._seq += 1
+            item = (self._seq, data, format_sse(data, self.event, self._seq))
+            self._history.append(item)
+            self._cond.notify_all()
+
+        with self._sub_lock:
+            subscribers = list(self._subscribers.items())
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer_latest, queue, item)
+            except RuntimeError:
+                self.unsubscribe(queue)
+        return item[0]
+
+    def latest(self):
+        """最近一条事件数据（没有时返回 None）"""
+        with self._cond:
+            return self._history[-1][1] if self._history else None
+
+    def since(self, seq):
+        """返回序号大于 seq 的历史事件 [(seq, data, payload), ...]"""
+        with self._cond:
+            return [item for item in self._history if item[0] > seq]
+
+    def wait_since(self, seq, timeout=KEEPALIVE_INTERVAL):
+        """阻塞等待序号大于 seq 的事件，超时返回空列表"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > seq, timeout)
+            return [item for item in self._history if item[0] > seq]
+
+    def subscribe(self, maxsize=16):
+        """asyncio 客户端订阅（需在事件循环中调用）"""
+        queue = asyncio.Queue(maxsize=maxsize)
+        with self._sub_lock:
+            self._subscribers[queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, queue):
+        with self._sub_lock:
+            self._subscribers.pop(queue, None)
+
+    def resume_seq(self, last_event_id):
+        """根据客户端的 Last-Event-ID 计算补发起点；为空或已失效时从最近一条开始"""
+        try:
+            seq = int(last_event_id)
+        except (TypeError, ValueError):
+            return max(0, self.last_seq - 1)
+        if seq > self.last_seq:
+            # 服务重启后序号重新计数，客户端的旧ID作废
+            return max(0, self.last_seq - 1)
+        return seq
+
+    def sse_stream(self, last_event_id=None):
+        """
+        生成 SSE 字节流（线程式服务器使用）
+
+        Args:
+            last_event_id: 客户端上次收到的事件ID，补发其后的事件；为空时先发送最近一条作为初始状态
+        """
+        yield b'retry: 2000\n\n'
+        seq = self.resume_seq(last_event_id)
+        while True:
+            items = self.wait_since(seq)
+            if not items:
+                yield b': keepalive\n\n'
+                continue
+            for item_seq, _, payload in items:
+                seq = item_seq
+                yield payload
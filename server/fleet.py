@@ -0,0 +1,406 @@
+"""
+车棚集群汇聚服务 - 运维中心统一查看多个边缘节点
+与每个边缘节点（app_edge.py / app_async.py）保持长连接池，并发拉取各节点状态并缓存最新结果：
+- /api/stats、/api/health 按固定间隔轮询（同一节点的两个请求并发发出，复用 keep-alive 连接）
+- /api/events 检测事件流（SSE）长连接订阅，断线后带 Last-Event-ID 重连补发
+- /api/snapshot 快照按间隔做条件请求（If-None-Match），画面未变时节点只返回 304
+
+对外提供集群级接口：
+- /api/fleet 全部节点摘要与汇总，/api/fleet/nodes/<节点> 单节点完整状态
+- /api/fleet/snapshot/<节点> 节点最新快照（直接取自缓存，不访问节点）
+- /api/fleet/events 各节点检测事件合并后的 SSE 流（每条带 node 字段）
+
+节点列表用 FLEET_NODES 指定：JSON 配置文件路径，或逗号分隔的 名称=地址 列表，例如
+    FLEET_NODES=carport-a=http://192.168.1.21:5000,carport-b=http://192.168.1.22:5000
+
+用法:
+    python3 fleet.py
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+
+import aiohttp
+from aiohttp import web
+from werkzeug.http import http_date, parse_etags
+
+from event_stream import EventBroadcaster, KEEPALIVE_INTERVAL
+
+PORT = int(os.getenv('FLEET_PORT', '5100'))
+# 状态（/api/stats、/api/health）轮询间隔（秒）
+STATS_INTERVAL = float(os.getenv('FLEET_STATS_INTERVAL', '2'))
+# 快照拉取间隔（秒），0 为不拉取
+SNAPSHOT_INTERVAL = float(os.getenv('FLEET_SNAPSHOT_INTERVAL', '2'))
+# 单个请求超时（秒）
+REQUEST_TIMEOUT = 5.0
+# 事件流断线重连的最长退避时间（秒）
+MAX_RECONNECT_DELAY = 30.0
+# 每个节点的连接池上限：状态轮询 2 个 + 事件流 1 个 + 快照 1 个
+CONNECTIONS_PER_NODE = 4
+# 超过这个时间（秒）没有成功的状态轮询，视为离线
+OFFLINE_AFTER = 3 * STATS_INTERVAL + REQUEST_TIMEOUT
+
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*'}
+
+
+def load_nodes(value=None):
+    """
+    解析节点列表：JSON 文件（[{"name": ..., "url": ...}, ...]）或 名称=地址 逗号列表
+
+    Raises:
+        ValueError: 格式错误或节点名称重复
+    """
+    value = value if value is not None else os.getenv('FLEET_NODES', 'local=http://127.0.0.1:5000')
+    if os.path.isfile(value):
+        with open(value, 'r', encoding='utf-8') as f:
+            nodes = json.load(f)
+    else:
+        nodes = []
+        for item in filter(None, (part.strip() for part in value.split(','))):
+            name, sep, url = item.partition('=')
+            if not sep:
+                name, url = url_name(item), item
+            nodes.append({'name': name.strip(), 'url': url.strip()})
+    names = [node['name'] for node in nodes]
+    if len(set(names)) != len(names):
+        raise ValueError(f"节点名称重复: {names}")
+    return nodes
+
+
+def url_name(url):
+    """未指定名称时用 主机:端口 作为节点名称"""
+    return url.split('://', 1)[-1].rstrip('/')
+
+
+class EdgeNode:
+    """单个边缘节点的最新状态缓存"""
+
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url.rstrip('/')
+        self.stats = None
+        self.health = None
+        self.last_seen = None  # 最近一次状态轮询成功的时间
+        self.latency_ms = None  # 状态轮询往返耗时（指数平滑）
+        self.error = None
+        self.events_connected = False
+        self.last_event_id = None
+        self.last_detection = None
+        self.has_danger = False
+        self.events = 0
+        # 快照缓存：(jpeg, etag, Last-Modified, 获取时间)
+        self.snapshot = None
+        self.snapshot_fetches = 0
+        self.snapshot_not_modified = 0
+
+    @property
+    def online(self):
+        return self.last_seen is not None and time.time() - self.last_seen < OFFLINE_AFTER
+
+    def on_poll(self, stats, health, elapsed):
+        self.stats = stats
+        self.health = health
+        self.last_seen = time.time()
+        self.error = None
+        latency = elapsed * 1000
+        self.latency_ms = latency if self.latency_ms is None else self.latency_ms * 0.8 + latency * 0.2
+
+    def summary(self):
+        stats = self.stats or {}
+        return {
+            'name': self.name,
+            'url': self.url,
+            'online': self.online,
+            'readiness': (self.health or {}).get('readiness'),
+            'last_seen': self.last_seen,
+            'latency_ms': round(self.latency_ms, 1) if self.latency_ms is not None else None,
+            'error': self.error,
+            'current_fps': stats.get('current_fps'),
+            'inference_fps': stats.get('inference_fps'),
+            'cpu_usage': stats.get('cpu_usage'),
+            'memory_usage': stats.get('memory_usage'),
+            'detected_fires': stats.get('detected_fires', 0),
+            'detected_smoke': stats.get('detected_smoke', 0),
+            'has_danger': self.has_danger,
+            'events_connected': self.events_connected,
+            'snapshot_time': self.snapshot[3] if self.snapshot is not None else None,
+        }
+
+    def detail(self):
+        return {
+            **self.summary(),
+            'stats': self.stats,
+            'health': self.health,
+            'last_detection': self.last_detection,
+            'events': self.events,
+            'snapshot_fetches': self.snapshot_fetches,
+            'snapshot_not_modified': self.snapshot_not_modified,
+        }
+
+
+def _parse_sse_event(lines):
+    """把一条 SSE 消息的各行解析为 (id, event, data)"""
+    event_id, event, data = None, 'message', []
+    for line in lines:
+        field, _, value = line.partition(':')
+        value = value[1:] if value.startswith(' ') else value
+        if field == 'id':
+            event_id = value
+        elif field == 'event':
+            event = value
+        elif field == 'data':
+            data.append(value)
+    return event_id, event, '\n'.join(data)
+
+
+class FleetAggregator:
+    """
+    集群汇聚器
+
+    所有节点共用一个 aiohttp 会话，连接池按节点限制连接数并保持 keep-alive；
+    每个节点三个协程（状态轮询、事件订阅、快照拉取），单个节点慢或离线不影响其他节点。
+    """
+
+    def __init__(self, nodes):
+        self.nodes = {node['name']: EdgeNode(node['name'], node['url']) for node in nodes}
+        # 合并后的检测事件（只转发有检测框或告警状态变化的事件）
+        self.events = EventBroadcaster('detection', history=200)
+        self.session = None
+        self._tasks = []
+
+    async def start(self):
+        connector = aiohttp.TCPConnector(limit_per_host=CONNECTIONS_PER_NODE, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector)
+        for node in self.nodes.values():
+            self._tasks.append(asyncio.ensure_future(self._poll_status(node)))
+            self._tasks.append(asyncio.ensure_future(self._follow_events(node)))
+            if SNAPSHOT_INTERVAL > 0:
+                self._tasks.append(asyncio.ensure_future(self._poll_snapshot(node)))
+        logging.info(f"✅ 集群汇聚已启动（{len(self.nodes)} 个节点）")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.session is not None:
+            await self.session.close()
+
+    async def _get_json(self, node, path):
+        timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+        async with self.session.get(node.url + path, timeout=timeout) as resp:
+            # 未就绪时 /api/health 也返回正文，照常缓存
+            return await resp.json(content_type=None)
+
+    async def _poll_status(self, node):
+        """按绝对时间刻度轮询状态，请求耗时不累积到间隔中"""
+        next_tick = time.monotonic()
+        while True:
+            start = time.monotonic()
+            try:
+                stats, health = await asyncio.gather(
+                    self._get_json(node, '/api/stats'), self._get_json(node, '/api/health')
+                )
+                node.on_poll(stats, health, time.monotonic() - start)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                node.error = str(e) or type(e).__name__
+            next_tick += STATS_INTERVAL
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                next_tick = time.monotonic()
+
+    async def _follow_events(self, node):
+        """订阅节点的检测事件流，断线后按指数退避重连"""
+        delay = 1.0
+        # 节点每 KEEPALIVE_INTERVAL 秒至少发一次心跳，超过两倍时间没有数据视为连接已断
+        timeout = aiohttp.ClientTimeout(total=None, connect=REQUEST_TIMEOUT, sock_read=KEEPALIVE_INTERVAL * 2)
+        while True:
+            headers = {'Accept': 'text/event-stream'}
+            if node.last_event_id is not None:
+                headers['Last-Event-ID'] = node.last_event_id
+            try:
+                async with self.session.get(node.url + '/api/events', headers=headers, timeout=timeout) as resp:
+                    resp.raise_for_status()
+                    node.events_connected = True
+                    delay = 1.0
+                    lines = []
+                    async for raw in resp.content:
+                        line = raw.decode('utf-8').rstrip('\r\n')
+                        if line:
+                            lines.append(line)
+                            continue
+                        if lines:
+                            self._on_event(node, *_parse_sse_event(lines))
+                            lines = []
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logging.debug(f"节点 {node.name} 事件流断开: {e}")
+            finally:
+                node.events_connected = False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    def _on_event(self, node, event_id, event, data):
+        if event_id is not None:
+            node.last_event_id = event_id
+        if event != 'detection' or not data:
+            return
+        try:
+            detection = json.loads(data)
+        except ValueError:
+            return
+        node.events += 1
+        danger_changed = detection.get('has_danger', False) != node.has_danger
+        node.has_danger = detection.get('has_danger', False)
+        if detection.get('detections'):
+            node.last_detection = detection
+        # 空结果每帧都有，只转发有检测框或告警状态变化的事件，避免节点多时合并流过大
+        if detection.get('detections') or danger_changed:
+            self.events.publish({'node': node.name, **detection})
+
+    async def _poll_snapshot(self, node):
+        """按间隔拉取快照；带上缓存的 ETag，画面未变时节点返回 304，不重复传输 JPEG"""
+        timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+        while True:
+            headers = {}
+            if node.snapshot is not None:
+                headers['If-None-Match'] = node.snapshot[1]
+            try:
+                async with self.session.get(node.url + '/api/snapshot', headers=headers, timeout=timeout) as resp:
+                    node.snapshot_fetches += 1
+                    if resp.status == 304:
+                        node.snapshot_not_modified += 1
+                    elif resp.status == 200:
+                        node.snapshot = (
+                            await resp.read(), resp.headers.get('ETag'),
+                            resp.headers.get('Last-Modified'), time.time(),
+                        )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.debug(f"节点 {node.name} 快照拉取失败: {e}")
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+
+    def summary(self):
+        nodes = [node.summary() for node in self.nodes.values()]
+        online = [node for node in nodes if node['online']]
+        return {
+            'nodes': nodes,
+            'totals': {
+                'nodes': len(nodes),
+                'online': len(online),
+                'offline': len(nodes) - len(online),
+                'danger': sum(1 for node in nodes if node['has_danger']),
+                'detected_fires': sum(node['detected_fires'] for node in nodes),
+                'detected_smoke': sum(node['detected_smoke'] for node in nodes),
+                'current_fps': round(sum(node['current_fps'] or 0 for node in online), 2),
+            },
+            'events_seq': self.events.last_seq,
+        }
+
+
+# --- API 路由 ---
+
+async def fleet_summary(request):
+    """全部节点摘要及集群汇总"""
+    return web.json_response(request.app['fleet'].summary(), headers=CORS_HEADERS)
+
+
+async def node_detail(request):
+    """单个节点的完整状态（原始 /api/stats、/api/health 及最近一次检测）"""
+    node = request.app['fleet'].nodes.get(request.match_info['name'])
+    if node is None:
+        return web.json_response(
+            {"status": "error", "message": f"未知节点: {request.match_info['name']}"}, status=404, headers=CORS_HEADERS
+        )
+    return web.json_response(node.detail(), headers=CORS_HEADERS)
+
+
+async def node_snapshot(request):
+    """节点最新快照（取自缓存，ETag 沿用节点返回的值）"""
+    node = request.app['fleet'].nodes.get(request.match_info['name'])
+    if node is None:
+        return web.json_response(
+            {"status": "error", "message": f"未知节点: {request.match_info['name']}"}, status=404, headers=CORS_HEADERS
+        )
+    if node.snapshot is None:
+        return web.json_response(
+            {"status": "error", "message": "暂无画面"}, status=503, headers={'Retry-After': '2', **CORS_HEADERS}
+        )
+    jpeg, etag, last_modified, fetched_at = node.snapshot
+    headers = {
+        'Last-Modified': last_modified or http_date(fetched_at),
+        'Cache-Control': 'no-cache',
+        **CORS_HEADERS,
+    }
+    if etag:
+        headers['ETag'] = etag
+        if parse_etags(request.headers.get('If-None-Match')).contains(etag.strip('"')):
+            return web.Response(status=304, headers=headers)
+    return web.Response(body=jpeg, content_type='image/jpeg', headers=headers)
+
+
+async def fleet_event_stream(request):
+    """各节点检测事件合并后的 SSE 流（格式同 app_edge /api/events，另加 node 字段）"""
+    events = request.app['fleet'].events
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+        **CORS_HEADERS,
+    })
+    await response.prepare(request)
+
+    queue = events.subscribe()
+    try:
+        await response.write(b'retry: 2000\n\n')
+        seq = events.resume_seq(request.headers.get('Last-Event-ID') or request.query.get('last_id'))
+        for item_seq, _, payload in events.since(seq):
+            seq = item_seq
+            await response.write(payload)
+        while True:
+            try:
+                item_seq, _, payload = await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                await response.write(b': keepalive\n\n')
+                continue
+            if item_seq > seq:
+                seq = item_seq
+                await response.write(payload)
+    except (ConnectionResetError, asyncio.CancelledError):
+        pass
+    finally:
+        events.unsubscribe(queue)
+    return response
+
+
+def create_app(nodes=None):
+    """创建集群汇聚服务应用"""
+    app = web.Application()
+    app['fleet'] = FleetAggregator(nodes if nodes is not None else load_nodes())
+    app.router.add_get('/api/fleet', fleet_summary)
+    app.router.add_get('/api/fleet/nodes/{name}', node_detail)
+    app.router.add_get('/api/fleet/snapshot/{name}', node_snapshot)
+    app.router.add_get('/api/fleet/events', fleet_event_stream)
+
+    async def on_startup(app):
+        await app['fleet'].start()
+
+    async def on_cleanup(app):
+        logging.info('👋 集群汇聚服务正在停止...')
+        await app['fleet'].stop()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.DEBUG if os.getenv('DEBUG', '0') == '1' else logging.INFO,
+        format='[%(asctime)s] %(levelname)s: %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+    logging.info(f"🚀 启动集群汇聚服务 (端口: {PORT})")
+    web.run_app(create_app(), host='0.0.0.0', port=PORT, access_log=None)
@@ -0,0 +1,212 @@
+"""
+共享帧缓冲
+采集线程是唯一读取摄像头的线程，把编码好的帧发布到缓冲区；
+所有视频流客户端（线程式 WSGI 生成器或 asyncio 协程）共享读取同一份数据，
+客户端数量不再影响摄像头读取和推理。
+快照轮询客户端直接读取 latest，并按 ETag 判断画面是否更新。
+"""
+import asyncio
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# 快照接口被轮询后，继续为该缓冲区编码帧的时间（秒）
+SNAPSHOT_LINGER = 10.0
+
+
+class Frame:
+    """
+    发布到缓冲区的一帧
+
+    image 为编码 jpeg 所用的 BGR 图像（用于按客户端规格重新编码）；
+    image_id 标识画面内容，同一图像重复发布时保持不变，便于复用已编码的规格；
+    trace 为该帧的各阶段时刻（frame_trace.FrameTrace，已含 publish），没有时为 None。
+    """
+    __slots__ = ('seq', 'jpeg', 'timestamp', 'has_danger', 'image', 'image_id', 'frame_id', 'trace')
+
+    def __init__(self, seq, jpeg, timestamp, has_danger=False, image=None, image_id=None, frame_id=None,
+                 trace=None):
+        self.seq = seq
+        self.frame_id = frame_id  # 摄像头帧号，与检测事件中的 frame_id 对应
+        self.jpeg = jpeg
+        self.timestamp = timestamp
+        self.has_danger = has_danger
+        self.image = image
+        self.image_id = image_id if image_id is not None else seq
+        self.trace = trace
+
+
+def mjpeg_part(frame, data=None):
+    """
+    MJPEG 流中的一帧（boundary=frame）
+
+    除图像外附带缓冲区序号和发布时间（X-Frame-Seq / X-Timestamp），客户端可据此统计丢帧；
+    有延迟追踪时另附 trace_headers() 中的采集时间、帧龄和各阶段耗时。
+    data 为按客户端规格重新编码的 JPEG，默认用原始编码。
+    """
+    data = frame.jpeg if data is None else data
+    head = (b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n'
+            b'X-Frame-Seq: %d\r\nX-Timestamp: %.3f\r\n' % (len(data), frame.seq, frame.timestamp))
+    if frame.trace is not None:
+        head += ''.join(f'{name}: {value}\r\n' for name, value in trace_headers(frame.trace).items()).encode()
+    return head + b'\r\n' + data + b'\r\n'
+
+
+def trace_headers(trace, now=None):
+    """
+    帧延迟元数据（MJPEG 分块头和快照响应头）
+
+    X-Capture-Timestamp 为采集时刻的墙钟时间（Unix 秒），客户端与服务器时钟同步时，
+    显示时刻减去它即端到端（glass-to-glass）延迟；X-Frame-Age 为发送时服务端测得的帧龄（毫秒），
+    X-Stage-Times 为发布前各阶段耗时（毫秒，见 frame_trace）。
+    """
+    return {
+        'X-Capture-Timestamp': f'{trace.wall_time:.3f}',
+        'X-Frame-Age': f'{trace.age(now) * 1000:.1f}',
+        'X-Stage-Times': trace.header(),
+    }
+
+
+def _offer_latest(queue, frame):
+    """向有界队列投递帧；队列满时丢弃最旧的帧，慢客户端总是拿到最新画面"""
+    if queue.full():
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+    queue.put_nowait(frame)
+
+
+class FrameBuffer:
+    """最新帧缓冲区（一个摄像头一个）"""
+
+    def __init__(self, name='default'):
+        self.name = name
+        self.latest = None
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._subscribers = {}  # asyncio.Queue -> event loop
+        self._sub_lock = threading.Lock()
+        self._readers = 0  # 线程式客户端数量
+        self._last_polled = 0.0
+        # ETag 前缀：每次启动不同，避免重启后序号重复导致客户端误判画面未变
+        self.etag_prefix = os.urandom(4).hex()
+
+    def publish(self, jpeg, has_danger=False, image=None, frame_id=None, trace=None):
+        """发布一帧（采集线程调用）；trace 为该帧的延迟追踪，记录发布时刻后随帧保存"""
+        if trace is not None:
+            trace = trace.mark('publish')
+        with self._cond:
+            self._seq += 1
+            image_id = None
+            if image is not None and self.latest is not None and self.latest.image is image:
+                image_id = self.latest.image_id
+            frame = Frame(self._seq, jpeg, time.time(), has_danger, image, image_id, frame_id, trace)
+            self.latest = frame
+            self._cond.notify_all()
+
+        with self._sub_lock:
+            subscribers = list(self._subscribers.items())
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer_latest, queue, frame)
+            except RuntimeError:
+                # 事件循环已关闭
+                self.unsubscribe(queue)
+        return frame
+
+    def wait_next(self, last_seq, timeout=1.0):
+        """
+        阻塞等待比 last_seq 更新的帧（线程式客户端使用）
+
+        Returns:
+            Frame: 新帧；超时返回 None
+        """
+        with self._cond:
+            if not self._cond.wait_for(
+                lambda: self.latest is not None and self.latest.seq > last_seq, timeout
+            ):
+                return None
+            return self.latest
+
+    def subscribe(self, maxsize=2):
+        """
+        订阅帧（asyncio 客户端使用，需在事件循环中调用）
+
+        Returns:
+            asyncio.Queue: 每个客户端独立的有界队列
+        """
+        queue = asyncio.Queue(maxsize=maxsize)
+        # 无人观看期间最新帧可能早已过时，此时不立即推送，等采集线程发布下一帧
+        live = self.stale_seq() == 0
+        with self._sub_lock:
+            self._subscribers[queue] = asyncio.get_running_loop()
+        if live and self.latest is not None:
+            _offer_latest(queue, self.latest)
+        return queue
+
+    def unsubscribe(self, queue):
+        with self._sub_lock:
+            self._subscribers.pop(queue, None)
+
+    @contextmanager
+    def reader(self):
+        """线程式客户端在读取期间持有，用于统计是否有人在看"""
+        with self._sub_lock:
+            self._readers += 1
+        try:
+            yield self
+        finally:
+            with self._sub_lock:
+                self._readers -= 1
+
+    def touch(self):
+        """快照轮询时调用，最近被轮询过的缓冲区视为有人在看"""
+        self._last_polled = time.monotonic()
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers) + self._readers
+
+    def has_readers(self):
+        return self.subscriber_count > 0 or time.monotonic() - self._last_polled < SNAPSHOT_LINGER
+
+    def stale_seq(self):
+        """
+        无人观看时采集线程不再发布本缓冲区，最新帧可能是很久以前的画面：返回其序号，
+        新客户端应等待比它更新的帧；正被观看（或还没有帧）时返回 0。需在 touch() / 订阅之前调用
+        """
+        latest = self.latest
+        if latest is None or self.has_readers():
+            return 0
+        return latest.seq
+
+    def etag(self, frame):
+        return f'{self.etag_prefix}-{frame.seq}'
+
+    def seq_from_etag(self, etag):
+        """从本缓冲区生成的 ETag 中取出帧序号；不是本次启动生成的返回 None"""
+        prefix, _, seq = etag.partition('-')
+        if prefix == self.etag_prefix and seq.isdigit():
+            return int(seq)
+        return None
+
+
+_buffers = {}
+_buffers_lock = threading.Lock()
+
+
+def find_buffer(name):
+    """按名称查找已有的帧缓冲区，不存在返回 None"""
+    with _buffers_lock:
+        return _buffers.get(name)
+
+
+def get_buffer(name='default'):
+    """按摄像头名称获取（或创建）帧缓冲区"""
+    with _buffers_lock:
+        buffer = _buffers.get(name)
+        if buffer is None:
+            buffer = _buffers[name] = FrameBuffer(name)
+        return buffer
@@ -0,0 +1,131 @@
+"""
+帧延迟追踪 - 记录每帧从产生到送达客户端经过的各阶段时刻，定位"画面慢几秒"发生在哪一段
+
+采集时为每帧建立 FrameTrace：帧在视频源处产生的单调时钟时刻（V4L2 驱动缓冲区时间戳 /
+解码线程的解码时刻，取不到时为读取时刻）及对应的墙钟时间。流水线每完成一个阶段调用
+mark(阶段名)，得到追加了该时刻的新对象——FrameTrace 不可变，缓存的标注帧被重复发布、
+多个客户端同时读取同一帧时互不影响。阶段耗时为相邻两个时刻之差：
+
+    source     在视频源缓冲中等待采集线程读取（V4L2 缓冲区 / 解码线程缓冲区）
+    queue      在推理队列 frame_queue 中等待
+    inference  模型推理
+    encode     绘制检测框 + JPEG 编码（原始画面只有编码）
+    publish    编码完成到发布到帧缓冲区（标注画面即在 result_queue 中等待采集线程取走）
+    send       发布后到写入客户端连接（客户端等待 + 套接字写入）
+
+原始画面不经过推理，只有 source / encode / publish / send。
+"""
+import threading
+import time
+from collections import deque
+
+# 各阶段的先后顺序（用于输出时排序）
+STAGES = ('source', 'queue', 'inference', 'encode', 'publish', 'send')
+# 帧龄直方图分桶（秒）：从几十毫秒的正常延迟到数十秒的严重积压
+AGE_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+# 滚动统计保留的最近样本数
+WINDOW = 300
+
+
+class FrameTrace:
+    """
+    一帧的阶段时刻（time.monotonic()）
+
+    Args:
+        captured: 帧在视频源处产生的单调时钟时刻
+        now: 建立追踪时的单调时钟时刻（默认当前），用于换算采集时刻的墙钟时间
+    """
+    __slots__ = ('frame_id', 'captured', 'wall_time', 'marks')
+
+    def __init__(self, frame_id=None, captured=None, now=None, marks=()):
+        now = time.monotonic() if now is None else now
+        self.frame_id = frame_id
+        self.captured = now if captured is None else captured
+        # 采集时刻的墙钟时间（客户端与服务器时钟同步时，可据此计算端到端延迟）
+        self.wall_time = time.time() - (now - self.captured)
+        self.marks = marks
+
+    def mark(self, stage, at=None):
+        """返回追加了阶段 stage 完成时刻的新 FrameTrace"""
+        trace = FrameTrace.__new__(FrameTrace)
+        trace.frame_id = self.frame_id
+        trace.captured = self.captured
+        trace.wall_time = self.wall_time
+        trace.marks = self.marks + ((stage, time.monotonic() if at is None else at),)
+        return trace
+
+    def age(self, now=None):
+        """帧龄：从采集到 now（默认当前）的秒数"""
+        return (time.monotonic() if now is None else now) - self.captured
+
+    def stages(self):
+        """
+        各阶段耗时（秒）
+
+        Returns:
+            list: [(阶段名, 耗时), ...]，按经过的先后顺序
+        """
+        durations = []
+        previous = self.captured
+        for stage, at in self.marks:
+            durations.append((stage, max(0.0, at - previous)))
+            previous = at
+        return durations
+
+    def header(self):
+        """流元数据中的阶段耗时，如 'source=1.2,queue=35.0,inference=80.3'（毫秒）"""
+        return ','.join(f'{stage}={duration * 1000:.1f}' for stage, duration in self.stages())
+
+    def to_dict(self, now=None):
+        """JSON 形式的延迟信息（WebSocket 帧头、检测事件）"""
+        return {
+            'captured_at': round(self.wall_time, 3),
+            'age_ms': round(self.age(now) * 1000, 1),
+            'stages_ms': {stage: round(duration * 1000, 1) for stage, duration in self.stages()},
+        }
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class LatencyWindow:
+    """最近若干个样本的滚动统计（各阶段耗时、送达客户端时的帧龄），供 /api/latency 查询"""
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self._samples = {}  # (分组, 名称) -> deque
+        self._lock = threading.Lock()
+
+    def add(self, group, name, value):
+        samples = self._samples.get((group, name))
+        if samples is None:
+            with self._lock:
+                samples = self._samples.setdefault((group, name), deque(maxlen=self.window))
+        samples.append(value)
+
+    def add_trace(self, group, trace):
+        """记录一帧已经过的各阶段耗时"""
+        for stage, duration in trace.stages():
+            self.add(group, stage, duration)
+
+    def summary(self):
+        """
+        Returns:
+            dict: {分组: {名称: {count, p50_ms, p95_ms, max_ms}}}，阶段按流水线顺序排列
+        """
+        with self._lock:
+            items = [(key, list(samples)) for key, samples in self._samples.items()]
+        order = {stage: index for index, stage in enumerate(STAGES)}
+        result = {}
+        for (group, name), values in sorted(items, key=lambda item: (item[0][0], order.get(item[0][1], len(order)))):
+            if not values:
+                continue
+            ordered = sorted(values)
+            result.setdefault(group, {})[name] = {
+                'count': len(ordered),
+                'p50_ms': round(_percentile(ordered, 0.5) * 1000, 1),
+                'p95_ms': round(_percentile(ordered, 0.95) * 1000, 1),
+                'max_ms': round(ordered[-1] * 1000, 1),
+            }
+        return result
@@ -0,0 +1,450 @@
+"""
+并发观看压力测试 - 逐级增加 MJPEG / SSE / 快照客户端，找出边缘设备能承受的观看人数
+默认在本机启动一个服务（视频文件源 + 桩模型，不需要摄像头和模型权重），每级客户端数保持一段时间，统计：
+
+- 每个客户端实际收到的帧率、画面延迟（收到时刻 - 服务端发布时刻，取自 X-Timestamp）、丢帧（序号跳跃）
+- 服务进程的 CPU / RSS，以及压测进程自身的 CPU（接近 100% 说明瓶颈在压测端，结果不可信）
+
+视频类客户端帧率低于服务采集帧率的 90%、或 p95 画面延迟超过 --max-age 即视为饱和；
+结果输出为每级一行的报告（JSON）和饱和曲线（CSV）。
+
+用法:
+    python3 loadtest.py                                              # 1~64 个 MJPEG 客户端，每级 15 秒
+    python3 loadtest.py --server async --mix mjpeg=3,sse=1,snapshot=1 --steps 10,25,50,100
+    python3 loadtest.py --url http://192.168.1.21:5000 --pid 1234    # 压测已在运行的服务
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.request import urlopen
+
+import aiohttp
+import cv2
+import psutil
+
+from calibration import synthetic_frames
+from device_config import DEVICE_PRESETS
+
+CLIENT_KINDS = ('mjpeg', 'sse', 'snapshot')
+# 视频类客户端帧率低于服务采集帧率的这个比例即视为饱和
+SATURATION_RATIO = 0.9
+# 客户端断开后重连前等待（秒）
+RECONNECT_DELAY = 1.0
+# 快照客户端长轮询等待（秒）
+SNAPSHOT_WAIT = 5
+# 本机启动的服务关闭的功能（压测只关心视频流）
+SERVER_ENV = {
+    'MODEL_STUB': '1',
+    'CAMERA_PACE': 'realtime',
+    'TELEMETRY': '0',
+    'CLIP_RECORDING': '0',
+    'DETECTION_HISTORY': '0',
+    'DVR_RECORDING': '0',
+    'ALARM': '0',
+}
+
+
+def _percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def parse_mix(text):
+    """解析客户端比例，如 'mjpeg=3,sse=1'"""
+    mix = {}
+    for item in text.split(','):
+        kind, _, weight = item.partition('=')
+        kind = kind.strip()
+        if kind not in CLIENT_KINDS:
+            raise ValueError(f"未知的客户端类型: {kind}")
+        mix[kind] = float(weight or 1)
+    if not any(weight > 0 for weight in mix.values()):
+        raise ValueError('客户端比例不能全为 0')
+    return mix
+
+
+def plan_clients(count, mix):
+    """
+    按比例分配客户端类型
+
+    逐个分配给当前最欠缺的类型，因此前 n 个的分配与总数无关，逐级加压时只需追加新客户端
+    """
+    kinds = []
+    total = sum(mix.values())
+    for i in range(count):
+        kinds.append(max(mix, key=lambda kind: mix[kind] / total * (i + 1) - kinds.count(kind)))
+    return kinds
+
+
+class ClientStats:
+    """单个客户端在一个统计窗口内的收帧情况"""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.last_seq = None
+        self.reset()
+
+    def reset(self):
+        self.started = time.monotonic()
+        self.frames = 0
+        self.bytes = 0
+        self.dropped = 0
+        self.errors = 0
+        self.ages = []
+
+    def on_frame(self, seq, timestamp, size):
+        if seq is not None:
+            if self.last_seq is not None and seq > self.last_seq + 1:
+                self.dropped += seq - self.last_seq - 1
+            self.last_seq = seq
+        if timestamp is not None:
+            self.ages.append(max(0.0, time.time() - timestamp))
+        self.frames += 1
+        self.bytes += size
+
+    def fps(self):
+        elapsed = time.monotonic() - self.started
+        return self.frames / elapsed if elapsed > 0 else 0.0
+
+
+async def _mjpeg_client(session, base_url, stats):
+    async with session.get(f'{base_url}/video_feed', params={'adaptive': '0'}) as resp:
+        resp.raise_for_status()
+        content = resp.content
+        while True:
+            line = await content.readline()
+            if not line:
+                return
+            if not line.startswith(b'--frame'):
+                continue
+            headers = {}
+            while True:
+                line = await content.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            if 'content-length' not in headers:
+                raise RuntimeError('MJPEG 分块缺少 Content-Length（服务端版本过旧）')
+            data = await content.readexactly(int(headers['content-length']))
+            seq = headers.get('x-frame-seq')
+            timestamp = headers.get('x-timestamp')
+            stats.on_frame(int(seq) if seq else None, float(timestamp) if timestamp else None, len(data))
+
+
+async def _sse_client(session, base_url, stats):
+    async with session.get(f'{base_url}/api/events') as resp:
+        resp.raise_for_status()
+        event_id, event, data = None, None, []
+        async for line in resp.content:
+            line = line.decode('utf-8').rstrip('\r\n')
+            if line:
+                field, _, value = line.partition(':')
+                value = value[1:] if value.startswith(' ') else value
+                if field == 'id':
+                    event_id = value
+                elif field == 'event':
+                    event = value
+                elif field == 'data':
+                    data.append(value)
+                continue
+            if event == 'detection' and data:
+                payload = '\n'.join(data)
+                stats.on_frame(
+                    int(event_id) if event_id and event_id.isdigit() else None,
+                    json.loads(payload).get('timestamp'), len(payload),
+                )
+            event, data = None, []
+
+
+async def _snapshot_client(session, base_url, stats):
+    etag = None
+    while True:
+        headers = {'If-None-Match': etag} if etag else {}
+        async with session.get(f'{base_url}/api/snapshot', params={'wait': str(SNAPSHOT_WAIT)},
+                               headers=headers) as resp:
+            if resp.status == 304:
+                continue
+            resp.raise_for_status()
+            data = await resp.read()
+            etag = resp.headers.get('ETag')
+            seq = (etag or '').strip('"').rpartition('-')[2]
+            timestamp = resp.headers.get('X-Timestamp')
+            stats.on_frame(int(seq) if seq.isdigit() else None, float(timestamp) if timestamp else None, len(data))
+
+
+CLIENTS = {'mjpeg': _mjpeg_client, 'sse': _sse_client, 'snapshot': _snapshot_client}
+
+
+async def run_client(session, base_url, stats):
+    """运行一个客户端直到被取消；断开或出错后重连"""
+    while True:
+        try:
+            await CLIENTS[stats.kind](session, base_url, stats)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            stats.errors += 1
+            logging.debug(f"{stats.kind} 客户端出错: {e}")
+        await asyncio.sleep(RECONNECT_DELAY)
+
+
+def summarize_step(count, clients, server_stats, server_proc, loadgen_proc, max_age):
+    """汇总一级压测结果"""
+    row = {
+        'clients': count,
+        'server_fps': server_stats.get('current_fps'),
+        'server_cpu': round(server_proc.cpu_percent(), 1) if server_proc else None,
+        'server_rss_mb': round(server_proc.memory_info().rss / 1048576, 1) if server_proc else None,
+        'loadgen_cpu': round(loadgen_proc.cpu_percent(), 1),
+        'kinds': {},
+    }
+    saturated = []
+    for kind in CLIENT_KINDS:
+        group = [stats for stats in clients if stats.kind == kind]
+        if not group:
+            continue
+        rates = [stats.fps() for stats in group]
+        ages = [age for stats in group for age in stats.ages]
+        frames = sum(stats.frames for stats in group)
+        dropped = sum(stats.dropped for stats in group)
+        elapsed = max(time.monotonic() - group[0].started, 1e-6)
+        summary = {
+            'clients': len(group),
+            'fps_p50': round(_percentile(rates, 50), 2),
+            'fps_min': round(min(rates), 2),
+            'age_p50_ms': round(_percentile(ages, 50) * 1000, 1) if ages else None,
+            'age_p95_ms': round(_percentile(ages, 95) * 1000, 1) if ages else None,
+            'age_p99_ms': round(_percentile(ages, 99) * 1000, 1) if ages else None,
+            'drop_ratio': round(dropped / (frames + dropped), 4) if frames + dropped else 0.0,
+            'errors': sum(stats.errors for stats in group),
+            'mbps': round(sum(stats.bytes for stats in group) * 8 / elapsed / 1e6, 2),
+        }
+        row['kinds'][kind] = summary
+        if summary['age_p95_ms'] is not None and summary['age_p95_ms'] > max_age * 1000:
+            saturated.append(f'{kind} 延迟')
+        # SSE 事件按推理速率产生，不与采集帧率比较
+        if kind != 'sse' and row['server_fps'] and summary['fps_p50'] < row['server_fps'] * SATURATION_RATIO:
+            saturated.append(f'{kind} 帧率')
+        if summary['errors'] and not summary['fps_min']:
+            saturated.append(f'{kind} 断连')
+    row['saturated'] = saturated
+    return row
+
+
+def _log_row(row):
+    head = (f"{row['clients']:>4} 客户端 | 服务 {row['server_fps'] or 0:.1f} FPS"
+            f"  CPU {row['server_cpu'] if row['server_cpu'] is not None else '-'}%"
+            f"  RSS {row['server_rss_mb'] if row['server_rss_mb'] is not None else '-'}MB"
+            f"  压测端 CPU {row['loadgen_cpu']}%")
+    logging.info(head + (f"  ⚠️ 饱和: {', '.join(row['saturated'])}" if row['saturated'] else ''))
+    for kind, summary in row['kinds'].items():
+        logging.info(
+            f"     {kind:<8} x{summary['clients']:<4} {summary['fps_p50']:>6.2f} FPS (最低 {summary['fps_min']:.2f})"
+            f"  延迟 p50/p95 {summary['age_p50_ms']}/{summary['age_p95_ms']}ms"
+            f"  丢帧 {summary['drop_ratio']:.1%}  错误 {summary['errors']}  {summary['mbps']} Mbps"
+        )
+
+
+async def ramp(base_url, steps, mix, hold, settle, server_pid=None, max_age=1.0, stop_on_saturation=False):
+    """
+    逐级加压（已建立的客户端保持连接，每级只追加新客户端）
+
+    Returns:
+        list: 每级的汇总结果
+    """
+    server_proc = psutil.Process(server_pid) if server_pid else None
+    loadgen_proc = psutil.Process()
+    clients, tasks, rows = [], [], []
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30)
+    async with aiohttp.ClientSession(timeout=timeout, connector=aiohttp.TCPConnector(limit=0)) as session:
+        try:
+            for count in steps:
+                for kind in plan_clients(count, mix)[len(clients):]:
+                    stats = ClientStats(kind)
+                    clients.append(stats)
+                    tasks.append(asyncio.create_task(run_client(session, base_url, stats)))
+                await asyncio.sleep(settle)
+                for stats in clients:
+                    stats.reset()
+                for proc in (server_proc, loadgen_proc):
+                    if proc:
+                        proc.cpu_percent()
+                await asyncio.sleep(hold)
+                async with session.get(f'{base_url}/api/stats') as resp:
+                    server_stats = await resp.json() if resp.status == 200 else {}
+                row = summarize_step(count, clients, server_stats, server_proc, loadgen_proc, max_age)
+                rows.append(row)
+                _log_row(row)
+                if stop_on_saturation and row['saturated']:
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    return rows
+
+
+def write_synthetic_video(path, resolution, fps=20, seconds=10):
+    """生成合成视频文件作为服务的视频源（暖色块在噪声背景上移动，桩模型可检出）"""
+    width, height = resolution
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+    frames = synthetic_frames(width, height)
+    for i in range(int(fps * seconds)):
+        writer.write(frames[i % len(frames)])
+    writer.release()
+    return path
+
+
+class LocalServer:
+    """在本机启动被测服务（子进程），日志写入临时目录"""
+
+    def __init__(self, server='edge', port=5090, source=None, preset='auto', stub_delay=0.0):
+        self.server = server
+        self.port = port
+        self.source = source
+        self.preset = preset
+        self.stub_delay = stub_delay
+        self.workdir = tempfile.mkdtemp(prefix='loadtest-')
+        self.process = None
+        self._log = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def start(self, timeout=60.0):
+        source = self.source or write_synthetic_video(
+            os.path.join(self.workdir, 'source.avi'), DEVICE_PRESETS[self.preset]['resolution']
+        )
+        env = dict(os.environ, **SERVER_ENV, PORT=str(self.port), CAMERA_SOURCE=source,
+                   DEVICE_TYPE=self.preset, MODEL_STUB_DELAY=str(self.stub_delay))
+        script = 'app_async.py' if self.server == 'async' else 'app_edge.py'
+        self._log = open(os.path.join(self.workdir, 'server.log'), 'wb')
+        self.process = subprocess.Popen(
+            [sys.executable, script], cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env, stdout=self._log, stderr=subprocess.STDOUT,
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"服务启动失败，日志见 {self._log.name}")
+            try:
+                with urlopen(f'{self.url}/api/health/ready', timeout=2) as resp:
+                    if resp.status == 200:
+                        return
+            except OSError:
+                pass
+            time.sleep(0.5)
+        raise RuntimeError(f"服务 {timeout:.0f} 秒内未就绪，日志见 {self._log.name}")
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self._log:
+            self._log.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def write_curve(rows, path):
+    """饱和曲线（CSV）：每级每类客户端一行"""
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['clients', 'kind', 'fps_p50', 'fps_min', 'age_p50_ms', 'age_p95_ms', 'age_p99_ms',
+                         'drop_ratio', 'server_fps', 'server_cpu', 'server_rss_mb', 'loadgen_cpu', 'saturated'])
+        for row in rows:
+            for kind, summary in row['kinds'].items():
+                writer.writerow([
+                    row['clients'], kind, summary['fps_p50'], summary['fps_min'], summary['age_p50_ms'],
+                    summary['age_p95_ms'], summary['age_p99_ms'], summary['drop_ratio'], row['server_fps'],
+                    row['server_cpu'], row['server_rss_mb'], row['loadgen_cpu'], int(bool(row['saturated'])),
+                ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='并发观看压力测试（MJPEG / SSE / 快照）')
+    parser.add_argument('--url', default=None, help='压测已运行的服务（不指定则在本机启动）')
+    parser.add_argument('--pid', type=int, default=None, help='--url 对应服务的进程号（用于统计 CPU / RSS）')
+    parser.add_argument('--server', default='edge', choices=('edge', 'async'),
+                        help='本机启动的服务: edge=app_edge.py, async=app_async.py')
+    parser.add_argument('--port', type=int, default=5090, help='本机启动服务的端口')
+    parser.add_argument('--source', default=None, help='本机服务的视频文件（默认生成合成视频）')
+    parser.add_argument('--preset', default='auto', choices=sorted(DEVICE_PRESETS), help='本机服务的设备预设')
+    parser.add_argument('--stub-delay', type=float, default=0.0, help='桩模型每帧模拟推理耗时（毫秒）')
+    parser.add_argument('--steps', default='1,2,4,8,16,32,64', help='各级客户端数（逗号分隔）')
+    parser.add_argument('--mix', default='mjpeg=1', help='客户端比例，如 mjpeg=3,sse=1,snapshot=1')
+    parser.add_argument('--hold', type=float, default=15.0, help='每级统计时长（秒）')
+    parser.add_argument('--settle', type=float, default=3.0, help='每级加压后等待稳定的时间（秒，不计入统计）')
+    parser.add_argument('--max-age', type=float, default=1.0, help='p95 画面延迟超过该秒数视为饱和')
+    parser.add_argument('--stop-on-saturation', action='store_true', help='饱和后不再继续加压')
+    parser.add_argument('--output', default='loadtest.json', help='报告文件（JSON）')
+    parser.add_argument('--csv', default='loadtest.csv', help='饱和曲线文件（CSV）')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+    try:
+        mix = parse_mix(args.mix)
+        steps = sorted({int(step) for step in args.steps.split(',') if step.strip()})
+    except ValueError as e:
+        parser.error(str(e))
+
+    server = None
+    base_url, pid = args.url, args.pid
+    if base_url is None:
+        server = LocalServer(args.server, args.port, args.source, args.preset, args.stub_delay)
+        logging.info(f"启动被测服务 ({args.server}, 端口 {args.port})...")
+        server.start()
+        base_url, pid = server.url, server.process.pid
+    base_url = base_url.rstrip('/')
+
+    rows = []
+    try:
+        rows = asyncio.run(ramp(
+            base_url, steps, mix, args.hold, args.settle, pid, args.max_age, args.stop_on_saturation
+        ))
+    except KeyboardInterrupt:
+        logging.info('压测被中断，输出已完成的各级结果')
+    finally:
+        if server:
+            server.stop()
+
+    capacity = max((row['clients'] for row in rows if not row['saturated']), default=0)
+    first_saturated = next((row for row in rows if row['saturated']), None)
+    report = {
+        'url': base_url,
+        'mix': mix,
+        'hold': args.hold,
+        'max_age': args.max_age,
+        'steps': rows,
+        'capacity': capacity,
+        'saturated_at': first_saturated['clients'] if first_saturated else None,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    write_curve(rows, args.csv)
+
+    logging.info(f"✅ 报告已写入 {args.output}，饱和曲线已写入 {args.csv}")
+    if first_saturated:
+        logging.info(f"   最多 {capacity} 个客户端未饱和；{first_saturated['clients']} 个时饱和"
+                     f"（{', '.join(first_saturated['saturated'])}）")
+    else:
+        logging.info(f"   测试的 {rows[-1]['clients'] if rows else 0} 个客户端内均未饱和")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
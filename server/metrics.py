@@ -0,0 +1,273 @@
+"""
+运行指标 - 计数器、仪表和固定分桶直方图，以 Prometheus 文本格式导出（/metrics）
+
+采集、推理、编码和推流线程会同时更新同一指标，每个（带标签的）子指标各有一把锁，
+热路径上的一次更新只是一次无竞争加锁的加法（直方图另加一次分桶二分查找）。
+带标签的指标在启动时用 labels() 取得子指标并保存引用，每帧更新时不再查找标签。
+
+    frames = Counter('carport_frames_captured_total', '采集的帧数', ['camera'])
+    captured = frames.labels('default')
+    captured.inc()
+"""
+import bisect
+import math
+import threading
+
+# 文本格式的 Content-Type
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# 延迟直方图的默认分桶（秒）：覆盖 1ms 的编码到数秒的推理/推流阻塞
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if value != value:
+        return 'NaN'
+    if isinstance(value, int) or (float(value).is_integer() and abs(value) < 1e15):
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _labels_text(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class CounterChild:
+    """单调递增的计数"""
+    __slots__ = ('_value', '_lock')
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def samples(self, name, labels):
+        yield name, labels, self._value
+
+
+class GaugeChild:
+    """可增可减的当前值；set_function() 后在导出时调用函数取值"""
+    __slots__ = ('_value', '_lock', '_function')
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+        self._function = None
+
+    def set(self, value):
+        self._value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self._value -= amount
+
+    def set_function(self, function):
+        self._function = function
+
+    @property
+    def value(self):
+        if self._function is not None:
+            return self._function()
+        return self._value
+
+    def samples(self, name, labels):
+        value = self.value
+        if value is not None:
+            yield name, labels, value
+
+
+class HistogramChild:
+    """固定分桶直方图（分桶计数在导出时累加为 Prometheus 的累积计数）"""
+    __slots__ = ('_bounds', '_counts', '_sum', '_lock')
+
+    def __init__(self, bounds):
+        self._bounds = bounds
+        self._counts = [0] * (len(bounds) + 1)  # 最后一个为 +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @property
+    def count(self):
+        return sum(self._counts)
+
+    def snapshot(self):
+        """返回 (各分桶计数, 总和)"""
+        with self._lock:
+            return list(self._counts), self._sum
+
+    def samples(self, name, labels):
+        counts, total = self.snapshot()
+        cumulative = 0
+        for bound, count in zip(self._bounds + (math.inf,), counts):
+            cumulative += count
+            yield f'{name}_bucket', labels + (('le', _format_value(bound)),), cumulative
+        yield f'{name}_sum', labels, total
+        yield f'{name}_count', labels, cumulative
+
+
+class Registry:
+    """指标注册表，render() 输出全部指标"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"指标重复注册: {metric.name}")
+            self._metrics[metric.name] = metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return ''.join(metric.render() for metric in metrics)
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        if registry is not None:
+            registry.register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kwargs):
+        """
+        取得（或创建）一组标签值对应的子指标
+
+        Raises:
+            ValueError: 标签数量或名称与定义不符
+        """
+        if kwargs:
+            if values or set(kwargs) != set(self.labelnames):
+                raise ValueError(f"{self.name} 的标签应为 {self.labelnames}")
+            values = tuple(str(kwargs[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(value) for value in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} 的标签应为 {self.labelnames}")
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def remove(self, *values):
+        """删除一组标签值（如已断开的客户端），不存在时忽略"""
+        with self._lock:
+            self._children.pop(tuple(str(value) for value in values), None)
+
+    def _default(self):
+        if self.labelnames:
+            raise ValueError(f"{self.name} 带标签，需先调用 labels()")
+        return self._children[()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {_escape_help(self.documentation)}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            children = list(self._children.items())
+        for values, child in children:
+            labels = tuple(zip(self.labelnames, values))
+            for name, sample_labels, value in child.samples(self.name, labels):
+                lines.append(f'{name}{_labels_text(sample_labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(_Metric):
+    """计数器（名称按惯例以 _total 结尾）"""
+    kind = 'counter'
+
+    def _new_child(self):
+        return CounterChild()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    @property
+    def value(self):
+        return self._default().value
+
+
+class Gauge(_Metric):
+    """仪表"""
+    kind = 'gauge'
+
+    def _new_child(self):
+        return GaugeChild()
+
+    def set(self, value):
+        self._default().set(value)
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def dec(self, amount=1):
+        self._default().dec(amount)
+
+    def set_function(self, function):
+        self._default().set_function(function)
+
+    @property
+    def value(self):
+        return self._default().value
+
+
+class Histogram(_Metric):
+    """固定分桶直方图"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(float(bound) for bound in buckets if bound != math.inf))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
@@ -0,0 +1,276 @@
+"""
+Modbus 客户端与设备模拟器
+只实现读保持寄存器（功能码 0x03），满足逆变器、BMS、环境传感器的遥测读取：
+- ModbusTCPClient：Modbus TCP（长连接，出错自动重连）
+- ModbusRTUClient：Modbus RTU 串口（需要 pyserial，同一串口上的设备共用一把锁）
+- ModbusSimulator：本地 Modbus TCP 服务器，按单元号模拟风机逆变器、光伏逆变器、BMS 和环境传感器
+"""
+import logging
+import math
+import random
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+READ_HOLDING_REGISTERS = 0x03
+# MBAP 头中长度字段的取值范围：单元号 + 至少功能码和一个字节，最长 253 字节的 PDU
+MIN_MBAP_LENGTH = 3
+MAX_MBAP_LENGTH = 254
+
+
+class ModbusError(Exception):
+    """Modbus 通信或协议错误"""
+
+
+def to_signed(value):
+    """16 位寄存器值按补码解释为有符号数"""
+    return value - 0x10000 if value & 0x8000 else value
+
+
+class ModbusTCPClient:
+    """Modbus TCP 客户端（单连接，非线程安全，每个设备一个实例）"""
+
+    def __init__(self, host, port=502, timeout=1.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._sock = None
+        self._transaction = 0
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+    def _recv_exact(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self._sock.recv(size - len(data))
+            if not chunk:
+                raise ModbusError("连接被对端关闭")
+            data += chunk
+        return data
+
+    def read_holding_registers(self, unit, address, count):
+        """
+        读保持寄存器
+
+        Returns:
+            list: 无符号 16 位寄存器值
+
+        Raises:
+            ModbusError: 通信失败或设备返回异常码
+        """
+        try:
+            if self._sock is None:
+                self._connect()
+            self._transaction = (self._transaction + 1) & 0xFFFF
+            request = struct.pack('>HHHBBHH', self._transaction, 0, 6, unit,
+                                  READ_HOLDING_REGISTERS, address, count)
+            self._sock.sendall(request)
+            transaction, _, length, _ = struct.unpack('>HHHB', self._recv_exact(7))
+            if not MIN_MBAP_LENGTH <= length <= MAX_MBAP_LENGTH:
+                # 长度字段不可信，连接上的后续数据也无法再对齐，按通信失败断开重连
+                raise ModbusError(f"MBAP 长度字段无效: {length}")
+            pdu = self._recv_exact(length - 1)
+        except (OSError, ModbusError) as e:
+            self.close()
+            raise ModbusError(f"{self.host}:{self.port} 通信失败: {e}") from e
+        if transaction != self._transaction:
+            self.close()
+            raise ModbusError(f"事务号不匹配: {transaction} != {self._transaction}")
+        return _parse_read_response(pdu, count)
+
+
+def _parse_read_response(pdu, count):
+    if len(pdu) < 2:
+        raise ModbusError("响应长度错误")
+    if pdu[0] & 0x80:
+        raise ModbusError(f"设备返回异常码 {pdu[1]}")
+    byte_count = pdu[1]
+    if byte_count != count * 2 or len(pdu) < 2 + byte_count:
+        raise ModbusError("响应长度错误")
+    return list(struct.unpack(f'>{count}H', pdu[2:2 + byte_count]))
+
+
+def crc16(data):
+    """Modbus RTU CRC16（多项式 0xA001）"""
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+
+_serial_locks = {}
+_serial_locks_guard = threading.Lock()
+
+
+class ModbusRTUClient:
+    """Modbus RTU 串口客户端（同一串口上的多个设备共享串口和锁）"""
+
+    _ports = {}
+
+    def __init__(self, port, baudrate=9600, timeout=0.5):
+        try:
+            import serial
+        except ImportError:
+            raise ModbusError("Modbus RTU 需要 pyserial: pip install pyserial")
+        with _serial_locks_guard:
+            if port not in self._ports:
+                self._ports[port] = serial.Serial(port, baudrate=baudrate, timeout=timeout)
+                _serial_locks[port] = threading.Lock()
+        self.port = port
+        self._serial = self._ports[port]
+        self._lock = _serial_locks[port]
+
+    def close(self):
+        pass  # 串口由同一串口上的所有设备共享，不单独关闭
+
+    def read_holding_registers(self, unit, address, count):
+        frame = struct.pack('>BBHH', unit, READ_HOLDING_REGISTERS, address, count)
+        frame += struct.pack('<H', crc16(frame))
+        with self._lock:
+            try:
+                self._serial.reset_input_buffer()
+                self._serial.write(frame)
+                header = self._serial.read(3)
+                if len(header) < 3:
+                    raise ModbusError("读取超时")
+                if header[1] & 0x80:
+                    self._serial.read(2)  # 丢弃 CRC
+                    raise ModbusError(f"设备返回异常码 {header[2]}")
+                rest = self._serial.read(header[2] + 2)
+            except OSError as e:
+                raise ModbusError(f"{self.port} 通信失败: {e}") from e
+        response = header + rest
+        if len(response) < 5 or crc16(response[:-2]) != struct.unpack('<H', response[-2:])[0]:
+            raise ModbusError("CRC 校验失败")
+        if response[0] != unit:
+            raise ModbusError(f"单元号不匹配: {response[0]} != {unit}")
+        return _parse_read_response(response[1:-2], count)
+
+
+# --- 设备模拟器 ---
+
+class _SimulatedPlant:
+    """
+    风光储车棚的简单物理模拟（与原前端随机游走的数值范围一致）
+
+    单元号: 1 风机逆变器, 2 光伏逆变器, 3 BMS, 4 环境传感器
+    """
+
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.last_update = time.time()
+        self.wind_speed = 5.2        # m/s
+        self.wind_power = 2.4        # kW
+        self.solar_power = 3.8       # kW
+        self.output_power = 4.1      # kW
+        self.battery_level = 78.0    # %
+        self.battery_capacity = 20.0  # kWh
+        self.temperature = 23.5      # °C
+        self.humidity = 65.0         # %
+
+    def _step(self):
+        now = time.time()
+        dt = min(now - self.last_update, 10.0)
+        if dt <= 0:
+            return
+        self.last_update = now
+        rng = self.rng
+        scale = math.sqrt(dt)
+        self.wind_speed = max(0.0, min(25.0, self.wind_speed + rng.gauss(0, 0.4) * scale))
+        # 风机功率近似与风速的三次方成正比，额定 6kW
+        self.wind_power = min(6.0, 0.018 * self.wind_speed ** 3)
+        hour = time.localtime(now).tm_hour + time.localtime(now).tm_min / 60.0
+        daylight = max(0.0, math.sin(math.pi * (hour - 6) / 12)) if 6 <= hour <= 18 else 0.0
+        self.solar_power = max(0.0, 5.0 * daylight * (0.8 + 0.2 * rng.random()))
+        self.output_power = max(0.0, min(8.0, self.output_power + rng.gauss(0, 0.25) * scale))
+        net_kwh = (self.wind_power + self.solar_power - self.output_power) * dt / 3600.0
+        self.battery_level = max(0.0, min(100.0, self.battery_level + net_kwh / self.battery_capacity * 100))
+        self.temperature = max(-30.0, min(60.0, self.temperature + rng.gauss(0, 0.1) * scale))
+        self.humidity = max(0.0, min(100.0, self.humidity + rng.gauss(0, 0.5) * scale))
+
+    def registers(self, unit):
+        """返回单元的保持寄存器（缩放为整数）"""
+        with self.lock:
+            self._step()
+            if unit == 1:
+                values = [self.wind_power * 100, self.wind_speed * 10]
+            elif unit == 2:
+                values = [self.solar_power * 100]
+            elif unit == 3:
+                voltage = 44.0 + 0.09 * self.battery_level  # 48V 电池组
+                values = [self.battery_level * 10, voltage * 10, self.output_power * 100]
+            elif unit == 4:
+                values = [self.temperature * 10, self.humidity * 10, self.wind_speed * 10]
+            else:
+                return None
+        return [int(round(v)) & 0xFFFF for v in values]
+
+
+class _ModbusTCPHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sock = self.request
+        plant = self.server.plant
+        while True:
+            try:
+                header = sock.recv(7, socket.MSG_WAITALL)
+                if len(header) < 7:
+                    return
+                transaction, protocol, length, unit = struct.unpack('>HHHB', header)
+                pdu = sock.recv(length - 1, socket.MSG_WAITALL)
+            except OSError:
+                return
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            function = pdu[0]
+            registers = plant.registers(unit)
+            if function != READ_HOLDING_REGISTERS:
+                body = bytes([function | 0x80, 0x01])  # 不支持的功能码
+            elif registers is None:
+                body = bytes([function | 0x80, 0x0B])  # 网关目标设备无响应
+            else:
+                address, count = struct.unpack('>HH', pdu[1:5])
+                if address + count > len(registers):
+                    body = bytes([function | 0x80, 0x02])  # 非法数据地址
+                else:
+                    values = registers[address:address + count]
+                    body = struct.pack(f'>BB{count}H', function, count * 2, *values)
+            try:
+                sock.sendall(struct.pack('>HHHB', transaction, protocol, len(body) + 1, unit) + body)
+            except OSError:
+                return
+
+
+class ModbusSimulator(socketserver.ThreadingTCPServer):
+    """
+    本地 Modbus TCP 模拟器（替代真实设备，开发和演示用）
+
+    Args:
+        latency: 每次请求的模拟响应延迟（秒）
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=5020, latency=0.0, seed=None):
+        self.plant = _SimulatedPlant(seed)
+        self.latency = latency
+        super().__init__((host, port), _ModbusTCPHandler)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='modbus-sim', daemon=True).start()
+        logging.info(f"🔌 Modbus 模拟器已启动: {self.server_address[0]}:{self.server_address[1]}")
+        return self
@@ -0,0 +1,295 @@
+"""
+模型管理 - 支持运行时热切换模型权重
+新模型在后台线程加载并预热，旧模型在此期间继续服务；
+预热成功后在两帧之间原子替换引用，预热失败则保留旧模型（回滚）。
+"""
+import threading
+import time
+import logging
+from collections import deque
+
+import cv2
+import numpy as np
+
+# 视为火情的类别
+DANGER_CLASSES = ('fire', 'smoke')
+
+
+def extract_detections(result):
+    """
+    把一帧的 YOLO 推理结果转换为检测列表（实时服务与离线分析共用）
+
+    Returns:
+        list: [{"class": 类别, "confidence": 置信度, "box": [x1, y1, x2, y2]}, ...]
+    """
+    if len(result.boxes) == 0:
+        return []
+    names = result.names
+    return [{
+        "class": names[int(cls_id)],
+        "confidence": round(float(conf), 3),
+        "box": [round(float(v), 1) for v in box],
+    } for cls_id, conf, box in zip(
+        result.boxes.cls.cpu().numpy(), result.boxes.conf.cpu().numpy(), result.boxes.xyxy.cpu().numpy()
+    )]
+
+
+class _StubTensor:
+    """模拟 torch.Tensor 的 .cpu().numpy()，桩模型的结果不依赖 torch"""
+
+    def __init__(self, array):
+        self.array = array
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+
+class _StubBoxes:
+    def __init__(self, boxes):
+        data = np.asarray(boxes, dtype=np.float32).reshape(-1, 6)
+        self.cls = _StubTensor(data[:, 0])
+        self.conf = _StubTensor(data[:, 1])
+        self.xyxy = _StubTensor(data[:, 2:])
+
+    def __len__(self):
+        return len(self.cls.array)
+
+
+class StubResult:
+    """桩模型的单帧结果（boxes / names / plot() 与 ultralytics Results 用法一致）"""
+
+    COLORS = {0: (0, 0, 255), 1: (160, 160, 160)}
+
+    def __init__(self, image, boxes, names):
+        self.orig_img = image
+        self.boxes = _StubBoxes(boxes)
+        self.names = names
+
+    def plot(self, line_width=None, font_size=None, **kwargs):
+        annotated = self.orig_img.copy()
+        thickness = line_width or 2
+        for cls_id, conf, box in zip(self.boxes.cls.array, self.boxes.conf.array, self.boxes.xyxy.array):
+            x1, y1, x2, y2 = (int(v) for v in box)
+            color = self.COLORS.get(int(cls_id), (255, 255, 255))
+            cv2.rectangle(annotated, (x1, y1), (x2, y2), color, thickness)
+            cv2.putText(annotated, f"{self.names[int(cls_id)]} {conf:.2f}", (x1, max(y1 - 6, 12)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5 * (font_size or 1), color, thickness)
+        return annotated
+
+
+class StubModel:
+    """
+    纯 CPU 的桩模型：调用方式与 ultralytics YOLO 相同，不需要模型文件和 torch
+
+    用颜色阈值把画面中的暖色块当作火焰，检测结果可复现；用于基准测试、压力测试等
+    只关心流水线开销、不关心检测精度的场合。delay 为模拟的每帧推理耗时（秒）。
+    """
+
+    names = {0: 'fire', 1: 'smoke'}
+
+    def __init__(self, delay=0.0, min_area=64):
+        self.delay = delay
+        self.min_area = min_area
+
+    def __call__(self, source, conf=0.25, verbose=False, device=None, **kwargs):
+        images = source if isinstance(source, list) else [source]
+        start_time = time.perf_counter()
+        results = [StubResult(image, self._detect(image, conf), self.names) for image in images]
+        remaining = self.delay * len(images) - (time.perf_counter() - start_time)
+        if remaining > 0:
+            time.sleep(remaining)
+        return results
+
+    def _detect(self, image, conf):
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        mask = cv2.inRange(hsv, (5, 150, 150), (35, 255, 255))
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        boxes = []
+        for contour in contours:
+            area = cv2.contourArea(contour)
+            if area < self.min_area:
+                continue
+            x, y, w, h = cv2.boundingRect(contour)
+            # 色块越饱满置信度越高（圆形约 0.89）
+            score = min(0.99, 0.5 + 0.5 * area / (w * h))
+            if score >= conf:
+                boxes.append((0, score, x, y, x + w, y + h))
+        return boxes
+
+
+class ModelManager:
+    """
+    持有当前服务中的模型，并负责后台热切换
+
+    推理线程每帧调用 acquire() 取一次模型引用，整帧推理都使用这个引用，
+    因此切换只会发生在两帧之间，不会出现一帧内新旧模型混用。
+    """
+
+    def __init__(self, device='cpu', warmup_resolution=(640, 480), conf=0.15):
+        self.device = device
+        self.warmup_resolution = warmup_resolution
+        self.conf = conf
+
+        self.model = None
+        self.model_path = None
+        self.generation = 0  # 每次成功切换 +1，用于识别帧由哪个模型处理
+
+        self._swap_lock = threading.Lock()  # 同一时间只允许一个切换任务
+        self._state_lock = threading.Lock()
+        self._swap_thread = None
+        self._pending = None  # 正在进行的切换记录
+        self._last_inference = None  # 最近完成的一帧: (generation, 完成时刻)
+        self.swap_history = deque(maxlen=10)
+
+    def _load_and_warmup(self, model_path):
+        """加载模型并用虚拟帧预热，返回 (model, 加载耗时, 预热耗时)"""
+        from ultralytics import YOLO
+
+        start_time = time.time()
+        model = YOLO(model_path)
+        load_time = time.time() - start_time
+
+        start_time = time.time()
+        width, height = self.warmup_resolution
+        dummy_frame = np.zeros((height, width, 3), dtype=np.uint8)
+        _ = model(dummy_frame, conf=self.conf, verbose=False, device=self.device)
+        warmup_time = time.time() - start_time
+        return model, load_time, warmup_time
+
+    def load(self, model_path):
+        """
+        同步加载初始模型（启动时使用），失败直接抛出异常
+
+        Returns:
+            tuple: (加载耗时, 预热耗时)
+        """
+        logging.info(f"正在加载 YOLO 模型 ({model_path})...")
+        model, load_time, warmup_time = self._load_and_warmup(model_path)
+        self.model = model
+        self.model_path = model_path
+        self.generation += 1
+        logging.info(f"✅ 模型加载完成 (加载 {load_time:.2f}s, 预热 {warmup_time:.2f}s)")
+        return load_time, warmup_time
+
+    def install(self, model, model_path):
+        """直接使用已构造的模型（如 StubModel），不加载权重文件"""
+        self.model = model
+        self.model_path = model_path
+        self.generation += 1
+        logging.info(f"✅ 使用模型 {model_path}")
+
+    def acquire(self):
+        """
+        获取当前模型引用（推理线程每帧调用一次）
+
+        Returns:
+            tuple: (model, generation)
+        """
+        return self.model, self.generation
+
+    def is_swapping(self):
+        return self._swap_thread is not None and self._swap_thread.is_alive()
+
+    def swap_async(self, model_path):
+        """
+        在后台加载并预热新模型，成功后原子替换
+
+        Returns:
+            bool: 是否已启动切换任务（已有切换在进行时返回 False）
+        """
+        if not self._swap_lock.acquire(blocking=False):
+            return False
+
+        record = {
+            'from': self.model_path,
+            'to': model_path,
+            'status': 'loading',
+            'requested_at': time.time(),
+            'load_time': None,
+            'warmup_time': None,
+            'first_frame_latency_ms': None,
+            'swap_gap_ms': None,  # 旧模型完成最后一帧到新模型完成第一帧的间隔
+            'dropped_frames': 0,
+            'error': None,
+        }
+        with self._state_lock:
+            # 上一次切换还没等到首帧（例如摄像头断开），直接归档
+            if self._pending is not None:
+                self.swap_history.append(self._pending)
+            self._pending = record
+
+        def swap_worker():
+            try:
+                logging.info(f"🔄 开始热切换模型: {self.model_path} -> {model_path}")
+                try:
+                    model, load_time, warmup_time = self._load_and_warmup(model_path)
+                except Exception as e:
+                    # 回滚：旧模型从未被替换，继续服务
+                    logging.error(f"❌ 新模型加载/预热失败，保留旧模型: {e}", exc_info=True)
+                    with self._state_lock:
+                        record['status'] = 'rolled_back'
+                        record['error'] = str(e)
+                        self.swap_history.append(record)
+                        self._pending = None
+                    return
+
+                with self._state_lock:
+                    self.model = model
+                    self.model_path = model_path
+                    self.generation += 1
+                    record['generation'] = self.generation
+                    record['swapped_at'] = time.time()
+                    record['load_time'] = round(load_time, 3)
+                    record['warmup_time'] = round(warmup_time, 3)
+                    record['status'] = 'swapped'
+                logging.info(f"✅ 模型已切换 (加载 {load_time:.2f}s, 预热 {warmup_time:.2f}s)")
+
+                # 旧模型的显存在引用释放后回收
+                if self.device == 'cuda':
+                    try:
+                        import torch
+                        torch.cuda.empty_cache()
+                    except Exception:
+                        pass
+            finally:
+                self._swap_lock.release()
+
+        self._swap_thread = threading.Thread(target=swap_worker, daemon=True)
+        self._swap_thread.start()
+        return True
+
+    def report_inference(self, generation):
+        """推理线程完成一帧后回调，用于统计切换后首帧延迟和切换造成的推理间隔"""
+        now = time.time()
+        record = self._pending
+        if record is not None and record.get('generation') == generation:
+            with self._state_lock:
+                if self._pending is record:
+                    record['first_frame_latency_ms'] = round((now - record['swapped_at']) * 1000, 1)
+                    last = self._last_inference
+                    if last is not None and last[0] != generation:
+                        record['swap_gap_ms'] = round((now - last[1]) * 1000, 1)
+                    self.swap_history.append(record)
+                    self._pending = None
+        self._last_inference = (generation, now)
+
+    def note_dropped_frame(self):
+        """推理队列满而丢帧时回调，切换期间的丢帧计入当前切换记录"""
+        record = self._pending
+        if record is not None:
+            record['dropped_frames'] += 1
+
+    def status(self):
+        """返回当前模型和切换状态"""
+        with self._state_lock:
+            return {
+                'model_path': self.model_path,
+                'generation': self.generation,
+                'device': self.device,
+                'swapping': self.is_swapping(),
+                'pending': dict(self._pending) if self._pending else None,
+                'history': [dict(r) for r in self.swap_history],
+            }
@@ -0,0 +1,348 @@
+"""
+设备预设评估 - 用标注过的火焰/烟雾录像回放各设备预设，量化每个预设在检测延迟和召回率上的取舍
+按预设的分辨率、目标帧率、帧跳跃、置信度和模型大小模拟实时流水线：
+
+- 采集：按 target_fps 从录像中取帧并缩放到预设分辨率
+- 推理：每 frame_skip 帧送一帧进推理队列（容量 2，满了丢弃新帧，与 app_edge 相同），单线程推理；
+  推理在本机实际运行，耗时乘以设备减速系数（--slowdown）模拟目标设备的速度，队列据此排队和丢帧
+- 告警：按 alarm.py 的确认规则（CONFIRM_WINDOW 秒内至少 CONFIRM_FRAMES 次检出）计算告警时刻
+
+标注文件（JSON）列出录像及其中火情的起止时间，没有火情的录像用于统计误报：
+
+    {"clips": [
+        {"file": "clips/fire_01.mp4", "events": [{"start": 12.0, "end": 95.0, "class": "fire"}]},
+        {"file": "clips/night_empty.mp4", "events": []}
+    ]}
+
+每个预设报告：首次检出延迟、告警延迟、事件召回率、逐帧精确率/召回率、每小时误报次数、
+每小时录像消耗的 CPU 秒数（模拟目标设备）。
+
+用法:
+    python3 preset_eval.py labels.json
+    python3 preset_eval.py labels.json --presets raspberry_pi,rockchip --slowdown raspberry_pi=12
+    python3 preset_eval.py labels.json --model stub          # 只验证流程，不需要模型文件
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import time
+from collections import deque
+
+import cv2
+
+from alarm import CLEAR_AFTER, CONFIRM_FRAMES, CONFIRM_WINDOW
+from device_config import DEVICE_PRESETS, MODEL_FILES, get_model_path, resolve_model_file
+from model_manager import DANGER_CLASSES, StubModel, extract_detections
+
+# 推理队列容量（同 EdgeCamera.frame_queue）
+INFERENCE_QUEUE_SIZE = 2
+# 各预设目标设备相对本机 CPU 的推理减速系数（粗略估计，建议用目标设备 calibration 实测的推理速率换算后覆盖；
+# 未列出的预设按 1.0，即与本机相同）
+DEVICE_SLOWDOWN = {
+    'raspberry_pi': 10.0,
+    'hisilicon': 6.0,
+    'rockchip': 4.0,
+    'jetson_nano': 2.0,
+    'jetson_xavier': 0.5,
+    'auto': 1.0,
+}
+
+
+def load_labels(path):
+    """
+    读取标注文件，录像路径相对于标注文件所在目录
+
+    Returns:
+        list: [{"file": 路径, "events": [{"start", "end", "class"}, ...]}, ...]
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    clips = data['clips'] if isinstance(data, dict) else data
+    base = os.path.dirname(os.path.abspath(path))
+    return [{
+        'file': os.path.join(base, clip['file']),
+        'events': sorted(clip.get('events', []), key=lambda event: event['start']),
+    } for clip in clips]
+
+
+def parse_slowdown(text):
+    """解析减速系数：'raspberry_pi=12,rockchip=3'，单独一个数字表示所有预设"""
+    slowdown = dict(DEVICE_SLOWDOWN)
+    if not text:
+        return slowdown
+    for item in text.split(','):
+        name, sep, value = item.partition('=')
+        if not sep:
+            return {preset: float(name) for preset in DEVICE_PRESETS}
+        if name.strip() not in DEVICE_PRESETS:
+            raise ValueError(f"未知的设备预设: {name}")
+        slowdown[name.strip()] = float(value)
+    return slowdown
+
+
+def _in_event(events, t):
+    return any(event['start'] <= t <= event['end'] for event in events)
+
+
+def simulate_clip(path, config, model, slowdown=1.0, device='cpu'):
+    """
+    按预设模拟一段录像的实时处理
+
+    时间均为录像内的秒数；推理完成时刻 = 开始时刻 + 本机耗时 × slowdown
+
+    Returns:
+        dict: duration（录像时长）、captured、skipped、dropped、cpu_seconds、
+              results=[(采集时刻, 完成时刻, 检出的火情类别集合), ...]
+    """
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise RuntimeError(f"无法打开录像: {path}")
+    native_fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    width, height = config['resolution']
+    period = 1.0 / config['target_fps']
+
+    queued_starts = deque()  # 已入队帧的开始推理时刻（晚于当前时刻的仍在队列中）
+    busy_until = 0.0
+    next_capture = 0.0
+    frame_counter = 0
+    stats = {'captured': 0, 'skipped': 0, 'dropped': 0, 'cpu_seconds': 0.0, 'results': []}
+    index = -1
+    try:
+        while cap.grab():
+            index += 1
+            t = index / native_fps
+            if t + 1e-9 < next_capture:
+                continue
+            next_capture += period
+            ok, frame = cap.retrieve()
+            if not ok:
+                continue
+            stats['captured'] += 1
+            cpu_start = time.process_time()
+            if frame.shape[1] != width or frame.shape[0] != height:
+                frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+            should_infer = frame_counter % config['frame_skip'] == 0
+            frame_counter += 1
+            if not should_infer:
+                stats['skipped'] += 1
+                stats['cpu_seconds'] += (time.process_time() - cpu_start) * slowdown
+                continue
+            while queued_starts and queued_starts[0] <= t:
+                queued_starts.popleft()
+            if len(queued_starts) >= INFERENCE_QUEUE_SIZE:
+                stats['dropped'] += 1
+                stats['cpu_seconds'] += (time.process_time() - cpu_start) * slowdown
+                continue
+            wall_start = time.perf_counter()
+            result = model(frame, conf=config['detection_conf'], verbose=False, device=device)
+            elapsed = (time.perf_counter() - wall_start) * slowdown
+            stats['cpu_seconds'] += (time.process_time() - cpu_start) * slowdown
+            start = max(t, busy_until)
+            busy_until = start + elapsed
+            queued_starts.append(start)
+            classes = {det['class'] for det in extract_detections(result[0]) if det['class'] in DANGER_CLASSES}
+            stats['results'].append((t, busy_until, classes))
+    finally:
+        cap.release()
+    stats['duration'] = (index + 1) / native_fps
+    return stats
+
+
+def alarm_times(results, confirm_window=CONFIRM_WINDOW, confirm_frames=CONFIRM_FRAMES, clear_after=CLEAR_AFTER):
+    """
+    按 alarm.py 的确认规则计算告警
+
+    Returns:
+        list: [(触发告警的检出采集时刻, 告警时刻（推理完成时刻）, 类别), ...]
+    """
+    candidates = {}
+    last_seen = {}
+    alarms = []
+    for capture_t, done_t, classes in sorted(results, key=lambda item: item[1]):
+        for cls in classes:
+            if cls in last_seen and capture_t - last_seen[cls] <= clear_after and cls not in candidates:
+                last_seen[cls] = capture_t  # 告警持续中
+                continue
+            window = candidates.setdefault(cls, deque())
+            while window and window[0] < capture_t - confirm_window:
+                window.popleft()
+            window.append(capture_t)
+            if len(window) >= confirm_frames:
+                alarms.append((capture_t, done_t, cls))
+                del candidates[cls]
+                last_seen[cls] = capture_t
+    return alarms
+
+
+def score_preset(clip_runs):
+    """
+    汇总一个预设在所有录像上的结果
+
+    Args:
+        clip_runs: [(标注 events, simulate_clip 结果), ...]
+    """
+    tp = fp = fn = 0
+    events_total = events_detected = events_alarmed = 0
+    detect_delays, alarm_delays = [], []
+    false_alarms = 0
+    totals = {'duration': 0.0, 'captured': 0, 'skipped': 0, 'dropped': 0, 'cpu_seconds': 0.0, 'inferences': 0}
+    for events, run in clip_runs:
+        for key in ('duration', 'captured', 'skipped', 'dropped', 'cpu_seconds'):
+            totals[key] += run[key]
+        totals['inferences'] += len(run['results'])
+        for capture_t, _, classes in run['results']:
+            truth = _in_event(events, capture_t)
+            if classes and truth:
+                tp += 1
+            elif classes:
+                fp += 1
+            elif truth:
+                fn += 1
+        alarms = alarm_times(run['results'])
+        false_alarms += sum(1 for capture_t, _, _ in alarms if not _in_event(events, capture_t))
+        for event in events:
+            events_total += 1
+            hits = [done_t for capture_t, done_t, classes in run['results']
+                    if classes and event['start'] <= capture_t <= event['end']]
+            if hits:
+                events_detected += 1
+                detect_delays.append(min(hits) - event['start'])
+            raised = [done_t for capture_t, done_t, _ in alarms if event['start'] <= capture_t <= event['end']]
+            if raised:
+                events_alarmed += 1
+                alarm_delays.append(min(raised) - event['start'])
+
+    hours = totals['duration'] / 3600 if totals['duration'] else 0.0
+
+    def median(values):
+        ordered = sorted(values)
+        return round(ordered[len(ordered) // 2], 2) if ordered else None
+
+    return {
+        'video_seconds': round(totals['duration'], 1),
+        'events': events_total,
+        'event_recall': round(events_detected / events_total, 3) if events_total else None,
+        'alarm_recall': round(events_alarmed / events_total, 3) if events_total else None,
+        'ttfd_median_s': median(detect_delays),
+        'ttfd_max_s': round(max(detect_delays), 2) if detect_delays else None,
+        'alarm_delay_median_s': median(alarm_delays),
+        'alarm_delay_max_s': round(max(alarm_delays), 2) if alarm_delays else None,
+        'frame_precision': round(tp / (tp + fp), 3) if tp + fp else None,
+        'frame_recall': round(tp / (tp + fn), 3) if tp + fn else None,
+        'false_alarms_per_hour': round(false_alarms / hours, 2) if hours else None,
+        'inferences': totals['inferences'],
+        'dropped_by_queue': totals['dropped'],
+        'cpu_seconds_per_hour': round(totals['cpu_seconds'] / hours, 1) if hours else None,
+    }
+
+
+def evaluate(clips, presets, model_override=None, slowdown=None, device='cpu'):
+    """
+    逐个预设回放所有录像
+
+    Returns:
+        dict: {预设: score_preset 结果 + 预设参数}
+    """
+    slowdown = slowdown or DEVICE_SLOWDOWN
+    models = {}
+    report = {}
+    for name in presets:
+        config = DEVICE_PRESETS[name]
+        model_key = model_override or config['model_size']
+        if model_key not in models:
+            models[model_key] = _load_model(model_key)
+        model = models[model_key]
+        if model is None:
+            logging.warning(f"跳过预设 {name}: 找不到模型 {model_key}")
+            continue
+        factor = slowdown.get(name, 1.0)
+        logging.info(
+            f"评估预设 {name}: {config['resolution'][0]}x{config['resolution'][1]} @ {config['target_fps']} FPS, "
+            f"每 {config['frame_skip']} 帧推理, 置信度 {config['detection_conf']}, 模型 {model_key}, 减速 {factor}x"
+        )
+        clip_runs = []
+        for clip in clips:
+            run = simulate_clip(clip['file'], config, model, factor, device)
+            clip_runs.append((clip['events'], run))
+            logging.info(
+                f"  {os.path.basename(clip['file'])}: 推理 {len(run['results'])} 帧, 队列丢弃 {run['dropped']} 帧"
+            )
+        report[name] = {
+            'resolution': list(config['resolution']),
+            'target_fps': config['target_fps'],
+            'frame_skip': config['frame_skip'],
+            'detection_conf': config['detection_conf'],
+            'model': model_key,
+            'slowdown': factor,
+            **score_preset(clip_runs),
+        }
+    return report
+
+
+def _load_model(model_key):
+    """按模型大小或文件名加载模型（'stub' 为桩模型），找不到文件返回 None"""
+    if model_key == 'stub':
+        return StubModel()
+    from ultralytics import YOLO
+    try:
+        model_path = get_model_path(model_key) if model_key in MODEL_FILES else resolve_model_file(model_key)
+    except FileNotFoundError:
+        return None
+    if not os.path.exists(model_path):
+        return None
+    return YOLO(model_path)
+
+
+def _fmt(value, suffix=''):
+    return '-' if value is None else f'{value}{suffix}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='用标注录像评估各设备预设的检测延迟、召回率和 CPU 开销')
+    parser.add_argument('labels', help='标注文件（JSON）')
+    parser.add_argument('--presets', default=','.join(DEVICE_PRESETS), help='要评估的预设（逗号分隔）')
+    parser.add_argument('--model', default=None,
+                        help=f"所有预设统一使用的模型（{'/'.join(MODEL_FILES)}、模型文件名或 stub），默认按预设的 model_size")
+    parser.add_argument('--slowdown', default=None,
+                        help='目标设备相对本机的推理减速系数，如 raspberry_pi=12,rockchip=3；单个数字表示全部预设')
+    parser.add_argument('--device', default='cpu', help='本机推理设备: cpu / cuda')
+    parser.add_argument('--output', default='preset_eval.json', help='报告文件（JSON）')
+    parser.add_argument('--csv', default=None, help='同时输出 CSV（每个预设一行）')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+    presets = [name.strip() for name in args.presets.split(',') if name.strip()]
+    unknown = set(presets) - set(DEVICE_PRESETS)
+    if unknown:
+        parser.error(f"未知的设备预设: {', '.join(sorted(unknown))}")
+    try:
+        slowdown = parse_slowdown(args.slowdown)
+    except ValueError as e:
+        parser.error(str(e))
+
+    clips = load_labels(args.labels)
+    report = evaluate(clips, presets, args.model, slowdown, args.device)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'labels': args.labels, 'presets': report}, f, ensure_ascii=False, indent=2)
+    if args.csv and report:
+        with open(args.csv, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=['preset', *next(iter(report.values()))])
+            writer.writeheader()
+            for name, row in report.items():
+                writer.writerow({'preset': name, **row, 'resolution': 'x'.join(map(str, row['resolution']))})
+
+    logging.info(f"✅ 评估完成，报告已写入 {args.output}")
+    for name, row in report.items():
+        logging.info(
+            f"  {name:<14} 首次检出 {_fmt(row['ttfd_median_s'], 's')}（最长 {_fmt(row['ttfd_max_s'], 's')}）"
+            f"  告警 {_fmt(row['alarm_delay_median_s'], 's')}  事件召回 {_fmt(row['event_recall'])}"
+            f"  逐帧 P/R {_fmt(row['frame_precision'])}/{_fmt(row['frame_recall'])}"
+            f"  误报 {_fmt(row['false_alarms_per_hour'], '/h')}  CPU {_fmt(row['cpu_seconds_per_hour'], 's/h')}"
+        )
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
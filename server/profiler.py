@@ -0,0 +1,292 @@
+"""
+现场诊断 - 设备运行中按需采样 CPU 调用栈和内存分配，不需要重启进程或附加外部工具
+
+- CPU：采样线程按固定间隔读取 sys._current_frames()，统计所有线程的 Python 调用栈，
+  输出折叠栈（collapsed stack，每行 "线程;函数;...;函数 权重"），可直接交给 flamegraph.pl
+  或 speedscope 生成火焰图。mode=cpu（Linux 上的默认方式）按各线程两次采样之间消耗的 CPU 时间
+  （微秒）加权，阻塞在等待中的线程不计入；mode=wall 每次采样计 1，看各线程时间花在哪里。
+  两次采样之间消耗的 CPU 记在后一次采样看到的调用栈上，短于采样间隔、随后进入等待的工作
+  会出现在 wait 等函数下，提高采样频率（hz）可减小这种偏差。
+- 内存：临时开启 tracemalloc，比较开始和结束时的快照，列出这段时间内增长最多的分配位置；
+  结束后立即关闭（开启期间每次分配都有额外开销）。
+
+两者都只在调用期间运行，时长有上限，同一时间只允许一个诊断任务；不调用时没有任何开销。
+"""
+import collections
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# 单次诊断的最长时长（秒）
+MAX_DURATION = 60.0
+DEFAULT_DURATION = 10.0
+# CPU 采样间隔（秒），默认 100Hz
+DEFAULT_INTERVAL = 0.01
+MIN_INTERVAL = 0.001
+# 内存诊断默认列出的分配位置数
+DEFAULT_TOP = 30
+# group=traceback 时每个分配记录的调用栈深度
+TRACE_FRAMES = 10
+MEMORY_GROUPS = ('lineno', 'filename', 'traceback')
+CPU_MODES = ('cpu', 'wall')
+# 能否按内核线程号读取单个线程的 CPU 时间（Linux）
+THREAD_CPU_CLOCK = sys.platform.startswith('linux') and hasattr(time, 'clock_gettime')
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+_busy = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    """已有诊断任务在运行"""
+
+
+@contextmanager
+def _exclusive():
+    if not _busy.acquire(blocking=False):
+        raise ProfilerBusy("已有诊断任务在运行，请稍后再试")
+    try:
+        yield
+    finally:
+        _busy.release()
+
+
+def parse_duration(value, default=DEFAULT_DURATION):
+    """
+    解析诊断时长（秒）
+
+    Raises:
+        ValueError: 不是正数或超过 MAX_DURATION
+    """
+    if value in (None, ''):
+        return default
+    seconds = float(value)
+    if not 0 < seconds <= MAX_DURATION:
+        raise ValueError(f"时长应在 0 到 {MAX_DURATION:.0f} 秒之间")
+    return seconds
+
+
+def _short_path(filename):
+    """调用栈中显示的文件名：本项目为相对路径，第三方库从包名开始，其余只保留文件名"""
+    if filename.startswith(_ROOT + os.sep):
+        return filename[len(_ROOT) + 1:]
+    marker = 'site-packages' + os.sep
+    index = filename.rfind(marker)
+    if index >= 0:
+        return filename[index + len(marker):]
+    return os.path.basename(filename)
+
+
+class CpuProfile:
+    """CPU 采样结果：stacks 为 {折叠栈: 权重}，mode=cpu 时权重为微秒，wall 时为采样次数"""
+
+    def __init__(self, mode, interval):
+        self.mode = mode
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.duration = 0.0
+        self.overhead = 0.0  # 采样线程自身消耗的 CPU 时间（秒）
+
+    def collapsed(self):
+        """折叠栈文本（flamegraph.pl / speedscope 的输入格式），按权重从大到小"""
+        return ''.join(f'{stack} {weight}\n' for stack, weight in self.stacks.most_common())
+
+    def top(self, limit=20):
+        """
+        按函数汇总
+
+        Returns:
+            list: [{function, self, total}]，self 为位于栈顶的权重，total 为出现在栈中的权重，按 self 排序
+        """
+        own = collections.Counter()
+        total = collections.Counter()
+        for stack, weight in self.stacks.items():
+            frames = stack.split(';')[1:]
+            if not frames:
+                continue
+            own[frames[-1]] += weight
+            for name in set(frames):
+                total[name] += weight
+        return [{'function': name, 'self': weight, 'total': total[name]} for name, weight in own.most_common(limit)]
+
+    def to_dict(self, limit=20):
+        return {
+            'mode': self.mode,
+            'unit': 'us' if self.mode == 'cpu' else 'samples',
+            'duration': round(self.duration, 3),
+            'interval': self.interval,
+            'samples': self.samples,
+            'sampler_cpu_seconds': round(self.overhead, 4),
+            'total': sum(self.stacks.values()),
+            'top': self.top(limit),
+        }
+
+
+def _thread_cpu(native_id):
+    """
+    线程已消耗的 CPU 时间（秒）；线程已退出时返回 None
+
+    时钟号与 pthread_getcpuclockid() 返回的相同，但直接由内核线程号构造：采样到的线程随时可能退出
+    （如每个请求一个线程的 HTTP 服务），按线程号读取只会失败，不会访问已释放的线程结构。
+    """
+    try:
+        return time.clock_gettime(((~native_id) << 3) | 6)
+    except OSError:
+        return None
+
+
+def _collapse(frame, labels):
+    """把一个线程的调用栈折叠为 "外层;...;内层"（labels 缓存每个代码对象的显示名）"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        label = labels.get(code)
+        if label is None:
+            label = labels[code] = f'{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})'
+        names.append(label)
+        frame = frame.f_back
+    names.reverse()
+    return ';'.join(names)
+
+
+def profile_cpu(duration=DEFAULT_DURATION, interval=DEFAULT_INTERVAL, mode=None):
+    """
+    采样所有线程的调用栈 duration 秒
+
+    Args:
+        interval: 采样间隔（秒）
+        mode: 'cpu' 按线程 CPU 时间加权（默认，平台不支持时为 'wall'），'wall' 按采样次数
+
+    Returns:
+        CpuProfile
+
+    Raises:
+        ValueError: 参数无效
+        ProfilerBusy: 已有诊断任务在运行
+    """
+    mode = mode or ('cpu' if THREAD_CPU_CLOCK else 'wall')
+    if mode not in CPU_MODES:
+        raise ValueError(f"未知的采样方式: {mode}")
+    if mode == 'cpu' and not THREAD_CPU_CLOCK:
+        raise ValueError("本平台无法读取线程 CPU 时间，请使用 mode=wall")
+    interval = max(MIN_INTERVAL, float(interval))
+    profile = CpuProfile(mode, interval)
+    own = threading.get_ident()
+    labels = {}
+    names = {}
+    native_ids = {}
+    last_cpu = {}
+
+    with _exclusive():
+        own_start = time.thread_time()
+        start = time.monotonic()
+        deadline = start + duration
+        next_at = start
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            frames = sys._current_frames()
+            if any(ident not in names for ident in frames):
+                for thread in threading.enumerate():
+                    names[thread.ident] = thread.name.replace(';', ':')
+                    native_ids[thread.ident] = thread.native_id
+            for ident, frame in frames.items():
+                if ident == own:
+                    continue
+                if mode == 'cpu':
+                    native_id = native_ids.get(ident)
+                    used = _thread_cpu(native_id) if native_id is not None else None
+                    previous = last_cpu.get(ident)
+                    last_cpu[ident] = used
+                    # 首次见到的线程只记录起点；两次采样之间没有消耗 CPU 的线程不计入
+                    if used is None or previous is None:
+                        continue
+                    weight = int((used - previous) * 1e6)
+                    if weight <= 0:
+                        continue
+                else:
+                    weight = 1
+                stack = _collapse(frame, labels)
+                profile.stacks[f'{names.get(ident, ident)};{stack}'] += weight
+            # 不持有其他线程的帧对象，避免延长其中局部变量的生命周期
+            frames = frame = None
+            profile.samples += 1
+            next_at += interval
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_at = time.monotonic()
+        profile.duration = time.monotonic() - start
+        profile.overhead = time.thread_time() - own_start
+    return profile
+
+
+def profile_memory(duration=DEFAULT_DURATION, top=DEFAULT_TOP, group='lineno'):
+    """
+    统计 duration 秒内新增且仍未释放的内存分配
+
+    Args:
+        top: 列出的分配位置数
+        group: 'lineno' 按代码行，'filename' 按文件，'traceback' 按调用栈（深度 TRACE_FRAMES）
+
+    Returns:
+        dict: duration, traced_kb / peak_kb（tracemalloc 统计的当前和峰值）, growth_kb（总增长）,
+        top=[{location, size_diff_kb, size_kb, count_diff, count, traceback?}]
+
+    Raises:
+        ValueError: 参数无效
+        ProfilerBusy: 已有诊断任务在运行
+    """
+    if group not in MEMORY_GROUPS:
+        raise ValueError(f"未知的分组方式: {group}")
+    filters = (
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        tracemalloc.Filter(False, '<unknown>'),
+    )
+
+    with _exclusive():
+        # 进程启动时已开启（PYTHONTRACEMALLOC）则沿用，结束后不关闭
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start(TRACE_FRAMES if group == 'traceback' else 1)
+        try:
+            start = time.monotonic()
+            before = tracemalloc.take_snapshot().filter_traces(filters)
+            time.sleep(duration)
+            after = tracemalloc.take_snapshot().filter_traces(filters)
+            traced, peak = tracemalloc.get_traced_memory()
+            elapsed = time.monotonic() - start
+        finally:
+            if started:
+                tracemalloc.stop()
+
+    diff = after.compare_to(before, group)
+    entries = []
+    for stat in diff[:max(1, int(top))]:
+        frame = stat.traceback[-1]  # 最近一层调用
+        location = _short_path(frame.filename) if group == 'filename' else f'{_short_path(frame.filename)}:{frame.lineno}'
+        entry = {
+            'location': location,
+            'size_diff_kb': round(stat.size_diff / 1024, 1),
+            'size_kb': round(stat.size / 1024, 1),
+            'count_diff': stat.count_diff,
+            'count': stat.count,
+        }
+        if group == 'traceback':
+            entry['traceback'] = [f'{_short_path(item.filename)}:{item.lineno}' for item in stat.traceback]
+        entries.append(entry)
+    return {
+        'duration': round(elapsed, 3),
+        'group': group,
+        'traced_kb': round(traced / 1024, 1),
+        'peak_kb': round(peak / 1024, 1),
+        'growth_kb': round(sum(stat.size_diff for stat in diff) / 1024, 1),
+        'top': entries,
+    }
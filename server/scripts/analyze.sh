@@ -0,0 +1,5 @@
+#!/bin/bash
+# 离线批量分析脚本：对录像文件/目录做火情检测，结果写入 JSONL 或 Parquet
+
+cd "$(dirname "$0")/.." || exit 1
+python3 analyze.py "$@"
@@ -0,0 +1,5 @@
+#!/bin/bash
+# 流水线基准测试脚本：逐段测量采集/推理/绘制/编码耗时，退化超过基线容差时返回非零
+
+cd "$(dirname "$0")/.." || exit 1
+python3 benchmark.py "$@"
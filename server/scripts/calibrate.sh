@@ -0,0 +1,6 @@
+#!/bin/bash
+# 设备校准脚本：实测候选配置并缓存最佳配置，之后 start_auto.sh 启动时直接加载
+
+cd "$(dirname "$0")/.." || exit 1
+echo "开始设备校准（需要摄像头和模型文件）..."
+python3 app_edge.py calibrate "$@"
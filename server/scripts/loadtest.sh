@@ -0,0 +1,5 @@
+#!/bin/bash
+# 并发观看压力测试脚本：逐级增加视频流客户端，输出报告和饱和曲线
+
+cd "$(dirname "$0")/.." || exit 1
+python3 loadtest.py "$@"
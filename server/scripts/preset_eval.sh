@@ -0,0 +1,5 @@
+#!/bin/bash
+# 设备预设评估脚本：用标注录像比较各预设的检测延迟、召回率和 CPU 开销
+
+cd "$(dirname "$0")/.." || exit 1
+python3 preset_eval.py "$@"
@@ -0,0 +1,6 @@
+#!/bin/bash
+# 异步流媒体服务启动脚本（大量并发视频流客户端时使用，接口与 app_edge.py 相同）
+
+cd "$(dirname "$0")/.." || exit 1
+echo "启动异步流媒体服务..."
+python3 app_async.py "$@"
@@ -0,0 +1,6 @@
+#!/bin/bash
+# 集群汇聚服务启动脚本（运维中心使用，节点列表见 FLEET_NODES）
+
+cd "$(dirname "$0")/.." || exit 1
+echo "启动集群汇聚服务..."
+python3 fleet.py "$@"
@@ -0,0 +1,575 @@
+"""
+事件暂存转发（store-and-forward）- 上行链路不稳定（4G）时不丢火情事件
+推理线程只把事件放入内存队列，写入线程按批追加到磁盘分段文件；
+上传线程从提交位置读取，压缩成批发往上级服务器，成功后才推进提交位置，断网、重启都不丢数据。
+
+目录结构:
+- <首条序号>.seg：分段文件，每条记录为 头部(长度 uint32, CRC32 uint32) + UTF-8 JSON
+- commit：已确认上传的位置 {"segment": 段首条序号, "offset": 字节偏移, "seq": 下一条待上传序号}
+
+每条记录带全局唯一 id（节点名:序号），重传同一批时接收端按 id 去重。
+段完全上传后删除；总大小超过配额时从最旧的段开始丢弃并计数。
+"""
+import argparse
+import gzip
+import http.client
+import json
+import logging
+import os
+import random
+import socket
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import SimpleQueue, Empty
+from urllib.parse import urlsplit
+
+SPOOL_DIR = os.getenv('SPOOL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spool'))
+# 上级接收地址（未设置时不启用暂存转发）
+SPOOL_UPLOAD_URL = os.getenv('SPOOL_UPLOAD_URL', '')
+# 节点名称（记录 id 前缀，集群内唯一）
+SPOOL_NODE_ID = os.getenv('SPOOL_NODE_ID', socket.gethostname())
+# 单个分段文件大小上限（字节）
+SEGMENT_BYTES = 1024 * 1024
+# 磁盘配额（MB），超出后丢弃最旧的未上传段
+SPOOL_QUOTA_MB = float(os.getenv('SPOOL_QUOTA_MB', '256'))
+# 上传限速（KB/s，按压缩后字节数计），链路恢复后积压数据不会占满带宽
+SPOOL_RATE_KBPS = float(os.getenv('SPOOL_RATE_KBPS', '32'))
+# 每批最多上传的记录数 / 未压缩字节数
+UPLOAD_BATCH_RECORDS = 500
+UPLOAD_BATCH_BYTES = 512 * 1024
+# 写入线程攒批时间（秒）
+FLUSH_INTERVAL = 0.5
+# 上传失败后的重试退避（秒）
+MIN_RETRY_DELAY = 1.0
+MAX_RETRY_DELAY = 60.0
+REQUEST_TIMEOUT = 15.0
+# 停止时等待写完队列的最长时间（秒）
+STOP_TIMEOUT = 5.0
+
+RECORD_HEADER = struct.Struct('<II')  # 长度, CRC32
+SEGMENT_SUFFIX = '.seg'
+COMMIT_FILE = 'commit'
+# 放入队列表示停止写入线程
+_STOP = object()
+
+
+def read_records(path, offset=0, max_records=None, max_bytes=None):
+    """
+    从分段文件 offset 处顺序读取完整记录（末尾写了一半或校验失败的记录不返回）
+
+    Returns:
+        tuple: ([payload, ...], 读取结束位置)
+    """
+    payloads = []
+    size = 0
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while max_records is None or len(payloads) < max_records:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                break
+            length, crc = RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            if max_bytes is not None and payloads and size + length > max_bytes:
+                break
+            payloads.append(payload)
+            size += length
+            offset += RECORD_HEADER.size + length
+    return payloads, offset
+
+
+class RateLimiter:
+    """令牌桶限速（字节/秒）"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self._tokens = self.burst
+        self._last = time.monotonic()
+
+    def wait(self, amount):
+        """等待直到可以发送 amount 字节（超过桶容量的一批先欠账，之后按速率补齐）"""
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        self._tokens -= amount
+        if self._tokens < 0:
+            time.sleep(-self._tokens / self.rate)
+
+
+class EventSpool:
+    """
+    磁盘事件暂存队列：append() 非阻塞入队，写入线程落盘，上传线程按批转发
+
+    Args:
+        url: 上级接收地址（POST，gzip 压缩的 JSON: {"node": ..., "records": [...]}）
+    """
+
+    def __init__(self, directory=SPOOL_DIR, url=SPOOL_UPLOAD_URL, node=SPOOL_NODE_ID,
+                 segment_bytes=SEGMENT_BYTES, quota_mb=SPOOL_QUOTA_MB, rate_kbps=SPOOL_RATE_KBPS):
+        self.directory = directory
+        self.url = url
+        self.node = node
+        self.segment_bytes = segment_bytes
+        self.quota_bytes = int(quota_mb * 1024 * 1024)
+        self.limiter = RateLimiter(rate_kbps * 1024, burst=max(rate_kbps * 1024, UPLOAD_BATCH_BYTES))
+        self._queue = SimpleQueue()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._conn = None
+        self.uploaded = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.batches = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_upload = None
+        self.stalled = False  # 有待上传事件却读不出记录
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+
+    # --- 启动恢复 ---
+
+    def _segment_path(self, start):
+        return os.path.join(self.directory, f'{start:020d}{SEGMENT_SUFFIX}')
+
+    def _recover(self):
+        """扫描已有分段：截掉最后一段写了一半的记录，恢复下一条序号和提交位置"""
+        self._segments = sorted(
+            int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit()
+        )
+        self._next_seq = 0
+        self._write_offset = 0
+        if self._segments:
+            last = self._segments[-1]
+            path = self._segment_path(last)
+            payloads, end = read_records(path)
+            if end < os.path.getsize(path):
+                logging.warning(f"⚠️ 暂存分段 {path} 末尾有不完整记录，已截断")
+                with open(path, 'r+b') as f:
+                    f.truncate(end)
+            self._next_seq = last + len(payloads)
+            self._write_offset = end
+        # 最近一次刷盘后的位置（写入失败时回退到这里）
+        self._flushed_seq = self._next_seq
+        self._flushed_segment = self._segments[-1] if self._segments else None
+        self._flushed_offset = self._write_offset
+
+        self._commit = {'segment': self._segments[0] if self._segments else 0, 'offset': 0,
+                        'seq': self._segments[0] if self._segments else 0}
+        try:
+            with open(os.path.join(self.directory, COMMIT_FILE), 'r', encoding='utf-8') as f:
+                commit = json.load(f)
+            if commit['segment'] in self._segments or commit['seq'] == self._next_seq:
+                self._commit = commit
+        except (OSError, ValueError, KeyError):
+            pass
+        if self.pending:
+            logging.info(f"📮 暂存队列中有 {self.pending} 条待上传事件")
+
+    # --- 写入 ---
+
+    def start(self):
+        if self._threads:
+            return
+        self._threads = [threading.Thread(target=self._write_loop, name='spool-writer', daemon=True)]
+        if self.url:
+            self._threads.append(threading.Thread(target=self._upload_loop, name='spool-uploader', daemon=True))
+        for thread in self._threads:
+            thread.start()
+        logging.info(f"✅ 事件暂存转发已启动: {self.directory} -> {self.url or '（未配置上传地址）'}")
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """把队列中已有的事件写入并刷盘后停止写入线程（进程退出前调用；待上传的事件已在磁盘上，下次启动继续上传）"""
+        if not self._threads:
+            return
+        writer = self._threads[0]
+        self._queue.put(_STOP)
+        writer.join(timeout)
+        if writer.is_alive():
+            logging.warning(f"⚠️ 事件暂存未能在 {timeout:.0f} 秒内写完，剩余 {self._queue.qsize()} 条")
+
+    def append(self, record):
+        """记录一条事件（只入队，不做磁盘和网络 I/O）"""
+        self._queue.put(record)
+
+    @property
+    def pending(self):
+        return self._flushed_seq - self._commit['seq']
+
+    def _write_loop(self):
+        f = None
+        while True:
+            try:
+                batch = [self._queue.get(timeout=FLUSH_INTERVAL)]
+            except Empty:
+                continue
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while batch[-1] is not _STOP:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except Empty:
+                    break
+            stopping = batch[-1] is _STOP
+            if stopping:
+                batch.pop()
+            if batch:
+                try:
+                    f = self._write_batch(f, batch)
+                except OSError as e:
+                    self.last_error = str(e)
+                    self.dropped += len(batch)
+                    logging.error(f"写入事件暂存失败，丢弃本批 {len(batch)} 条: {e}")
+                    if f is not None:
+                        try:
+                            f.close()
+                        except OSError:
+                            pass
+                        f = None
+                    self._rollback()
+            if stopping:
+                if f is not None:
+                    f.close()
+                return
+
+    def _write_batch(self, f, batch):
+        for record in batch:
+            if f is None or self._write_offset >= self.segment_bytes:
+                f = self._rotate(f)
+            seq = self._next_seq
+            payload = json.dumps(
+                {'id': f'{self.node}:{seq}', **record}, ensure_ascii=False, separators=(',', ':')
+            ).encode('utf-8')
+            f.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            self._write_offset += RECORD_HEADER.size + len(payload)
+            self._next_seq = seq + 1
+        # 每批只刷盘一次
+        f.flush()
+        os.fsync(f.fileno())
+        self._enforce_quota()
+        with self._cond:
+            self._flushed_seq = self._next_seq
+            self._flushed_segment = self._segments[-1]
+            self._flushed_offset = self._write_offset
+            self._cond.notify_all()
+        return f
+
+    def _rollback(self):
+        """
+        写入失败（如磁盘已满）后回到上次刷盘的位置：删除之后新建的段，截掉当前段中未刷盘的部分，
+        恢复序号和写入位置。否则写了一半的记录留在段中，之后追加的记录都读不到。
+        """
+        with self._cond:
+            while self._segments and (self._flushed_segment is None or self._segments[-1] > self._flushed_segment):
+                start = self._segments.pop()
+                try:
+                    os.remove(self._segment_path(start))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logging.error(f"删除未刷盘的暂存分段失败: {e}")
+            self._next_seq = self._flushed_seq
+            self._write_offset = 0
+            if self._segments and self._segments[-1] == self._flushed_segment:
+                try:
+                    with open(self._segment_path(self._flushed_segment), 'r+b') as f:
+                        f.truncate(self._flushed_offset)
+                    self._write_offset = self._flushed_offset
+                except OSError as e:
+                    # 截断失败时改写新段，不再往带残缺记录的段后追加
+                    logging.error(f"截断暂存分段失败: {e}")
+                    self._write_offset = self.segment_bytes
+
+    def _rotate(self, f):
+        """打开当前段（重启后继续写最后一段）或在写满后新建一段"""
+        with self._cond:
+            if f is not None:
+                f.close()
+            if not self._segments or self._write_offset >= self.segment_bytes:
+                self._segments.append(self._next_seq)
+                self._write_offset = 0
+            return open(self._segment_path(self._segments[-1]), 'ab')
+
+    def _enforce_quota(self):
+        """总大小超过配额时删除最旧的段（不删除正在写入的段）"""
+        with self._cond:
+            sizes = [os.path.getsize(self._segment_path(start)) for start in self._segments]
+            total = sum(sizes)
+            while total > self.quota_bytes and len(self._segments) > 1:
+                start = self._segments.pop(0)
+                total -= sizes.pop(0)
+                next_start = self._segments[0]
+                if self._commit['seq'] < next_start:
+                    lost = next_start - max(start, self._commit['seq'])
+                    self.dropped += lost
+                    logging.warning(f"⚠️ 事件暂存超出配额，丢弃 {lost} 条未上传事件")
+                    commit = {'segment': next_start, 'offset': 0, 'seq': next_start}
+                    self._save_commit(commit)
+                    self._commit = commit
+                os.remove(self._segment_path(start))
+
+    # --- 上传 ---
+
+    def _save_commit(self, commit):
+        path = os.path.join(self.directory, COMMIT_FILE)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(commit, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    def _read_batch(self):
+        """
+        从提交位置读取一批记录
+
+        Returns:
+            tuple: ([payload, ...], 读取后的提交位置)；没有新记录时为 ([], None)
+        """
+        with self._cond:
+            commit = dict(self._commit)
+            segments = [start for start in self._segments if start >= commit['segment']]
+        for start in segments:
+            # 段首条记录的序号就是段名，跳到后续段时序号从段名开始计
+            offset, seq = (commit['offset'], commit['seq']) if start == commit['segment'] else (0, start)
+            try:
+                payloads, end = read_records(
+                    self._segment_path(start), offset, UPLOAD_BATCH_RECORDS, UPLOAD_BATCH_BYTES
+                )
+            except FileNotFoundError:
+                continue  # 刚被配额清理
+            if payloads:
+                return payloads, {'segment': start, 'offset': end, 'seq': seq + len(payloads)}
+        return [], None
+
+    def _advance(self, new_commit):
+        """
+        推进提交位置，并删除已全部上传的段
+
+        Returns:
+            bool: 提交位置写盘失败（如磁盘已满）时为 False，内存中的提交位置不变，这批稍后重传
+        """
+        with self._cond:
+            if new_commit['seq'] <= self._commit['seq']:
+                return True  # 期间整段被配额清理，提交位置已越过这批
+            try:
+                self._save_commit(new_commit)
+            except OSError as e:
+                self.last_error = f'保存提交位置失败: {e}'
+                logging.error(f"❌ {self.last_error}")
+                return False
+            self._commit = new_commit
+            while len(self._segments) > 1 and self._segments[1] <= new_commit['seq']:
+                path = self._segment_path(self._segments.pop(0))
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logging.warning(f"删除已上传的暂存分段 {path} 失败: {e}")
+        return True
+
+    def _post(self, body):
+        """发送一批数据，返回 (状态码, Retry-After 秒数或 None)；连接保持复用"""
+        parts = urlsplit(self.url)
+        if self._conn is None:
+            cls = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+            self._conn = cls(parts.hostname, parts.port, timeout=REQUEST_TIMEOUT)
+        try:
+            self._conn.request('POST', parts.path or '/', body=body, headers={
+                'Content-Type': 'application/json',
+                'Content-Encoding': 'gzip',
+            })
+            resp = self._conn.getresponse()
+            resp.read()
+        except (OSError, http.client.HTTPException):
+            self._conn.close()
+            self._conn = None
+            raise
+        retry_after = resp.getheader('Retry-After')
+        return resp.status, float(retry_after) if retry_after and retry_after.isdigit() else None
+
+    def _upload_loop(self):
+        delay = MIN_RETRY_DELAY
+        while True:
+            try:
+                delay = self._upload_once(delay)
+            except Exception as e:
+                # 读取分段等意外错误不能让上传线程退出，否则待上传事件永远留在本地
+                self.failures += 1
+                self.last_error = str(e) or type(e).__name__
+                logging.exception("上传事件出错")
+                time.sleep(delay * (0.5 + random.random()))
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+
+    def _upload_once(self, delay):
+        """
+        等待并上传一批事件
+
+        Returns:
+            float: 下一次失败时的退避时间（秒）
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self.pending > 0, timeout=5.0)
+        payloads, new_commit = self._read_batch()
+        if not payloads:
+            if self.pending > 0:
+                # 有待上传事件却读不出记录（分段损坏或被外部删除）：退避后重试，不空转
+                self.stalled = True
+                self.last_error = f'{self.pending} 条待上传事件无法读取'
+                time.sleep(delay * (0.5 + random.random()))
+                return min(delay * 2, MAX_RETRY_DELAY)
+            return delay
+        self.stalled = False
+        body = gzip.compress(
+            b'{"node":' + json.dumps(self.node).encode('utf-8') + b',"records":[' + b','.join(payloads) + b']}'
+        )
+        self.limiter.wait(len(body))
+        try:
+            status, retry_after = self._post(body)
+        except (OSError, http.client.HTTPException) as e:
+            status, retry_after = None, None
+            self.last_error = str(e) or type(e).__name__
+
+        # 提交位置写盘失败时按上传失败退避重试（重传的记录由接收端按 id 去重）
+        if status is not None and 200 <= status < 300:
+            if self._advance(new_commit):
+                self.uploaded += len(payloads)
+                self.batches += 1
+                self.last_upload = time.time()
+                return MIN_RETRY_DELAY
+        elif status is not None and 400 <= status < 500 and status not in (408, 429):
+            # 接收端拒收这批数据，重试也不会成功；跳过以免阻塞后续事件
+            logging.error(f"❌ 上传事件被拒绝 (HTTP {status})，丢弃 {len(payloads)} 条")
+            if self._advance(new_commit):
+                self.rejected += len(payloads)
+                return delay
+        elif status is not None:
+            self.last_error = f'HTTP {status}'
+
+        self.failures += 1
+        # 指数退避加随机抖动，避免多个节点在链路恢复时同时重传
+        wait = retry_after if retry_after is not None else delay * (0.5 + random.random())
+        logging.debug(f"上传事件失败: {self.last_error}，{wait:.1f} 秒后重试")
+        time.sleep(wait)
+        return min(delay * 2, MAX_RETRY_DELAY)
+
+    def status(self):
+        with self._cond:
+            segments = len(self._segments)
+        return {
+            'directory': self.directory,
+            'url': self.url or None,
+            'queued': self._queue.qsize(),
+            'pending': self.pending,
+            'stalled': self.stalled,
+            'segments': segments,
+            'uploaded': self.uploaded,
+            'batches': self.batches,
+            'failures': self.failures,
+            'dropped': self.dropped,
+            'rejected': self.rejected,
+            'last_upload': self.last_upload,
+            'last_error': self.last_error,
+        }
+
+
+# --- 本地接收端（代替上级服务器，开发和联调用）---
+
+class _ReceiverHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        if server.fail_rate and random.random() < server.fail_rate:
+            self.send_response(503)
+            self.send_header('Retry-After', '1')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        try:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if self.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            batch = json.loads(body)
+            records = batch['records']
+        except (OSError, ValueError, KeyError):
+            self.send_response(400)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        accepted = duplicates = 0
+        with server.lock:
+            for record in records:
+                if record.get('id') in server.seen:
+                    duplicates += 1
+                    continue
+                server.seen.add(record.get('id'))
+                accepted += 1
+            server.accepted += accepted
+            server.duplicates += duplicates
+        logging.info(f"📥 收到 {batch.get('node')} 的 {len(records)} 条事件（新 {accepted}，重复 {duplicates}）")
+        self._send_json({'accepted': accepted, 'duplicates': duplicates})
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            self._send_json({'accepted': server.accepted, 'duplicates': server.duplicates})
+
+    def _send_json(self, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SpoolReceiver(ThreadingHTTPServer):
+    """
+    本地事件接收端：按 id 去重并计数
+
+    Args:
+        fail_rate: 随机返回 503 的比例（模拟链路不稳定）
+    """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=5300, fail_rate=0.0):
+        self.fail_rate = fail_rate
+        self.seen = set()
+        self.accepted = 0
+        self.duplicates = 0
+        self.lock = threading.Lock()
+        super().__init__((host, port), _ReceiverHandler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='本地事件接收端（代替上级服务器）')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=5300, help='监听端口')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='随机返回 503 的比例（0-1）')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+    server = SpoolReceiver(args.host, args.port, args.fail_rate)
+    logging.info(f"📮 事件接收端已启动: http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
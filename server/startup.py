@@ -0,0 +1,108 @@
+"""
+启动阶段管理
+HTTP 服务先启动监听，模型加载/预热与摄像头打开在后台线程并行进行；
+记录每个启动阶段的耗时，供 /api/health 报告存活(liveness)与就绪(readiness)状态。
+"""
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+# 模块导入时间近似为进程启动时间（各入口脚本最先导入本模块）
+PROCESS_START = time.time()
+
+
+class StartupTracker:
+    """记录启动阶段耗时并汇总就绪状态"""
+
+    def __init__(self, required=('model', 'camera')):
+        self.required = tuple(required)
+        self.phases = {}
+        self.ready_at = None
+        self.lock = threading.Lock()
+
+    def record(self, name, duration, status='done', error=None):
+        """直接记录一个已完成阶段的耗时（秒）"""
+        with self.lock:
+            self.phases[name] = {
+                'status': status,
+                'duration': round(duration, 3),
+                'error': error,
+            }
+        self._check_ready()
+
+    @contextmanager
+    def phase(self, name):
+        """用 with 语句包裹一个启动阶段，自动计时并记录成功/失败"""
+        start_time = time.time()
+        with self.lock:
+            self.phases[name] = {
+                'status': 'running',
+                'started_after': round(start_time - PROCESS_START, 3),
+                'duration': None,
+                'error': None,
+            }
+        try:
+            yield
+        except Exception as e:
+            with self.lock:
+                self.phases[name].update(
+                    status='failed', duration=round(time.time() - start_time, 3), error=str(e)
+                )
+            raise
+        with self.lock:
+            self.phases[name].update(status='done', duration=round(time.time() - start_time, 3))
+        self._check_ready()
+
+    def run_in_background(self, name, func):
+        """在后台线程中执行一个启动阶段，异常只记录不抛出"""
+        def runner():
+            try:
+                with self.phase(name):
+                    func()
+            except Exception as e:
+                logging.error(f"❌ 启动阶段 {name} 失败: {e}", exc_info=True)
+
+        thread = threading.Thread(target=runner, name=f'startup-{name}', daemon=True)
+        thread.start()
+        return thread
+
+    def _check_ready(self):
+        with self.lock:
+            if self.ready_at is not None:
+                return
+            if all(self.phases.get(n, {}).get('status') == 'done' for n in self.required):
+                self.ready_at = time.time()
+                ready_after = self.ready_at - PROCESS_START
+            else:
+                return
+        logging.info(f"✅ 服务就绪，启动耗时 {ready_after:.2f}s")
+        for name, phase in self.summary()['phases'].items():
+            logging.info(f"   - {name}: {phase['duration']}s ({phase['status']})")
+
+    def readiness(self):
+        """
+        Returns:
+            str: 'ready' / 'starting' / 'failed'
+        """
+        with self.lock:
+            statuses = [self.phases.get(n, {}).get('status') for n in self.required]
+        if 'failed' in statuses:
+            return 'failed'
+        if all(s == 'done' for s in statuses):
+            return 'ready'
+        return 'starting'
+
+    def is_ready(self):
+        return self.readiness() == 'ready'
+
+    def summary(self):
+        """返回启动状态汇总（用于健康检查接口）"""
+        readiness = self.readiness()
+        with self.lock:
+            return {
+                'readiness': readiness,
+                'uptime': round(time.time() - PROCESS_START, 1),
+                'ready_after': round(self.ready_at - PROCESS_START, 3) if self.ready_at else None,
+                'phases': {name: dict(phase) for name, phase in self.phases.items()},
+            }
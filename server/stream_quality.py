@@ -0,0 +1,224 @@
+"""
+视频流分级 - 按客户端请求的尺寸/质量/帧率输出，并在客户端网络拥塞时自动降级
+同一帧的同一种规格（宽度 × JPEG质量）只编码一次，通过小型缓存在所有客户端间共享：
+十个 480p 的手机客户端只多花一次编码，而不是十次。
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+
+# 常用尺寸（按宽度限制，高度按原始比例缩放）
+SIZE_PRESETS = {
+    '1080p': 1920,
+    '720p': 1280,
+    '480p': 854,
+    '360p': 640,
+    '240p': 426,
+}
+
+# 自动降级阶梯：(最大宽度, 最大JPEG质量)，None 表示原始分辨率
+QUALITY_LADDER = [
+    (None, 95),
+    (1280, 80),
+    (854, 70),
+    (640, 60),
+    (426, 50),
+]
+
+MIN_QUALITY = 30
+MAX_FPS = 30
+
+# 发送耗时超过帧间隔的这个比例即视为拥塞
+CONGESTION_RATIO = 0.8
+# 连续拥塞多少帧后降一级
+DOWNGRADE_AFTER = 3
+# 持续通畅多少秒后尝试升一级
+UPGRADE_AFTER = 10.0
+
+
+class StreamProfile:
+    """客户端请求的视频流规格（上限），由 URL 参数解析"""
+
+    def __init__(self, width=None, quality=None, fps=None, adaptive=True, raw=False):
+        self.width = width
+        self.quality = quality
+        self.fps = fps
+        self.adaptive = adaptive
+        self.raw = raw  # 原始画面（不绘制检测框，由前端根据检测事件自行叠加）
+
+    @classmethod
+    def from_args(cls, args):
+        """
+        解析 URL 参数：size=480p|640x360|640, q=1-100, fps=1-30, adaptive=0|1, mode=raw（或 raw=1）
+
+        Raises:
+            ValueError: 参数格式错误
+        """
+        width = None
+        size = args.get('size')
+        if size:
+            if size in SIZE_PRESETS:
+                width = SIZE_PRESETS[size]
+            else:
+                width = int(size.lower().split('x')[0])
+                if width < 64:
+                    raise ValueError(f"无效的尺寸: {size}")
+
+        quality = args.get('q')
+        if quality is not None:
+            quality = min(95, max(MIN_QUALITY, int(quality)))
+
+        fps = args.get('fps')
+        if fps is not None:
+            fps = min(MAX_FPS, max(1.0, float(fps)))
+
+        adaptive = args.get('adaptive', '1') not in ('0', 'false', 'no')
+        raw = args.get('mode') == 'raw' or args.get('raw') in ('1', 'true', 'yes')
+        return cls(width, quality, fps, adaptive, raw)
+
+
+class AdaptiveStream:
+    """
+    单个客户端的自适应状态
+
+    以发送一帧的阻塞耗时衡量客户端套接字是否积压：
+    连续多帧发送耗时接近帧间隔时降一级，持续通畅一段时间后升一级（不超过请求的规格）。
+    """
+
+    def __init__(self, profile, base_quality, target_fps):
+        self.profile = profile
+        self.base_quality = base_quality
+        self.fps = min(profile.fps or target_fps, target_fps)
+        self.frame_interval = 1.0 / self.fps
+        # 请求的规格对应的起始级别（也是可升级的上限）
+        self.top_level = 0
+        if profile.width is not None:
+            while (self.top_level < len(QUALITY_LADDER) - 1
+                   and QUALITY_LADDER[self.top_level + 1][0] is not None
+                   and QUALITY_LADDER[self.top_level + 1][0] >= profile.width):
+                self.top_level += 1
+        self.level = self.top_level
+        self.congested_frames = 0
+        self.last_congestion = time.monotonic()
+        self.next_send = 0.0
+        self.downgrades = 0
+
+    def variant(self, frame_width):
+        """
+        当前应发送的规格
+
+        Returns:
+            tuple: (宽度, JPEG质量)，宽度为 None 表示不缩放
+        """
+        ladder_width, ladder_quality = QUALITY_LADDER[self.level]
+        width = self.profile.width
+        if ladder_width is not None:
+            width = min(width, ladder_width) if width else ladder_width
+        if width is not None and width >= frame_width:
+            width = None
+
+        quality = self.profile.quality or self.base_quality
+        if self.level > self.top_level:
+            quality = min(quality, ladder_quality)
+        return width, quality
+
+    def should_send(self):
+        """按客户端请求的帧率节流"""
+        now = time.monotonic()
+        if now < self.next_send:
+            return False
+        # 允许最多追赶一个帧间隔，避免帧到达抖动导致实际帧率偏低
+        self.next_send = max(self.next_send, now - self.frame_interval) + self.frame_interval
+        return True
+
+    def on_sent(self, send_duration):
+        """每发送一帧后调用，send_duration 为阻塞写出这一帧的耗时（秒）"""
+        if not self.profile.adaptive:
+            return
+        now = time.monotonic()
+        if send_duration > self.frame_interval * CONGESTION_RATIO:
+            self.congested_frames += 1
+            self.last_congestion = now
+            if self.congested_frames >= DOWNGRADE_AFTER and self.level < len(QUALITY_LADDER) - 1:
+                self.level += 1
+                self.downgrades += 1
+                self.congested_frames = 0
+        else:
+            self.congested_frames = 0
+            if self.level > self.top_level and now - self.last_congestion > UPGRADE_AFTER:
+                self.level -= 1
+                self.last_congestion = now
+
+
+class _Entry:
+    __slots__ = ('ready', 'data')
+
+    def __init__(self):
+        self.ready = threading.Event()
+        self.data = None
+
+
+class VariantCache:
+    """
+    编码规格缓存：键为 (缓冲区名, 画面ID, 宽度, 质量)
+
+    画面ID 由各缓冲区的序号生成，不同缓冲区（如标注画面和原始画面）会重复，因此键中带上缓冲区名。
+
+    同一规格被多个客户端同时请求时，只有第一个客户端编码，其余等待结果。
+    """
+
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.encodes = 0
+
+    def get(self, buffer, frame, width, quality, base_quality):
+        """
+        获取帧的指定规格编码
+
+        Args:
+            buffer: 帧所在缓冲区的名称
+            frame: frame_buffer.Frame（需带 image）
+            width: 目标宽度，None 表示原始分辨率
+            quality: JPEG质量
+            base_quality: 原始编码使用的质量（原尺寸且质量相同时直接复用原始 JPEG）
+        """
+        if frame.image is None or (width is None and quality == base_quality):
+            return frame.jpeg
+
+        key = (buffer, frame.image_id, width, quality)
+        with self._lock:
+            entry = self._entries.get(key)
+            owner = entry is None
+            if owner:
+                entry = self._entries[key] = _Entry()
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+
+        if not owner:
+            entry.ready.wait(1.0)
+            return entry.data or frame.jpeg
+
+        try:
+            image = frame.image
+            if width is not None:
+                height = int(image.shape[0] * width / image.shape[1]) & ~1
+                image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+            ret, jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            entry.data = jpeg.tobytes() if ret else frame.jpeg
+            self.encodes += 1
+        finally:
+            if entry.data is None:
+                entry.data = frame.jpeg
+            entry.ready.set()
+        return entry.data
+
+    def stats(self):
+        return {'entries': len(self._entries), 'hits': self.hits, 'encodes': self.encodes}
@@ -0,0 +1,295 @@
+"""
+能源遥测采集 - 并发轮询逆变器、BMS 和环境传感器（Modbus TCP / RTU）
+每个设备一个轮询线程，按绝对时间刻度调度（不累积漂移，超时则跳过错过的刻度），
+样本写入每个通道独立的定长环形缓冲区（array 存储，无逐样本对象开销）。
+
+设备配置默认使用内置 Modbus 模拟器；接入真实设备时用 TELEMETRY_DEVICES 指定 JSON 配置文件，格式同 DEFAULT_DEVICES。
+"""
+import json
+import logging
+import os
+import threading
+import time
+from array import array
+
+from modbus import ModbusTCPClient, ModbusRTUClient, ModbusError, ModbusSimulator, to_signed
+
+# 内置 Modbus 模拟器监听端口（未配置真实设备时启动）
+SIMULATOR_PORT = int(os.getenv('TELEMETRY_SIM_PORT', '5020'))
+# 每个通道保留的原始样本数（1 秒一个样本约 1 小时）
+RING_CAPACITY = int(os.getenv('TELEMETRY_RING_SIZE', '3600'))
+
+# 通道定义：名称 -> (单位, 说明)
+CHANNELS = {
+    'wind_power': ('kW', '风力发电功率'),
+    'solar_power': ('kW', '光伏发电功率'),
+    'total_power': ('kW', '总发电功率'),
+    'output_power': ('kW', '输出功率'),
+    'battery_level': ('%', '电池电量'),
+    'battery_voltage': ('V', '电池电压'),
+    'temperature': ('°C', '温度'),
+    'humidity': ('%', '湿度'),
+    'wind_speed': ('m/s', '风速'),
+}
+
+# 设备定义：registers 为 [通道, 寄存器地址, 缩放系数, 是否有符号]
+DEFAULT_DEVICES = [
+    {'name': 'wind_inverter', 'transport': 'tcp', 'host': '127.0.0.1', 'port': SIMULATOR_PORT,
+     'unit': 1, 'interval': 1.0, 'registers': [['wind_power', 0, 0.01, False]]},
+    {'name': 'solar_inverter', 'transport': 'tcp', 'host': '127.0.0.1', 'port': SIMULATOR_PORT,
+     'unit': 2, 'interval': 1.0, 'registers': [['solar_power', 0, 0.01, False]]},
+    {'name': 'bms', 'transport': 'tcp', 'host': '127.0.0.1', 'port': SIMULATOR_PORT,
+     'unit': 3, 'interval': 2.0, 'registers': [
+         ['battery_level', 0, 0.1, False], ['battery_voltage', 1, 0.1, False], ['output_power', 2, 0.01, False]]},
+    {'name': 'environment', 'transport': 'tcp', 'host': '127.0.0.1', 'port': SIMULATOR_PORT,
+     'unit': 4, 'interval': 5.0, 'registers': [
+         ['temperature', 0, 0.1, True], ['humidity', 1, 0.1, False], ['wind_speed', 2, 0.1, False]]},
+]
+
+# 派生通道：由其他通道计算，任一来源更新时重新计算
+DERIVED_CHANNELS = {
+    'total_power': (('wind_power', 'solar_power'), sum),
+}
+
+
+class ChannelRing:
+    """单通道定长环形缓冲区（时间戳和数值各一个 array('d')）"""
+
+    def __init__(self, capacity=RING_CAPACITY):
+        self.capacity = capacity
+        self._ts = array('d', bytes(8 * capacity))
+        self._values = array('d', bytes(8 * capacity))
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def append(self, timestamp, value):
+        with self._lock:
+            self._ts[self._next] = timestamp
+            self._values[self._next] = value
+            self._next = (self._next + 1) % self.capacity
+            if self._count < self.capacity:
+                self._count += 1
+
+    def latest(self):
+        """最新样本 (时间戳, 数值)，没有样本时返回 None"""
+        with self._lock:
+            if not self._count:
+                return None
+            i = (self._next - 1) % self.capacity
+            return self._ts[i], self._values[i]
+
+    def window(self, since=None):
+        """
+        按时间顺序返回样本
+
+        Returns:
+            tuple: (时间戳列表, 数值列表)
+        """
+        with self._lock:
+            start = (self._next - self._count) % self.capacity
+            if start + self._count <= self.capacity:
+                ts = self._ts[start:start + self._count]
+                values = self._values[start:start + self._count]
+            else:
+                ts = self._ts[start:] + self._ts[:self._next]
+                values = self._values[start:] + self._values[:self._next]
+        if since is not None:
+            # 时间戳单调递增，二分定位起点
+            lo, hi = 0, len(ts)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if ts[mid] < since:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            ts, values = ts[lo:], values[lo:]
+        return ts.tolist(), values.tolist()
+
+    def __len__(self):
+        return self._count
+
+
+class DevicePoller:
+    """单个设备的轮询线程"""
+
+    def __init__(self, config, on_sample):
+        self.config = config
+        self.name = config['name']
+        self.interval = float(config.get('interval', 1.0))
+        self.on_sample = on_sample
+        self.running = False
+        self.client = None
+        self.polls = 0
+        self.errors = 0
+        self.missed_ticks = 0
+        self.last_error = None
+        self.last_ok = None
+        self.last_latency = None
+        self.max_jitter = 0.0
+        self._jitter_sum = 0.0
+        # 一次读出覆盖所有通道的连续寄存器区间
+        addresses = [reg[1] for reg in config['registers']]
+        self.base_address = min(addresses)
+        self.register_count = max(addresses) - self.base_address + 1
+
+    def _make_client(self):
+        transport = self.config.get('transport', 'tcp')
+        timeout = float(self.config.get('timeout', min(1.0, self.interval * 0.8)))
+        if transport == 'tcp':
+            return ModbusTCPClient(self.config['host'], int(self.config.get('port', 502)), timeout)
+        if transport == 'rtu':
+            return ModbusRTUClient(self.config['port'], int(self.config.get('baudrate', 9600)), timeout)
+        raise ValueError(f"未知的传输方式: {transport}")
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._run, name=f'telemetry-{self.name}', daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while self.running:
+            now = time.monotonic()
+            if now < next_tick:
+                time.sleep(next_tick - now)
+                now = time.monotonic()
+            jitter = now - next_tick
+            self.max_jitter = max(self.max_jitter, jitter)
+            self._jitter_sum += jitter
+            # 单次轮询出错不能让采集线程退出，否则该设备之后不再有数据
+            try:
+                self.poll_once()
+            except Exception as e:
+                self.errors += 1
+                self.last_error = str(e) or type(e).__name__
+                logging.error(f"遥测设备 {self.name} 轮询出错: {e}", exc_info=True)
+            # 按绝对刻度推进；轮询超过一个周期时跳过错过的刻度，而不是连续补读
+            next_tick += self.interval
+            behind = time.monotonic() - next_tick
+            if behind > 0:
+                skipped = int(behind // self.interval) + 1
+                self.missed_ticks += skipped
+                next_tick += skipped * self.interval
+
+    def poll_once(self):
+        start = time.monotonic()
+        self.polls += 1
+        try:
+            if self.client is None:
+                self.client = self._make_client()
+            registers = self.client.read_holding_registers(
+                int(self.config.get('unit', 1)), self.base_address, self.register_count
+            )
+        except (ModbusError, ValueError) as e:
+            self.errors += 1
+            if self.last_error != str(e):
+                logging.warning(f"⚠️ 遥测设备 {self.name} 读取失败: {e}")
+            self.last_error = str(e)
+            return
+        timestamp = time.time()
+        self.last_latency = time.monotonic() - start
+        self.last_ok = timestamp
+        self.last_error = None
+        for channel, address, scale, signed in self.config['registers']:
+            raw = registers[address - self.base_address]
+            self.on_sample(channel, timestamp, round((to_signed(raw) if signed else raw) * scale, 6))
+
+    def status(self):
+        return {
+            'interval': self.interval,
+            'online': self.last_error is None and self.last_ok is not None,
+            'polls': self.polls,
+            'errors': self.errors,
+            'missed_ticks': self.missed_ticks,
+            'last_ok': self.last_ok,
+            'last_error': self.last_error,
+            'latency_ms': round(self.last_latency * 1000, 2) if self.last_latency is not None else None,
+            'avg_jitter_ms': round(self._jitter_sum / self.polls * 1000, 2) if self.polls else None,
+            'max_jitter_ms': round(self.max_jitter * 1000, 2),
+        }
+
+
+def load_device_config(path=None):
+    """读取设备配置；未指定配置文件时返回模拟器设备配置"""
+    path = path or os.getenv('TELEMETRY_DEVICES')
+    if not path:
+        return DEFAULT_DEVICES, True
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f), False
+
+
+class TelemetryService:
+    """遥测服务：管理设备轮询线程和各通道环形缓冲区"""
+
+    def __init__(self, devices=None, ring_capacity=RING_CAPACITY):
+        if devices is None:
+            devices, self.simulated = load_device_config()
+        else:
+            self.simulated = False
+        self.rings = {name: ChannelRing(ring_capacity) for name in CHANNELS}
+        self.listeners = []  # 样本回调 fn(channel, timestamp, value)
+        self.pollers = [DevicePoller(config, self._on_sample) for config in devices]
+        self.simulator = None
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def start(self):
+        if self.simulated and self.simulator is None:
+            try:
+                self.simulator = ModbusSimulator(port=SIMULATOR_PORT).start()
+            except OSError as e:
+                logging.error(f"❌ Modbus 模拟器启动失败: {e}")
+        for poller in self.pollers:
+            poller.start()
+        logging.info(f"✅ 遥测采集已启动（{len(self.pollers)} 个设备{'，模拟模式' if self.simulated else ''}）")
+
+    def stop(self):
+        for poller in self.pollers:
+            poller.stop()
+        if self.simulator is not None:
+            self.simulator.shutdown()
+
+    def _on_sample(self, channel, timestamp, value):
+        ring = self.rings.get(channel)
+        if ring is None:
+            ring = self.rings[channel] = ChannelRing()
+        ring.append(timestamp, value)
+        self._notify(channel, timestamp, value)
+
+        for derived, (sources, func) in DERIVED_CHANNELS.items():
+            if channel in sources:
+                latest = [self.rings[source].latest() for source in sources]
+                if all(latest):
+                    value = func(sample[1] for sample in latest)
+                    self.rings[derived].append(timestamp, value)
+                    self._notify(derived, timestamp, value)
+
+    def _notify(self, channel, timestamp, value):
+        for callback in self.listeners:
+            try:
+                callback(channel, timestamp, value)
+            except Exception as e:
+                logging.error(f"遥测回调出错: {e}", exc_info=True)
+
+    def latest(self):
+        """各通道最新值 {通道: {'value', 'timestamp', 'unit'}}"""
+        result = {}
+        for name, ring in self.rings.items():
+            sample = ring.latest()
+            if sample is not None:
+                result[name] = {
+                    'value': round(sample[1], 3),
+                    'timestamp': sample[0],
+                    'unit': CHANNELS.get(name, ('', ''))[0],
+                }
+        return result
+
+    def status(self):
+        return {
+            'simulated': self.simulated,
+            'devices': {poller.name: poller.status() for poller in self.pollers},
+        }
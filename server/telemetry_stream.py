@@ -0,0 +1,141 @@
+"""
+遥测增量推送（Server-Sent Events）
+采集线程只更新各通道的待发送值，推送线程按固定节拍合并成一条增量消息，
+经 EventBroadcaster 编码一次后由所有客户端共享；每个客户端只需维护一个序号。
+
+- 每个通道有最短推送间隔和死区：间隔内的新样本合并为最新值，变化小于死区的样本不推送
+- 客户端连接（包括断线重连）时先收到一条 snapshot 全量消息，之后只收 delta 增量
+- 客户端落后导致增量不连续时（历史已被覆盖），重新发送全量消息
+"""
+import threading
+import time
+
+from event_stream import EventBroadcaster, KEEPALIVE_INTERVAL, format_sse
+from telemetry import CHANNELS
+
+# 推送节拍（秒）：同一节拍内所有通道的变化合并为一条消息
+TICK_INTERVAL = 0.25
+# 各通道 (最短推送间隔秒, 死区)
+CHANNEL_RATES = {
+    'wind_power': (1.0, 0.01),
+    'solar_power': (1.0, 0.01),
+    'total_power': (1.0, 0.01),
+    'output_power': (1.0, 0.01),
+    'battery_level': (5.0, 0.1),
+    'battery_voltage': (5.0, 0.05),
+    'temperature': (5.0, 0.1),
+    'humidity': (5.0, 0.5),
+    'wind_speed': (2.0, 0.1),
+}
+DEFAULT_RATE = (1.0, 0.0)
+
+
+class TelemetryDeltaStream:
+    """
+    遥测增量广播
+
+    on_sample() 作为 TelemetryService 的监听回调；消息格式:
+    - snapshot: {"t": 时间戳, "c": {通道: 值}, "u": {通道: 单位}}
+    - delta: {"t": 时间戳, "c": {变化的通道: 值}}
+    """
+
+    def __init__(self, rates=CHANNEL_RATES, tick=TICK_INTERVAL):
+        self.rates = rates
+        self.tick = tick
+        self.events = EventBroadcaster('delta', history=64)
+        self._pending = {}  # 通道 -> 尚未推送的最新值
+        self._sent = {}     # 通道 -> [已推送的值, 推送时刻(monotonic)]
+        self._lock = threading.Lock()
+        self._snapshot = None  # (序号, 编码后的全量消息)，同一序号的全量消息所有客户端共用
+        self._thread = None
+        self.deltas = 0
+        self.snapshots = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='telemetry-stream', daemon=True)
+        self._thread.start()
+
+    def on_sample(self, channel, timestamp, value):
+        with self._lock:
+            self._pending[channel] = value
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while True:
+            next_tick += self.tick
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.monotonic()
+            self.flush(time.monotonic())
+
+    def flush(self, now):
+        """把满足推送间隔和死区的通道合并为一条增量消息发布，返回发布的通道数"""
+        with self._lock:
+            changes = {}
+            for channel, value in list(self._pending.items()):
+                interval, deadband = self.rates.get(channel, DEFAULT_RATE)
+                sent = self._sent.get(channel)
+                if sent is not None:
+                    if now - sent[1] < interval:
+                        continue  # 间隔未到，保留最新值待下次推送
+                    if abs(value - sent[0]) < deadband:
+                        del self._pending[channel]
+                        continue
+                changes[channel] = round(value, 3)
+                self._sent[channel] = [value, now]
+                del self._pending[channel]
+            if changes:
+                # 在锁内发布，保证全量消息与增量序号一致
+                self.events.publish({'t': round(time.time(), 3), 'c': changes})
+                self.deltas += 1
+        return len(changes)
+
+    def snapshot(self):
+        """
+        当前全量状态（对应最新增量序号）
+
+        Returns:
+            tuple: (序号, 编码后的 snapshot 消息)
+        """
+        with self._lock:
+            seq = self.events.last_seq
+            if self._snapshot is None or self._snapshot[0] != seq:
+                data = {
+                    't': round(time.time(), 3),
+                    'c': {channel: round(sent[0], 3) for channel, sent in self._sent.items()},
+                    'u': {channel: CHANNELS.get(channel, ('', ''))[0] for channel in self._sent},
+                }
+                self._snapshot = (seq, format_sse(data, 'snapshot', seq))
+                self.snapshots += 1
+            return self._snapshot
+
+    def sse_stream(self):
+        """生成 SSE 字节流（线程式服务器使用）：先发全量，再发增量"""
+        yield b'retry: 2000\n\n'
+        seq, payload = self.snapshot()
+        yield payload
+        while True:
+            items = self.events.wait_since(seq, KEEPALIVE_INTERVAL)
+            if not items:
+                yield b': keepalive\n\n'
+                continue
+            if items[0][0] > seq + 1:
+                # 落后太多，中间的增量已不在历史中
+                seq, payload = self.snapshot()
+                yield payload
+                continue
+            for item_seq, _, payload in items:
+                seq = item_seq
+                yield payload
+
+    def status(self):
+        return {
+            'seq': self.events.last_seq,
+            'channels': len(self._sent),
+            'deltas': self.deltas,
+            'snapshots': self.snapshots,
+        }
@@ -0,0 +1,280 @@
+"""
+遥测时序存储 - SQLite（WAL 模式），原始样本 + 多级汇总
+- raw：原始样本，只保留最近一段时间（默认 24 小时）
+- rollup：1 分钟 / 15 分钟 / 1 小时三级汇总（最小、最大、合计、样本数），写入原始样本时同步累加
+
+查询按时间范围和图表像素宽度选择最合适的精度，再用 LTTB 降采样到像素宽度，
+查询一个月的数据和查询一分钟的数据返回的点数相同。
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from queue import SimpleQueue, Empty
+
+TIMESERIES_DB = os.getenv(
+    'TIMESERIES_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'telemetry.db')
+)
+# 各精度保留时长（秒）；None 为永久保留
+RAW_RETENTION = float(os.getenv('TIMESERIES_RAW_HOURS', '24')) * 3600
+ROLLUPS = {
+    60: 30 * 86400,      # 1 分钟汇总保留 30 天
+    900: 365 * 86400,    # 15 分钟汇总保留 1 年
+    3600: None,          # 1 小时汇总永久保留
+}
+# 每批最多写入的样本数 / 最长攒批时间（秒）
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 1.0
+# 选择精度时，原始点数不超过像素宽度的这个倍数（再由 LTTB 降到像素宽度）
+OVERSAMPLE = 4
+MAX_WIDTH = 4000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS raw (
+    channel TEXT NOT NULL,
+    ts REAL NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_raw_channel_ts ON raw (channel, ts);
+CREATE TABLE IF NOT EXISTS rollup (
+    resolution INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    sum REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (resolution, channel, bucket)
+) WITHOUT ROWID;
+"""
+
+ROLLUP_UPSERT = """
+INSERT INTO rollup (resolution, channel, bucket, min, max, sum, count)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (resolution, channel, bucket) DO UPDATE SET
+    min = MIN(min, excluded.min),
+    max = MAX(max, excluded.max),
+    sum = sum + excluded.sum,
+    count = count + excluded.count
+"""
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+def lttb(points, threshold):
+    """
+    Largest-Triangle-Three-Buckets 降采样
+
+    保留首尾点，其余每个桶选取与前一个选中点、下一个桶均值构成三角形面积最大的点，
+    折线形状（峰谷）在目标像素宽度下基本不失真。
+
+    Args:
+        points: [(x, y), ...]，x 递增
+        threshold: 目标点数
+
+    Returns:
+        list: 选中点在 points 中的下标
+    """
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    selected = [0]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # 下一个桶的均值点
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        if next_start >= next_end:
+            next_start, next_end = n - 1, n
+        count = next_end - next_start
+        avg_x = sum(points[j][0] for j in range(next_start, next_end)) / count
+        avg_y = sum(points[j][1] for j in range(next_start, next_end)) / count
+
+        # 当前桶中面积最大的点
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        ax, ay = points[a]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        selected.append(best)
+        a = best
+    selected.append(n - 1)
+    return selected
+
+
+class TimeSeriesStore:
+    """遥测时序存储：add() 非阻塞入队，后台线程批量写入原始样本并累加各级汇总"""
+
+    def __init__(self, path=TIMESERIES_DB):
+        self.path = path
+        self._queue = SimpleQueue()
+        self._local = threading.local()
+        self._thread = None
+        self.written = 0
+        self.last_error = None
+
+        conn = _connect(path)
+        with conn:
+            conn.executescript(SCHEMA)
+        conn.close()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='timeseries', daemon=True)
+        self._thread.start()
+        logging.info(f"✅ 遥测时序存储已启动: {self.path}")
+
+    def add(self, channel, timestamp, value):
+        """写入一个样本（可直接作为 TelemetryService 的监听回调）"""
+        self._queue.put((channel, timestamp, value))
+
+    # --- 写入 ---
+
+    def _run(self):
+        conn = _connect(self.path)
+        last_prune = 0.0
+        while True:
+            batch = self._next_batch()
+            if batch:
+                try:
+                    self._write(conn, batch)
+                except sqlite3.Error as e:
+                    self.last_error = str(e)
+                    logging.error(f"写入遥测数据失败: {e}")
+            now = time.time()
+            if now - last_prune > 600:
+                last_prune = now
+                self._prune(conn, now)
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=FLUSH_INTERVAL)]
+        except Empty:
+            return []
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        while len(batch) < BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except Empty:
+                break
+        return batch
+
+    def _write(self, conn, batch):
+        rollups = {}
+        for channel, ts, value in batch:
+            for resolution in ROLLUPS:
+                key = (resolution, channel, int(ts // resolution) * resolution)
+                agg = rollups.get(key)
+                if agg is None:
+                    rollups[key] = [value, value, value, 1]
+                else:
+                    agg[0] = min(agg[0], value)
+                    agg[1] = max(agg[1], value)
+                    agg[2] += value
+                    agg[3] += 1
+        with conn:
+            conn.executemany('INSERT INTO raw (channel, ts, value) VALUES (?, ?, ?)', batch)
+            conn.executemany(ROLLUP_UPSERT, [key + tuple(agg) for key, agg in rollups.items()])
+        self.written += len(batch)
+
+    def _prune(self, conn, now):
+        try:
+            with conn:
+                conn.execute('DELETE FROM raw WHERE ts < ?', (now - RAW_RETENTION,))
+                for resolution, retention in ROLLUPS.items():
+                    if retention is not None:
+                        conn.execute('DELETE FROM rollup WHERE resolution = ? AND bucket < ?',
+                                     (resolution, now - retention))
+        except sqlite3.Error as e:
+            logging.error(f"清理遥测数据失败: {e}")
+
+    # --- 查询 ---
+
+    def _reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = _connect(self.path)
+        return conn
+
+    def _choose_resolution(self, conn, channel, from_ts, to_ts, width):
+        """选择点数不超过 width * OVERSAMPLE 的最细精度（0 表示原始样本）"""
+        budget = width * OVERSAMPLE
+        if from_ts >= time.time() - RAW_RETENTION:
+            count = conn.execute(
+                'SELECT COUNT(*) FROM raw WHERE channel = ? AND ts >= ? AND ts <= ?',
+                (channel, from_ts, to_ts)
+            ).fetchone()[0]
+            if count <= budget:
+                return 0
+        now = time.time()
+        for resolution, retention in sorted(ROLLUPS.items()):
+            covers = retention is None or from_ts >= now - retention
+            if covers and (to_ts - from_ts) / resolution <= budget:
+                return resolution
+        return max(ROLLUPS)
+
+    def query(self, channel, from_ts, to_ts, width=600):
+        """
+        查询降采样后的时序数据
+
+        Args:
+            width: 图表像素宽度（返回点数上限）
+
+        Returns:
+            dict: {'resolution': 秒（0 为原始样本）, 'points': [[ts, value], ...],
+                   'min': [...], 'max': [...]}（min/max 仅汇总数据提供，与 points 一一对应）
+        """
+        width = max(3, min(MAX_WIDTH, int(width)))
+        conn = self._reader()
+        resolution = self._choose_resolution(conn, channel, from_ts, to_ts, width)
+        if resolution == 0:
+            rows = conn.execute(
+                'SELECT ts, value FROM raw WHERE channel = ? AND ts >= ? AND ts <= ? ORDER BY ts',
+                (channel, from_ts, to_ts)
+            ).fetchall()
+            points = rows
+            mins = maxs = None
+        else:
+            rows = conn.execute(
+                'SELECT bucket, min, max, sum / count FROM rollup '
+                'WHERE resolution = ? AND channel = ? AND bucket >= ? AND bucket <= ? ORDER BY bucket',
+                (resolution, channel, int(from_ts // resolution) * resolution, to_ts)
+            ).fetchall()
+            # 汇总点放在桶的中点
+            points = [(row[0] + resolution / 2, row[3]) for row in rows]
+            mins = [row[1] for row in rows]
+            maxs = [row[2] for row in rows]
+
+        indices = lttb(points, width)
+        result = {
+            'resolution': resolution,
+            'points': [[round(points[i][0], 3), round(points[i][1], 4)] for i in indices],
+        }
+        if mins is not None:
+            result['min'] = [round(mins[i], 4) for i in indices]
+            result['max'] = [round(maxs[i], 4) for i in indices]
+        return result
+
+    def status(self):
+        return {
+            'path': self.path,
+            'pending': self._queue.qsize(),
+            'written': self.written,
+            'last_error': self.last_error,
+        }
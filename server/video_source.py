@@ -0,0 +1,280 @@
+"""
+视频源 - 本地摄像头之外的输入：视频文件、网络流（RTSP / HTTP）、图片目录
+非本地摄像头的视频源由独立的解码线程持续读取，采集线程只取缓冲区中的帧：
+
+- 网络流：解码线程持续消费码流（不读会在 FFmpeg 内部积压，画面越来越滞后），只保留最新帧；
+  断流后按指数退避自动重连
+- 文件 / 图片目录：pace=realtime 按原始帧率回放（采集跟不上时丢旧帧，与实时摄像头一致），
+  pace=fast 不限速且不丢帧（消费方读一帧解码线程才继续，用于测试和复现）；loop 控制播完是否从头循环
+
+对外接口与 cv2.VideoCapture 相同（isOpened / read / get / set / release），采集代码无需区分来源；
+read() 取到的帧的解码时刻（time.monotonic()）记录在 frame_time，用于统计帧在缓冲区中等待的时间。
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import cv2
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+# 图片目录没有帧率信息，默认按这个帧率回放
+DEFAULT_IMAGE_FPS = 10.0
+# 实时模式下缓冲的最新帧数（1 即只保留最新一帧）
+LATEST_FRAMES = 1
+# read() 等待下一帧的最长时间（秒）
+READ_TIMEOUT = 1.0
+# 网络流重连退避（秒）
+MIN_RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 30.0
+PACES = ('realtime', 'fast')
+
+
+def parse_source(value):
+    """
+    解析视频源：摄像头索引、rtsp/http(s) 地址、file:// 或本地路径（视频文件或图片目录）
+
+    Returns:
+        tuple: (类型 'device' / 'network' / 'file' / 'images', 索引或地址)
+
+    Raises:
+        ValueError: 无法识别的视频源
+    """
+    if isinstance(value, int):
+        return 'device', value
+    value = str(value).strip()
+    if value.isdigit():
+        return 'device', int(value)
+    if value.split('://', 1)[0].lower() in ('rtsp', 'rtsps', 'rtmp', 'http', 'https'):
+        return 'network', value
+    path = value[len('file://'):] if value.startswith('file://') else value
+    if os.path.isdir(path):
+        return 'images', path
+    if os.path.isfile(path):
+        return 'file', path
+    raise ValueError(f"无法识别的视频源: {value}")
+
+
+def describe_source(source):
+    """日志和状态中显示的视频源（隐藏网络地址中的账号密码）"""
+    if isinstance(source, str) and '@' in source and '://' in source:
+        scheme, rest = source.split('://', 1)
+        return f"{scheme}://***@{rest.split('@', 1)[1]}"
+    return str(source)
+
+
+class ImageSequenceCapture:
+    """按文件名顺序读取目录中的图片（接口同 cv2.VideoCapture 的子集）"""
+
+    def __init__(self, directory, fps=DEFAULT_IMAGE_FPS):
+        self.files = sorted(
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        self.fps = fps
+        self.position = 0
+
+    def isOpened(self):
+        return bool(self.files)
+
+    def read(self):
+        while self.position < len(self.files):
+            frame = cv2.imread(self.files[self.position])
+            self.position += 1
+            if frame is not None:
+                return True, frame
+        return False, None
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return len(self.files)
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return self.position * 1000.0 / self.fps
+        return 0.0
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            self.position = int(value)
+            return True
+        return False
+
+    def release(self):
+        self.files = []
+
+
+class ThreadedSource:
+    """
+    带解码线程的视频源
+
+    Args:
+        kind: 'network' / 'file' / 'images'（由 parse_source 得到）
+        pace: 'realtime' 按原始帧率（网络流总是实时），'fast' 不限速不丢帧
+        loop: 文件 / 图片目录播完后是否从头循环
+    """
+
+    def __init__(self, kind, uri, pace='realtime', loop=True, fps=None):
+        if pace not in PACES:
+            raise ValueError(f"未知的回放速度: {pace}")
+        self.kind = kind
+        self.uri = uri
+        self.pace = 'realtime' if kind == 'network' else pace
+        self.loop = loop
+        self.fps = fps
+        self.frame_rate = fps  # 实际回放帧率（打开后从文件读取）
+        self._frames = deque(maxlen=LATEST_FRAMES)  # (帧, 解码时刻)
+        self.frame_time = None  # 最近一次 read() 取到的帧的解码时刻
+        self._cond = threading.Condition()
+        self._running = True
+        self.connected = False
+        self.ended = False
+        self.decoded = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self.last_error = None
+        self._thread = threading.Thread(target=self._run, name=f'source-{kind}', daemon=True)
+        self._thread.start()
+
+    @property
+    def unpaced(self):
+        """不限速回放：采集线程不应再按目标帧率限速"""
+        return self.pace == 'fast'
+
+    # --- 解码线程 ---
+
+    def _open(self):
+        if self.kind == 'images':
+            return ImageSequenceCapture(self.uri, self.fps or DEFAULT_IMAGE_FPS)
+        if self.kind == 'network':
+            cap = cv2.VideoCapture(self.uri, cv2.CAP_FFMPEG)
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            return cap
+        return cv2.VideoCapture(self.uri)
+
+    def _run(self):
+        delay = MIN_RECONNECT_DELAY
+        while self._running:
+            cap = self._open()
+            if not cap.isOpened():
+                cap.release()
+                if self.kind != 'network':
+                    self.last_error = f"无法打开: {describe_source(self.uri)}"
+                    logging.error(f"❌ {self.last_error}")
+                    break
+                self.last_error = '连接失败'
+                self._wait_reconnect(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                continue
+            with self._cond:
+                self.connected = True
+                self._cond.notify_all()
+            delay = MIN_RECONNECT_DELAY
+            try:
+                finished = self._decode(cap)
+            finally:
+                cap.release()
+                self.connected = False
+            if finished:
+                break
+            # 网络流断开：退避后重连
+            self.last_error = '码流中断'
+            logging.warning(f"⚠️ 视频源 {describe_source(self.uri)} 中断，{delay:.0f} 秒后重连")
+            self._wait_reconnect(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+        with self._cond:
+            self.ended = True
+            self._cond.notify_all()
+
+    def wait_ready(self, timeout=5.0):
+        """等待首次连接（或打开失败），返回是否已连接"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.connected or self.ended, timeout)
+        return self.connected
+
+    def _wait_reconnect(self, delay):
+        self.reconnects += 1
+        with self._cond:
+            self._cond.wait_for(lambda: not self._running, timeout=delay)
+
+    def _decode(self, cap):
+        """持续解码直到出错或播完；返回 True 表示不再需要重连（文件播完且不循环、或已关闭）"""
+        fps = self.fps or cap.get(cv2.CAP_PROP_FPS) or 25.0
+        self.frame_rate = fps
+        interval = 1.0 / fps
+        next_due = time.monotonic()
+        while self._running:
+            ok, frame = cap.read()
+            if not ok:
+                if self.kind == 'network':
+                    return False
+                if not self.loop:
+                    return True
+                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ok, frame = cap.read()
+                if not ok:
+                    return True
+            self.decoded += 1
+            if self.pace == 'realtime' and self.kind != 'network':
+                # 按绝对时刻排帧，解码耗时不累积；落后超过一帧时直接追上
+                next_due += interval
+                delay = next_due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                elif delay < -interval:
+                    next_due = time.monotonic()
+            with self._cond:
+                if self.pace == 'fast':
+                    # 不丢帧：等消费方取走上一帧
+                    self._cond.wait_for(lambda: len(self._frames) < self._frames.maxlen or not self._running)
+                elif len(self._frames) == self._frames.maxlen:
+                    self.dropped += 1
+                self._frames.append((frame, time.monotonic()))
+                self._cond.notify_all()
+        return True
+
+    # --- 采集线程接口（同 cv2.VideoCapture）---
+
+    def isOpened(self):
+        """已连接（网络流重连期间为 False）；文件播完且缓冲区取空后为 False"""
+        return self._running and (self.connected or bool(self._frames))
+
+    def read(self, timeout=READ_TIMEOUT):
+        """取下一帧，最多等待 timeout 秒"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._frames or self.ended or not self._running, timeout)
+            if not self._frames:
+                return False, None
+            frame, self.frame_time = self._frames.popleft()
+            self._cond.notify_all()
+            return True, frame
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.frame_rate or 0.0
+        return 0.0
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        with self._cond:
+            self._running = False
+            self._frames.clear()
+            self._cond.notify_all()
+        self._thread.join(timeout=2.0)
+
+    def status(self):
+        return {
+            'type': self.kind,
+            'source': describe_source(self.uri),
+            'pace': self.pace,
+            'loop': self.loop,
+            'connected': self.connected,
+            'ended': self.ended,
+            'decoded': self.decoded,
+            'dropped': self.dropped,
+            'reconnects': self.reconnects,
+            'last_error': self.last_error,
+        }